@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', '/tmp/pyppdisbot-audio')
+
+# Total bytes of audio kept on disk
+AUDIO_CACHE_BYTES = int(os.getenv('AUDIO_CACHE_BYTES', 2 * 1024 ** 3))
+
+# Tracks are downloaded once they have been played this many times
+CACHE_AFTER_PLAYS = int(os.getenv('CACHE_AFTER_PLAYS', 3))
+
+# Play counts kept for tracks that aren't cached yet; the least recently played are forgotten
+MAX_PLAY_COUNTS = int(os.getenv('AUDIO_CACHE_PLAY_COUNTS', 10000))
+
+# Downloads running at once
+MAX_DOWNLOADS = 2
+
+
+def _file_key(track_id):
+    # Non-YouTube track IDs are page URLs; make them safe as file names
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in track_id)[:200]
+
+
+# On-disk cache of frequently played tracks. Files are written to a temporary
+# directory and renamed into place, so a half-finished download is never served.
+# Eviction removes the least played, then least recently played, files first.
+class AudioCache:
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_BYTES, cache_after=CACHE_AFTER_PLAYS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.cache_after = cache_after
+        self._files = {}  # file key -> [path, size, plays, last_played]
+        self._plays = OrderedDict()  # file key -> plays of tracks not cached yet, least recent first
+        self._downloading = {}  # file key -> task
+        self._semaphore = asyncio.Semaphore(MAX_DOWNLOADS)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._scan()
+
+    # Rebuild the index from whatever is already on disk
+    def _scan(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not os.path.isfile(path):
+                if name.startswith('.download-'):
+                    shutil.rmtree(path, ignore_errors=True)  # Left over from a crash
+                continue
+            stat = os.stat(path)
+            key = name.rsplit('.', 1)[0]
+            self._files[key] = [path, stat.st_size, 0, stat.st_mtime]
+            self.total_bytes += stat.st_size
+        self._evict()
+
+    # Local file for a track, or None
+    def lookup(self, track_id):
+        entry = self._files.get(_file_key(track_id))
+        if entry is None or not os.path.exists(entry[0]):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    # Count a play; schedules a background download once the track is popular enough
+    def record_play(self, track_id, webpage_url):
+        key = _file_key(track_id)
+        entry = self._files.get(key)
+        if entry is not None:
+            entry[2] += 1
+            entry[3] = time.time()
+            return
+        plays = self._plays[key] = self._plays.get(key, 0) + 1
+        self._plays.move_to_end(key)
+        while len(self._plays) > MAX_PLAY_COUNTS:
+            self._plays.popitem(last=False)
+        if plays >= self.cache_after:
+            self.store(track_id, webpage_url)
+
+    # Download a track into the cache in the background (no-op if cached or in progress)
+    def store(self, track_id, webpage_url):
+        key = _file_key(track_id)
+        if key in self._files or key in self._downloading:
+            return None
+        task = asyncio.ensure_future(self._download(key, webpage_url))
+        self._downloading[key] = task
+        task.add_done_callback(lambda t: self._downloading.pop(key, None))
+        return task
+
+    async def _download(self, key, webpage_url):
+        async with self._semaphore:
+            try:
+                path = await asyncio.to_thread(self._download_file, key, webpage_url)
+            except Exception as e:
+                logging.error(f"Audio cache download failed for {webpage_url}: {e}")
+                return None
+        size = os.path.getsize(path)
+        self._files[key] = [path, size, self._plays.pop(key, 0), time.time()]
+        self.total_bytes += size
+        logging.info(f"Cached audio for {webpage_url} ({size} bytes)")
+        self._evict()
+        return path
+
+    def _download_file(self, key, webpage_url):
+        tmp_dir = tempfile.mkdtemp(prefix='.download-', dir=self.directory)
+        try:
+            ydl_opts = {
+                'format': 'bestaudio',
+                'quiet': True,
+                'no_warnings': True,
+                'outtmpl': os.path.join(tmp_dir, f"{key}.%(ext)s"),
+            }
+            from yt_dlp import YoutubeDL  # Loaded on first use; slow to import at startup
+            with YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(webpage_url, download=True)
+                downloaded = ydl.prepare_filename(info)
+            path = os.path.join(self.directory, os.path.basename(downloaded))
+            os.replace(downloaded, path)  # Atomic within the cache directory
+            return path
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        # Least played first, then least recently played
+        for key in sorted(self._files, key=lambda k: (self._files[k][2], self._files[k][3])):
+            if self.total_bytes <= self.max_bytes:
+                break
+            path, size, _, _ = self._files.pop(key)
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            logging.info(f"Evicted cached audio {path}")
+
+    def stats(self):
+        return {
+            'files': len(self._files),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'downloading': len(self._downloading),
+        }
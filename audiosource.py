@@ -0,0 +1,50 @@
+import os
+import weakref
+
+import discord
+
+# Send Opus streams to Discord as-is instead of decoding and re-encoding them; 0 disables
+OPUS_PASSTHROUGH = os.getenv('OPUS_PASSTHROUGH', '1') != '0'
+
+# Local file extensions that hold Opus audio (YouTube's webm audio formats are all Opus)
+OPUS_EXTENSIONS = ('.webm', '.opus', '.ogg')
+
+# Every FFmpeg source made here, for counting live ffmpeg processes
+_sources = weakref.WeakSet()
+
+
+# Whether a source can be passed through: the extractor says the codec is Opus,
+# or (for files without extractor info) the extension implies it
+def is_opus(location, codec=None):
+    if codec:
+        return codec == 'opus'
+    return '://' not in location and location.lower().endswith(OPUS_EXTENSIONS)
+
+
+# FFmpeg audio source for a stream URL or local file. Opus input is copied straight
+# into Ogg packets for the voice client, so neither ffmpeg nor discord.py touches the
+# samples. Anything that needs the samples (volume, filters) or isn't Opus is decoded
+# to PCM and re-encoded by discord.py as before.
+def make_source(location, codec=None, before_options=None, options=None, volume=None, filters=None):
+    if filters:
+        options = f"{options or ''} -af {filters}".strip()
+
+    if OPUS_PASSTHROUGH and volume is None and not filters and is_opus(location, codec):
+        source = discord.FFmpegOpusAudio(location, codec='copy', before_options=before_options, options=options)
+        _sources.add(source)
+        return source
+
+    source = discord.FFmpegPCMAudio(location, before_options=before_options, options=options)
+    _sources.add(source)
+    if volume is not None:
+        source = discord.PCMVolumeTransformer(source, volume)
+    return source
+
+
+def live_ffmpeg_processes():
+    count = 0
+    for source in list(_sources):
+        process = getattr(source, '_process', None)
+        if process is not None and process.poll() is None:
+            count += 1
+    return count
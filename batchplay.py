@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+from collections import deque
+
+from searchindex import is_search_query
+from updates import updates
+
+# Most URLs one play command queues
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 50))
+
+# URLs of a batch resolved at once; their extractions also share the extraction backend's workers
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 4))
+
+# Largest attached URL list that is read (bytes)
+BATCH_ATTACHMENT_BYTES = 64 * 1024
+
+# Longest summary message (Discord allows 2000 characters)
+SUMMARY_CHARS = 1900
+
+
+# URLs or searches in a play command's text: one per line, or several URLs on one line
+# separated by spaces or commas. A single line that isn't all URLs is one search.
+def parse_batch(text):
+    lines = [line.strip() for line in text.splitlines()]
+    lines = [line for line in lines if line and not line.startswith('#')]
+    if len(lines) == 1:
+        tokens = lines[0].replace(',', ' ').split()
+        if len(tokens) > 1 and not any(is_search_query(token) for token in tokens):
+            return tokens
+    return lines
+
+def _is_text_file(attachment):
+    return attachment.filename.lower().endswith('.txt') or (attachment.content_type or '').startswith('text/')
+
+# Everything a play command asks for, in order: its text, then each attached text file.
+# Returns the items and how many were dropped over BATCH_MAX_ITEMS.
+async def batch_items(text, attachments=()):
+    items = parse_batch(text or '')
+    for attachment in attachments:
+        if attachment is None or not _is_text_file(attachment):
+            continue
+        if attachment.size > BATCH_ATTACHMENT_BYTES:
+            logging.error(f"Ignoring attached URL list {attachment.filename}: {attachment.size} bytes")
+            continue
+        items += parse_batch((await attachment.read()).decode('utf-8', errors='replace'))
+    return items[:BATCH_MAX_ITEMS], max(0, len(items) - BATCH_MAX_ITEMS)
+
+
+# Queues several URLs from one command. Up to `workers` are resolved at once, but each is
+# queued only after every URL before it, so the queue keeps the user's order. Progress
+# goes to one summary message, edited through the update scheduler as URLs finish.
+#   resolve(item) is awaited off the queue and returns whatever enqueue needs.
+#   enqueue(item, resolved) queues it and returns a line for the summary, or None if
+#   nothing was found.
+class Batch:
+    def __init__(self, items, resolve, enqueue, dropped=0, workers=BATCH_WORKERS):
+        self.items = items
+        self.resolve = resolve
+        self.enqueue = enqueue
+        self.dropped = dropped
+        self.workers = workers
+        self.lines = [None] * len(items)  # Summary line per item once it has finished
+        self.queued = 0
+        self.failed = 0
+        self.message = None  # Set by the caller once the summary has been sent
+        self._first_queued = asyncio.Event()
+        self._task = None
+
+    def render(self):
+        finished = self.queued + self.failed
+        if finished < len(self.items):
+            header = f"Queueing {len(self.items)} URLs: {finished} done"
+        else:
+            header = f"Queued {self.queued} of {len(self.items)} URLs"
+        if self.failed:
+            header += f", {self.failed} failed"
+        if self.dropped:
+            header += f" ({self.dropped} more ignored, the limit is {BATCH_MAX_ITEMS})"
+        lines = [header]
+        length = len(header)
+        for index, line in enumerate(self.lines):
+            line = f"{index + 1}. {line or '…'}"
+            if length + len(line) + 1 > SUMMARY_CHARS:
+                lines.append(f"…and {len(self.lines) - index} more")
+                break
+            lines.append(line)
+            length += len(line) + 1
+        return '\n'.join(lines)
+
+    def _refresh(self):
+        if self.message is not None:
+            updates.edit_message(self.message, content=self.render())
+
+    # Resolve and queue every item, then leave the final summary
+    async def run(self):
+        items = iter(enumerate(self.items))
+        pending = deque()
+
+        def schedule_next():
+            index, item = next(items, (None, None))
+            if index is not None:
+                pending.append((index, item, asyncio.ensure_future(self.resolve(item))))
+
+        for _ in range(max(1, self.workers)):
+            schedule_next()
+        try:
+            while pending:
+                index, item, task = pending.popleft()
+                schedule_next()
+                try:
+                    line = await self.enqueue(item, await task)
+                except Exception as e:
+                    logging.error(f"Batch item {item} failed: {e}")
+                    line = None
+                if line is None:
+                    self.failed += 1
+                    self.lines[index] = f"{item}: nothing found"
+                else:
+                    self.queued += 1
+                    self.lines[index] = line
+                    self._first_queued.set()
+                self._refresh()
+        finally:
+            for _, _, task in pending:
+                task.cancel()
+            self._first_queued.set()
+
+    def start(self):
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    # Wait until something has been queued (so playback can start) or the batch is over
+    async def first_queued(self):
+        await self._first_queued.wait()
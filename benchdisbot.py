@@ -0,0 +1,686 @@
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import discord
+
+import pydisbot3
+import ytextract
+from streamcache import stream_cache
+from sessions import SessionRegistry
+from trackqueue import Track, TrackQueue
+from journal import SessionJournal, track_from_record
+from audiosource import make_source
+from gapless import ChainedSource
+from benchharness import FakeApi, FakeChannel, FakeFFmpegSource, FakeGuild, FakeYoutubeDL
+from searchindex import SearchIndex
+from playlistfeed import QueueFeed, PLAYLIST_PAGE_SIZE
+from timerwheel import TimerWheel
+from retrypolicy import BREAKER_FAILURES, CircuitOpen, RetryPolicy
+from voiceidle import IdleDisconnect, VoiceConnections
+
+# Simulated extractor latency per track (seconds)
+STUB_LATENCY = 0.05
+PLAYLIST_SIZE = 100
+
+# Stub for fetch_single_stream_url that sleeps instead of hitting YouTube
+async def stub_fetch_single_stream_url(url):
+    await asyncio.sleep(STUB_LATENCY * random.uniform(0.5, 1.5))
+    video_id = url.rsplit('=', 1)[-1]
+    return Track(video_id, title=f"Track {video_id}", uploader='Stub', duration=180,
+                 stream_url=f"https://stub.invalid/{video_id}")
+
+# Time-to-first-audio and throughput for playlist resolution
+async def bench_playlist_resolution(workers):
+    original = pydisbot3.fetch_single_stream_url
+    pydisbot3.fetch_single_stream_url = stub_fetch_single_stream_url
+    entries = [{'id': str(i)} for i in range(PLAYLIST_SIZE)]
+    start = time.perf_counter()
+    first = None
+
+    async def on_resolved(song):
+        nonlocal first
+        if first is None:
+            first = time.perf_counter() - start
+
+    try:
+        resolved = await pydisbot3.resolve_playlist_entries(entries, on_resolved, workers=workers)
+    finally:
+        pydisbot3.fetch_single_stream_url = original
+    total = time.perf_counter() - start
+    return {
+        'workers': workers,
+        'time_to_first_audio': round(first, 4),
+        'total': round(total, 4),
+        'tracks_per_second': round(resolved / total, 1),
+    }
+
+# YoutubeDL stand-in that counts constructions and extractor calls
+class CountingYoutubeDL:
+    constructed = 0
+    extractions = 0
+
+    def __init__(self, params=None):
+        CountingYoutubeDL.constructed += 1
+
+    def extract_info(self, url, download=False, process=True):
+        CountingYoutubeDL.extractions += 1
+        video_id = url.rsplit('=', 1)[-1]
+        return {'id': video_id, 'url': f"https://stub.invalid/{video_id}", 'title': f"Track {video_id}"}
+
+    def close(self):
+        pass
+
+# YoutubeDL constructions and extractor calls per single-video /play
+async def bench_calls_per_play(plays=10):
+    original = ytextract.YoutubeDL
+    ytextract.YoutubeDL = CountingYoutubeDL
+    ytextract.ydl_pool.close()
+    stream_cache.clear()
+    CountingYoutubeDL.constructed = CountingYoutubeDL.extractions = 0
+
+    async def on_resolved(song):
+        pass
+
+    try:
+        for i in range(plays):
+            await pydisbot3.fetch_stream_urls(f"https://www.youtube.com/watch?v=video{i}", on_resolved)
+    finally:
+        ytextract.YoutubeDL = original
+        ytextract.ydl_pool.close()
+        stream_cache.clear()
+    return {
+        'plays': plays,
+        'constructions_per_play': CountingYoutubeDL.constructed / plays,
+        'extractions_per_play': CountingYoutubeDL.extractions / plays,
+        'baseline_per_play': 3,  # detect_playlist + fetch_stream_urls + fetch_single_stream_url
+    }
+
+# Cost of building a YoutubeDL per call versus borrowing one from the pool
+def bench_ydl_construction(iterations=200):
+    from yt_dlp import YoutubeDL
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with YoutubeDL(dict(ytextract.PROFILES['audio'])):
+            pass
+    fresh = (time.perf_counter() - start) / iterations
+
+    pool = ytextract.YoutubeDLPool()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with pool.acquire('audio'):
+            pass
+    pooled = (time.perf_counter() - start) / iterations
+    pool.close()
+    return {'fresh_ms': round(fresh * 1000, 3), 'pooled_ms': round(pooled * 1000, 3)}
+
+# Many guilds queueing and playing at once, each through its own session
+async def bench_guild_sessions(guilds=5000, tracks=20):
+    registry = SessionRegistry()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    async def drive(guild_id):
+        session = registry.get(guild_id)
+        for i in range(tracks):
+            session.queue.append(Track(f"{guild_id}-{i}"))
+            await asyncio.sleep(0)
+        while session.queue:
+            session.history.append(session.queue.popleft())
+            await asyncio.sleep(0)
+        # No other guild's songs may leak into this session
+        assert all(track.id.startswith(f"{guild_id}-") for track in session.history)
+
+    await asyncio.gather(*(drive(guild_id) for guild_id in range(guilds)))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    evicted = registry.evict_idle(now=time.monotonic() + registry.idle_timeout)
+    return {
+        'guilds': guilds,
+        'operations_per_second': round(guilds * tracks * 2 / elapsed),
+        'peak_kib_per_guild': round(peak / guilds / 1024, 2),
+        'evicted': evicted,
+    }
+
+# Memory per queued track: slim Track records in a TrackQueue versus yt-dlp-style dicts in a list
+def bench_queue_memory(tracks):
+    uploaders = [f"Channel {i}" for i in range(50)]
+
+    def measure(build):
+        tracemalloc.start()
+        queue = build()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del queue
+        return round(size / tracks)
+
+    def build_tracks():
+        queue = TrackQueue()
+        for i in range(tracks):
+            queue.append(Track.from_info({
+                'webpage_url': f"https://www.youtube.com/watch?v={i:011d}",
+                'url': f"https://rr1.googlevideo.com/videoplayback?id={i}&expire=1700000000",
+                'title': f"Song number {i}",
+                'uploader': uploaders[i % 50],
+                'duration': 180,
+            }))
+        return queue
+
+    def build_dicts():
+        return [{
+            'url': f"https://rr1.googlevideo.com/videoplayback?id={i}&expire=1700000000",
+            'webpage_url': f"https://www.youtube.com/watch?v={i:011d}",
+            'title': f"Song number {i}",
+            'uploader': f"{uploaders[i % 50]}",
+            'duration': 180,
+            'views': 1000,
+            'upload_date': '20240101',
+        } for i in range(tracks)]
+
+    return {'tracks': tracks, 'track_bytes': measure(build_tracks), 'dict_bytes': measure(build_dicts)}
+
+# Startup restore from a journal snapshot plus a tail of journaled mutations
+def bench_journal_restore(guilds=1000, tracks=500, tail_records=5000):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.journal')
+        registry = SessionRegistry()
+        journal = SessionJournal(path, compact_every=10 ** 9)
+        journal.open(registry)
+        for guild_id in range(guilds):
+            session = registry.get(guild_id)
+            session.queue.extend(Track(f"{guild_id:05d}{i:06d}", f"Song {i}", "Uploader", 200) for i in range(tracks))
+        journal.compact()
+        for i in range(tail_records):
+            journal.record(i % guilds, 'advance', started_at=time.time())
+        # One more guild plays its whole queue out; a restart must not replay its last track
+        finished = guilds
+        journal.record(finished, 'extend', tracks=[Track('a', 'A', None, 100), Track('b', 'B', None, 100)])
+        journal.record(finished, 'advance', started_at=time.time())
+        journal.record(finished, 'advance', started_at=time.time())
+        journal.record(finished, 'clear')
+        journal.close()
+
+        start = time.perf_counter()
+        restored = SessionJournal(path).load()
+        load_time = time.perf_counter() - start
+
+        # Sessions are rebuilt lazily; time one guild's restore as it would happen on first use
+        start = time.perf_counter()
+        queue = TrackQueue(track_from_record(record) for record in restored[0]['queue'])
+        first_guild = time.perf_counter() - start
+        return {
+            'guilds': len(restored),
+            'finished_guild_restored': finished in restored,
+            'tracks_per_guild': len(queue),
+            'load_seconds': round(load_time, 3),
+            'first_guild_ms': round(first_guild * 1000, 2),
+        }
+
+# CPU seconds (ours plus ffmpeg's) to produce every Opus frame of a source, as the voice client would
+def _stream_cpu(source, encoder):
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.process_time()
+    frames = 0
+    while True:
+        data = source.read()
+        if not data:
+            break
+        if encoder is not None and not source.is_opus():
+            encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+        frames += 1
+    source.cleanup()
+    own = time.process_time() - started
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    ffmpeg = (after.ru_utime - children.ru_utime) + (after.ru_stime - children.ru_stime)
+    return frames, own + ffmpeg
+
+# Opus passthrough against decode + re-encode for one stream of `seconds` audio
+def bench_opus_passthrough(seconds=60):
+    if shutil.which('ffmpeg') is None:
+        return {'opus_passthrough': 'skipped, ffmpeg not found'}
+    if not discord.opus.is_loaded():
+        try:
+            discord.opus._load_default()
+        except Exception:
+            pass
+    encoder = discord.opus.Encoder() if discord.opus.is_loaded() else None
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'tone.webm')
+        subprocess.run(
+            ['ffmpeg', '-loglevel', 'error', '-f', 'lavfi', '-i', f"sine=frequency=440:duration={seconds}",
+             '-ac', '2', '-ar', '48000', '-c:a', 'libopus', '-b:a', '128k', path],
+            check=True,
+        )
+        frames, passthrough = _stream_cpu(make_source(path), encoder)
+        _, transcode = _stream_cpu(make_source(path, volume=1.0), encoder)
+
+    minutes = seconds / 60
+    return {
+        'frames': frames,
+        'passthrough_cpu_s_per_min': round(passthrough / minutes, 3),
+        'transcode_cpu_s_per_min': round(transcode / minutes, 3),
+        'encoder_included': encoder is not None,
+    }
+
+# Silence between tracks: a fresh source started after the last one ends, against a chained one
+async def bench_gapless_handover(tracks=5, frames=100, startup=0.3, frame_interval=0.005):
+    loop = asyncio.get_running_loop()
+    remaining = tracks - 1
+    intervals = []
+    handovers = []
+
+    async def prepare_next():
+        nonlocal remaining
+        if not remaining:
+            return None
+        remaining -= 1
+        return FakeFFmpegSource(frames, startup), Track('next', duration=frames * 0.02)
+
+    # Emulates the voice client's player thread, faster than real time
+    def player(source):
+        last = None
+        while True:
+            data = source.read()
+            now = time.perf_counter()
+            if not data:
+                break
+            if last is not None:
+                intervals.append(now - last - frame_interval)
+            last = now
+            time.sleep(frame_interval)
+        source.cleanup()
+
+    # Durations are short enough that every track is prepared as soon as it starts
+    chain = ChainedSource(FakeFFmpegSource(frames, startup), frames * 0.02, prepare_next,
+                          lambda track, gap: handovers.append(gap), loop=loop)
+    await asyncio.to_thread(player, chain)
+    await asyncio.sleep(0)  # Let the last handover callback run
+
+    cold = time.perf_counter()
+    FakeFFmpegSource(1, startup).read()
+    cold = time.perf_counter() - cold
+    return {
+        'handovers': len(handovers),
+        'max_handover_ms': round(max(handovers, default=0) * 1000, 2),
+        'worst_frame_delay_ms': round(max(intervals, default=0) * 1000, 2),
+        'cold_start_gap_ms': round(cold * 1000, 1),
+    }
+
+# Idle-disconnect timers for many guilds: a sleeping task per guild (the old polling
+# pattern) versus one timer wheel. Each guild re-arms its timer on every track change.
+async def bench_idle_timers(guilds=10000, rearms=5, tick=0.01):
+    async def sleeper():
+        await asyncio.sleep(3600)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    tasks = []
+    for _ in range(rearms):
+        for task in tasks:
+            task.cancel()
+        tasks = [asyncio.ensure_future(sleeper()) for _ in range(guilds)]
+        await asyncio.sleep(0)
+    task_seconds = time.perf_counter() - start
+    _, task_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    wheel = TimerWheel(tick=tick)
+    fired = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    timers = []
+    for _ in range(rearms):
+        for timer in timers:
+            timer.cancel()
+        timers = [wheel.schedule(tick * 100, fired.append, time.perf_counter()) for _ in range(guilds)]
+        await asyncio.sleep(0)
+    wheel_seconds = time.perf_counter() - start
+    _, wheel_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    while len(wheel):
+        await asyncio.sleep(tick)
+    return {
+        'guilds': guilds,
+        'task_rearm_us': round(task_seconds / guilds / rearms * 1e6, 2),
+        'wheel_rearm_us': round(wheel_seconds / guilds / rearms * 1e6, 2),
+        'task_peak_bytes_per_guild': round(task_peak / guilds),
+        'wheel_peak_bytes_per_guild': round(wheel_peak / guilds),
+        'fired': len(fired),
+        'cancelled': wheel.cancelled,
+    }
+
+# Repeated text searches through the local search index versus searching every time.
+# Queries follow a skewed popularity, some with different casing/punctuation and some
+# with a typo, and every result is played (feeding the title index).
+async def bench_search_index(searches=2000, distinct=200, latency=0.01, titles=10000):
+    rng = random.Random(0)
+    words = ['love', 'night', 'summer', 'dance', 'heart', 'fire', 'dream', 'rain', 'blue', 'city',
+             'light', 'river', 'gold', 'wild', 'moon', 'road', 'home', 'star', 'storm', 'echo']
+    queries = [' '.join(rng.sample(words, 4)) for _ in range(distinct)]
+    path = os.path.join(tempfile.mkdtemp(prefix='bench-search-'), 'index.json')
+    index = SearchIndex(path=path)
+    remote = 0
+    saved_latency, FakeYoutubeDL.latency = FakeYoutubeDL.latency, latency
+    start = time.perf_counter()
+    try:
+        for _ in range(searches):
+            query = queries[min(int(rng.paretovariate(1.2)) - 1, distinct - 1)]
+            roll = rng.random()
+            if roll < 0.2:
+                query = query.upper() + '!'
+            elif roll < 0.3:
+                position = rng.randrange(len(query))
+                query = query[:position] + query[position + 1:]
+            track = index.lookup(query)
+            if track is None:
+                remote += 1
+                ydl = FakeYoutubeDL({'extract_flat': True})
+                info = await asyncio.to_thread(ydl.extract_info, f"ytsearch1:{query}")
+                track = Track.from_info(info['entries'][0])
+                index.put(query, track)
+            index.record_play(track)
+    finally:
+        FakeYoutubeDL.latency = saved_latency
+    elapsed = time.perf_counter() - start
+
+    # Lookup cost once the title index is full: a fuzzy miss is the slowest path
+    for i in range(titles):
+        index.record_play(Track(f"title{i:06d}", title=' '.join(rng.sample(words, 5)) + f" {i}"))
+    index.lookup('warm up the title index')
+    lookup_start = time.perf_counter()
+    for i in range(1000):
+        index.lookup(f"{' '.join(rng.sample(words, 3))} unheard {i}")
+    lookup_us = (time.perf_counter() - lookup_start) / 1000 * 1e6
+    await index.flush()
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    return {
+        'searches': searches,
+        'remote_searches': remote,
+        'remote_searches_without_index': searches,
+        'search_ms_mean': round(elapsed / searches * 1000, 2),
+        'search_ms_mean_without_index': round(latency * 1000, 2),
+        'miss_lookup_us_with_10k_titles': round(lookup_us, 1),
+        **{key: value for key, value in index.stats().items() if key.endswith('hits')},
+    }
+
+# Queueing a very large playlist all at once versus a page at a time: time until the
+# first tracks are queued (the command's reply) and memory held, then playing through
+# the queue with the feed topping it up, counting the times it ran dry.
+async def bench_playlist_paging(size=5000, entry_latency=0.0002, page_size=PLAYLIST_PAGE_SIZE, plays=300,
+                                track_seconds=0.01):
+    async def fetch_page(url, items):
+        ydl = FakeYoutubeDL({'extract_flat': True, 'playlist_items': items})
+        return await asyncio.to_thread(ydl.extract_info, url)
+
+    url = 'https://www.youtube.com/playlist?list=benchpaging'
+    saved = FakeYoutubeDL.playlist_size, FakeYoutubeDL.entry_latency
+    FakeYoutubeDL.playlist_size, FakeYoutubeDL.entry_latency = size, entry_latency
+    results = {'playlist_size': size, 'page_size': page_size}
+    try:
+        for name, pages in (('eager', size), ('paged', page_size)):
+            feed = QueueFeed(TrackQueue(), fetch_page=fetch_page, page_size=pages)
+            tracemalloc.start()
+            start = time.perf_counter()
+            await feed.add_playlist(url)
+            results[f"{name}_first_reply_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            results[f"{name}_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+
+            dry = 0
+            for _ in range(plays):
+                if not feed.queue:
+                    dry += 1
+                    await feed.fill()
+                feed.queue.popleft()
+                feed.refill()
+                await asyncio.sleep(track_seconds)  # Tracks play (very) fast; pages land meanwhile
+            results[f"{name}_queue_ran_dry"] = dry
+            results[f"{name}_pages_for_{plays}_plays"] = feed.pages
+            feed.clear()
+    finally:
+        FakeYoutubeDL.playlist_size, FakeYoutubeDL.entry_latency = saved
+    return results
+
+# Extraction tail latency under throttling, and extractor load during an outage, with the
+# old fixed retries (3 attempts, 5 s apart) versus the retry policy. Latencies are of the
+# requests that succeeded; requests shed by an open breaker and requests that failed
+# are counted apart. Every duration, including the fake extractor's latency, is scaled
+# by `scale` (1 s of real time -> scale).
+async def bench_retry_policy(requests=300, throttled=0.3, scale=0.02):
+    async def fixed_retries(url, call, retries=3, delay=5 * scale):
+        for attempt in range(retries):
+            try:
+                return await call()
+            except Exception as e:
+                if not ytextract.is_extraction_error(e) or attempt == retries - 1:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def with_policy(policy):
+        async def run(url, call):
+            result, _ = await policy.run(url, call)
+            return result
+        return run
+
+    def fresh_policy(breaker_failures=BREAKER_FAILURES):
+        return RetryPolicy(base_delay=0.5 * scale, max_delay=8 * scale, deadline=30 * scale,
+                           breaker_failures=breaker_failures, breaker_reset=30 * scale)
+
+    async def trial(name, retrying, failure_rate, spacing):
+        FakeYoutubeDL.reset()
+        FakeYoutubeDL.failure_rate = failure_rate
+        latencies, failed, shed = [], 0, 0
+
+        async def request(i):
+            nonlocal failed, shed
+            await asyncio.sleep(i * spacing)
+            url = f"https://www.youtube.com/watch?v={name}{failure_rate}{i:06d}"
+            started = time.perf_counter()
+            try:
+                await retrying(url, lambda: asyncio.to_thread(FakeYoutubeDL().extract_info, url))
+            except CircuitOpen:
+                shed += 1
+            except Exception as e:
+                if not (ytextract.is_extraction_error(e) or isinstance(e, asyncio.TimeoutError)):
+                    raise
+                failed += 1
+            else:
+                latencies.append((time.perf_counter() - started) / scale)
+
+        await asyncio.gather(*(request(i) for i in range(requests)))
+        latencies.sort()
+        result = {'succeeded': len(latencies), 'failed': failed, 'shed': shed,
+                  'extractor_calls': FakeYoutubeDL.calls}
+        if latencies:
+            result.update(p50_s=round(latencies[len(latencies) // 2], 2),
+                          p99_s=round(latencies[int(len(latencies) * 0.99)], 2),
+                          max_s=round(latencies[-1], 2))
+        return result
+
+    saved = FakeYoutubeDL.latency, FakeYoutubeDL.failure_rate
+    FakeYoutubeDL.latency = scale
+    results = {'requests': requests}
+    try:
+        # Throttling: a share of attempts fail; two requests arrive per second. The policy's
+        # breaker never opens here, so only the backoff is compared.
+        results['throttled_fixed'] = await trial('tf', fixed_retries, throttled, 0.5 * scale)
+        results['throttled_policy'] = await trial(
+            'tp', await with_policy(fresh_policy(breaker_failures=requests * 4)), throttled, 0.5 * scale)
+        # The same throttling with the default breaker, which opens on a run of failures
+        results['throttled_policy_breaker'] = await trial('tb', await with_policy(fresh_policy()), throttled,
+                                                          0.5 * scale)
+        # Outage: every attempt fails; ten requests arrive per second
+        results['outage_fixed'] = await trial('of', fixed_retries, 1.0, 0.1 * scale)
+        results['outage_policy'] = await trial('op', await with_policy(fresh_policy()), 1.0, 0.1 * scale)
+    finally:
+        FakeYoutubeDL.latency, FakeYoutubeDL.failure_rate = saved
+    return results
+
+# pyppdisbot's 'search' profile ignores errors, so a failed extraction comes back as None.
+# Each None must count as a failure: retried, and seen by the extractor's breaker.
+async def bench_empty_extractions(attempts=3, scale=0.001):
+    import pyppdisbot
+    calls = 0
+
+    async def extract_nothing(url, profile='audio', items=None):
+        nonlocal calls
+        calls += 1
+        return None
+
+    policy = RetryPolicy(attempts=attempts, base_delay=scale, max_delay=scale, breaker_failures=attempts)
+    saved = pyppdisbot.extract, pyppdisbot.retry_policy
+    pyppdisbot.extract, pyppdisbot.retry_policy = extract_nothing, policy
+    try:
+        await pyppdisbot.extract_info_with_retries('https://www.youtube.com/watch?v=empty')
+        raised = None
+    except Exception as e:
+        raised = type(e).__name__
+    finally:
+        pyppdisbot.extract, pyppdisbot.retry_policy = saved
+    return {'raised': raised, 'extractor_calls': calls, 'retries': policy.retries,
+            'breaker': policy.stats()['breakers']['youtube.com']}
+
+# Cold start of each bot in a fresh interpreter: wall time, the import phase as the bot
+# records it, and whether yt-dlp was loaded. Then how many command-tree syncs three
+# connects (a start and two reconnects) cost, with the tree unchanged from the last run.
+async def bench_cold_start(runs=3):
+    import startup
+    here = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp(prefix='bench-start-')
+    with open(os.path.join(workdir, 'bot_config.json'), 'w') as config_file:
+        config_file.write('{}')  # ppdisbot reads it from the working directory
+    env = dict(os.environ, PYTHONPATH=here, LOG_FILE=os.path.join(workdir, 'bot.log'))
+    probe = ("import startup, sys, json; import {bot}; "
+             "print(json.dumps([startup.phases()['imports'], 'yt_dlp' in sys.modules]))")
+    results = {}
+    for bot in ('pyppdisbot', 'pydisbot3', 'ppdisbot'):
+        walls, imports = [], []
+        for _ in range(runs):
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', probe.format(bot=bot)], cwd=workdir, env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            walls.append(time.perf_counter() - started)
+            seconds, loaded = json.loads(output.strip().splitlines()[-1])
+            imports.append(seconds)
+        results[bot] = {'process_ms': round(sorted(walls)[runs // 2] * 1000),
+                        'imports_ms': round(sorted(imports)[runs // 2] * 1000), 'yt_dlp_loaded': loaded}
+
+    syncs = 0
+
+    async def counting_sync(**kwargs):
+        nonlocal syncs
+        syncs += 1
+
+    saved_sync, pydisbot3.bot.tree.sync = pydisbot3.bot.tree.sync, counting_sync
+    path = os.path.join(workdir, 'commands.json')
+    try:
+        await startup.sync_commands(pydisbot3.bot, path=path)  # The previous run's sync
+        syncs = 0
+        startup._synced.clear()  # A new process
+        for _ in range(3):
+            await startup.sync_commands(pydisbot3.bot, path=path)
+    finally:
+        pydisbot3.bot.tree.sync = saved_sync
+        shutil.rmtree(workdir, ignore_errors=True)
+    results['tree_syncs_for_3_connects'] = syncs
+    results['tree_syncs_for_3_connects_before'] = 3
+    return results
+
+# Time from /play to a usable voice connection over play/stop cycles, with some plays
+# from a second channel: disconnecting on stop and reconnecting on play (as before)
+# versus the warm connection manager. Handshake and move latencies are scaled by `scale`.
+async def bench_voice_reuse(plays=40, other_channel=0.3, handshake=1.0, move=0.1, scale=0.05):
+    class Bot:
+        user = None
+
+        def __init__(self, guild):
+            self.guild = guild
+
+        def add_listener(self, listener, name):
+            pass
+
+        def get_guild(self, guild_id):
+            return self.guild
+
+    async def cycles(connect, stop):
+        rng = random.Random(0)
+        waits = []
+        for _ in range(plays):
+            channel = channels[1] if rng.random() < other_channel else channels[0]
+            started = time.perf_counter()
+            voice_client = await connect(channel)
+            waits.append((time.perf_counter() - started) / scale)
+            voice_client.play(FakeFFmpegSource(5, startup=0))
+            await asyncio.sleep(0.001)
+            await stop()
+        waits.sort()
+        return {'connect_ms_mean': round(sum(waits) / len(waits) * 1000),
+                'connect_ms_p95': round(waits[int(len(waits) * 0.95)] * 1000),
+                'handshakes': api.calls.get('voice_connect', 0)}
+
+    saved = FakeChannel.handshake_latency, FakeChannel.move_latency
+    FakeChannel.handshake_latency, FakeChannel.move_latency = handshake * scale, move * scale
+    results = {'plays': plays}
+    try:
+        api, guild = FakeApi(), FakeGuild(1)
+        channels = [FakeChannel(api, guild, 1000), FakeChannel(api, guild, 1000)]
+
+        async def connect_each_time(channel):
+            return await channel.connect()
+
+        async def disconnect():
+            await guild.voice_client.disconnect()
+
+        results['reconnect'] = await cycles(connect_each_time, disconnect)
+
+        api, guild = FakeApi(), FakeGuild(1)
+        channels = [FakeChannel(api, guild, 1000), FakeChannel(api, guild, 1000)]
+        idle = IdleDisconnect(Bot(guild), wheel=TimerWheel())
+        connections = VoiceConnections(idle)
+
+        async def release():
+            connections.release(guild)
+
+        results['warm'] = await cycles(connections.connect, release)
+        results['warm'].update({'moves': connections.counts['move'], 'reuses': connections.counts['reuse']})
+        idle.forget(guild.id)
+    finally:
+        FakeChannel.handshake_latency, FakeChannel.move_latency = saved
+    return results
+
+async def main():
+    random.seed(0)
+    for workers in (1, 4, 8, 16):
+        print(await bench_playlist_resolution(workers))
+    print(await bench_calls_per_play())
+    print(bench_ydl_construction())
+    print(await bench_guild_sessions())
+    for tracks in (10000, 100000):
+        print(bench_queue_memory(tracks))
+    print(bench_journal_restore())
+    print(bench_opus_passthrough())
+    print(await bench_gapless_handover())
+    print(await bench_idle_timers())
+    print(await bench_search_index())
+    print(await bench_playlist_paging())
+    print(await bench_retry_policy())
+    print(await bench_empty_extractions())
+    print(await bench_cold_start())
+    print(await bench_voice_reuse())
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,555 @@
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+
+from docopt import docopt
+import discord
+from yt_dlp.utils import DownloadError
+
+import ytextract
+import trackqueue
+from streamcache import stream_cache
+from updates import updates
+from loopwatch import LoopWatchdog
+
+doc = """
+Offline end-to-end benchmark: drives the real play handlers of all three bots against
+a simulated extractor and voice client, and appends the results to a JSON lines file.
+Exits with status 1 if any handler blocked the event loop for longer than --block-threshold.
+
+Usage:
+  benchharness.py [--tracks=<n>] [--latency=<s>] [--failure-rate=<r>] [--speed=<x>] [--block-threshold=<s>] [--results=<path>]
+  benchharness.py (-h | --help)
+
+Options:
+  -h --help              Show this screen.
+  --tracks=<n>           Tracks played per scenario [default: 20].
+  --latency=<s>          Mean simulated extraction latency in seconds [default: 0.05].
+  --failure-rate=<r>     Fraction of extractions that fail [default: 0].
+  --speed=<x>            How many times faster than real time audio plays [default: 10].
+  --block-threshold=<s>  Longest the event loop may be blocked, in seconds [default: 0.1].
+  --results=<path>       File results are appended to [default: /tmp/ppdisbot-bench.jsonl].
+"""
+
+FRAME_SECONDS = 0.02
+
+# Time a simulated ffmpeg source takes to produce its first frame (process start, TLS, probing)
+FFMPEG_STARTUP = 0.1
+
+# A frame arriving this many frame periods late counts as an audible gap
+GAP_FRAMES = 3
+
+
+# Deterministic stand-in for yt_dlp.YoutubeDL. Latency and failures are derived from
+# a hash of the URL and how often it was asked for, so runs don't depend on thread timing.
+class FakeYoutubeDL:
+    latency = 0.05
+    failure_rate = 0.0
+    playlist_size = 20
+    entry_latency = 0.0
+    track_seconds = 3.0
+    calls = 0
+    _lock = threading.Lock()
+    _attempts = {}
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    @classmethod
+    def reset(cls):
+        cls.calls = 0
+        cls._attempts = {}
+
+    def _roll(self, url):
+        with FakeYoutubeDL._lock:
+            FakeYoutubeDL.calls += 1
+            attempt = FakeYoutubeDL._attempts[url] = FakeYoutubeDL._attempts.get(url, 0) + 1
+        digest = zlib.crc32(f"{url}#{attempt}".encode())
+        return (digest & 0xffff) / 0xffff, (digest >> 16) / 0xffff
+
+    @staticmethod
+    def video(video_id):
+        return {
+            'id': video_id,
+            'url': f"https://stub.invalid/{video_id}.webm",
+            'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+            'title': f"Track {video_id}",
+            'uploader': 'Bench',
+            'duration': FakeYoutubeDL.track_seconds,
+            'acodec': 'opus',
+            'extractor': 'youtube',
+        }
+
+    def extract_info(self, url, download=False, process=True):
+        latency_roll, failure_roll = self._roll(url)
+        time.sleep(FakeYoutubeDL.latency * (0.5 + latency_roll))
+        if failure_roll < FakeYoutubeDL.failure_rate:
+            raise DownloadError(f"Simulated extraction failure for {url}")
+        if 'list=' in url:
+            entries = []
+            first, last = 1, FakeYoutubeDL.playlist_size
+            if self.params.get('playlist_items'):
+                start, _, stop = self.params['playlist_items'].partition('-')
+                first, last = int(start), min(last, int(stop or last))
+            # Listing a page costs time per entry, like walking the playlist's API pages
+            time.sleep(FakeYoutubeDL.entry_latency * max(0, last - first + 1))
+            for i in range(first - 1, last):
+                video_id = f"bench{i:06d}"
+                if self.params.get('extract_flat'):
+                    entries.append({'id': video_id, 'url': f"https://www.youtube.com/watch?v={video_id}",
+                                    'title': f"Track {video_id}", 'duration': FakeYoutubeDL.track_seconds})
+                else:
+                    entries.append(self.video(video_id))
+            return {'id': 'benchlist', 'title': 'Bench playlist', 'entries': entries,
+                    'playlist_count': FakeYoutubeDL.playlist_size}
+        if url.startswith('ytsearch'):
+            # One flat result whose title is the query, under an ID derived from it
+            query = url.split(':', 1)[1]
+            video_id = f"search{zlib.crc32(query.lower().encode()):010d}"
+            return {'id': query, 'title': query, 'entries': [{
+                'id': video_id, 'url': f"https://www.youtube.com/watch?v={video_id}",
+                'title': query.title(), 'duration': FakeYoutubeDL.track_seconds}]}
+        return self.video(url.rsplit('=', 1)[-1])
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Stands in for an FFmpeg source: the first read pays for process start and stream probing
+class FakeFFmpegSource(discord.AudioSource):
+    def __init__(self, frames, startup=FFMPEG_STARTUP):
+        self.frames = frames
+        self.startup = startup
+        self.started = False
+
+    def read(self):
+        if not self.started:
+            time.sleep(self.startup)
+            self.started = True
+        if not self.frames:
+            return b''
+        self.frames -= 1
+        return b'\0' * discord.opus.Encoder.FRAME_SIZE
+
+    def is_opus(self):
+        return False
+
+def fake_make_source(location, codec=None, **kwargs):
+    return FakeFFmpegSource(int(FakeYoutubeDL.track_seconds / FRAME_SECONDS))
+
+
+# Counts every Discord API call the bots make
+class FakeApi:
+    def __init__(self):
+        self.calls = {}
+        self._ids = 1000
+
+    def count(self, route):
+        self.calls[route] = self.calls.get(route, 0) + 1
+
+    def next_id(self):
+        self._ids += 1
+        return self._ids
+
+    def total(self):
+        return sum(self.calls.values())
+
+    async def change_presence(self, **fields):
+        self.count('change_presence')
+
+
+class FakeMessage:
+    def __init__(self, api, channel):
+        self.api = api
+        self.channel = channel
+        self.id = api.next_id()
+
+    async def edit(self, **fields):
+        self.api.count('edit_message')
+        return self
+
+
+class FakeMember:
+    def __init__(self, member_id, channel):
+        self.id = member_id
+        self.voice = discord.Object(id=member_id)
+        self.voice.channel = channel
+
+
+# Voice client that reads its source on a thread at `speed` times real time, like discord.py's
+# AudioPlayer, and records when audio starts and every stall between frames
+class FakeVoiceClient:
+    def __init__(self, guild, channel, speed):
+        self.guild = guild
+        self.channel = channel
+        self.speed = speed
+        self._connected = True
+        self._player = None
+        self._end = None
+        self._paused = False
+        self.first_frame_at = None
+        self.last_frame_at = None
+        self.gaps = []
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._player is not None and self._player.is_alive() and not self._paused
+
+    def is_paused(self):
+        return self._paused
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def play(self, source, *, after=None, **kwargs):
+        if self._player is not None and self._player.is_alive():
+            raise discord.ClientException('Already playing audio.')
+        self._end = threading.Event()
+        self._player = threading.Thread(target=self._run, args=(source, after, self._end), daemon=True)
+        self._player.start()
+
+    def _run(self, source, after, end):
+        period = FRAME_SECONDS / self.speed
+        started = time.perf_counter()
+        frames = 0
+        while not end.is_set():
+            data = source.read()
+            if not data:
+                break
+            now = time.perf_counter()
+            if self.first_frame_at is None:
+                self.first_frame_at = now
+            elif self.last_frame_at is not None and now - self.last_frame_at > period * GAP_FRAMES:
+                self.gaps.append(now - self.last_frame_at - period)
+            self.last_frame_at = now
+            frames += 1
+            time.sleep(max(0.0, started + frames * period - time.perf_counter()))
+        if after is not None:
+            after(None)
+        source.cleanup()
+
+    def stop(self):
+        if self._end is not None:
+            self._end.set()
+        self.last_frame_at = None  # A skip isn't a gap
+
+    async def move_to(self, channel):
+        await asyncio.sleep(FakeChannel.move_latency)
+        self.channel = channel
+
+    async def disconnect(self, force=False):
+        self.stop()
+        self._connected = False
+        self.guild.voice_client = None
+
+
+class FakeChannel:
+    handshake_latency = 0.0  # A new voice connection (websocket, UDP discovery); off unless benchmarked
+    move_latency = 0.0
+
+    def __init__(self, api, guild, speed):
+        self.api = api
+        self.guild = guild
+        self.speed = speed
+        self.id = api.next_id()
+        self.members = []
+        self.voice_clients = []  # Every voice client created, for measurements after disconnects
+
+    async def send(self, content=None, **fields):
+        self.api.count('send_message')
+        return FakeMessage(self.api, self)
+
+    async def connect(self, **kwargs):
+        self.api.count('voice_connect')
+        await asyncio.sleep(FakeChannel.handshake_latency)
+        if self.guild.voice_client is None:
+            self.guild.voice_client = FakeVoiceClient(self.guild, self, self.speed)
+            self.voice_clients.append(self.guild.voice_client)
+        return self.guild.voice_client
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.voice_client = None
+
+
+# Enough of commands.Context for the prefix commands
+class FakeContext:
+    def __init__(self, guild, channel, author):
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.message = discord.Object(id=channel.api.next_id())
+        self.message.guild = guild
+        self.message.attachments = []
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def send(self, content=None, **fields):
+        return await self.channel.send(content, **fields)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, **kwargs):
+        self.interaction.api.count('interaction_defer')
+        self._done = True
+
+    async def send_message(self, content=None, **fields):
+        self.interaction.api.count('interaction_response')
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **fields):
+        self.interaction.api.count('followup_send')
+        return FakeMessage(self.interaction.api, self.interaction.channel)
+
+
+# Enough of discord.Interaction for the slash commands
+class FakeInteraction:
+    def __init__(self, guild, channel, user):
+        self.api = channel.api
+        self.guild = guild
+        self.channel = channel
+        self.user = user
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# Runs one bot's scenario with everything external swapped for fakes, and measures it
+class Harness:
+    def __init__(self, tracks, speed):
+        self.tracks = tracks
+        self.speed = speed
+        self.api = FakeApi()
+        self.guild = FakeGuild(4242)
+        self.channel = FakeChannel(self.api, self.guild, speed)
+        self.member = FakeMember(7, self.channel)
+        self.ingested = 0
+
+    async def run(self, scenario, idle):
+        original_append = trackqueue.TrackQueue.append
+
+        def counting_append(queue, track):
+            self.ingested += 1
+            original_append(queue, track)
+
+        trackqueue.TrackQueue.append = counting_append
+        tracemalloc.start()
+        started = time.perf_counter()
+        ingest_done = None
+        try:
+            commands = await scenario(self)
+            deadline = started + 60 + self.tracks * (FakeYoutubeDL.track_seconds / self.speed + 5)
+            while time.perf_counter() < deadline:
+                if ingest_done is None and self.ingested >= self.tracks:
+                    ingest_done = time.perf_counter()
+                if idle() and (self.guild.voice_client is None or not self.guild.voice_client.is_playing()):
+                    break
+                await asyncio.sleep(0.005)
+            finished = time.perf_counter()
+            await asyncio.sleep(max(updates.message_interval, updates.presence_interval))  # Let coalesced updates flush
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            trackqueue.TrackQueue.append = original_append
+
+        voice_clients = self.channel.voice_clients
+        first_frame = min((vc.first_frame_at for vc in voice_clients if vc.first_frame_at), default=None)
+        gaps = [gap for vc in voice_clients for gap in vc.gaps]
+        ingest_seconds = (ingest_done or finished) - started
+        return {
+            'commands': commands,
+            'tracks_ingested': self.ingested,
+            'time_to_first_audio_ms': round((first_frame - started) * 1000, 1) if first_frame else None,
+            'ingest_tracks_per_s': round(self.ingested / ingest_seconds, 1) if ingest_seconds > 0 else None,
+            'gap_count': len(gaps),
+            'gap_mean_ms': round(sum(gaps) / len(gaps) * 1000, 1) if gaps else 0.0,
+            'gap_p95_ms': round(_percentile(gaps, 0.95) * 1000, 1),
+            'gap_max_ms': round(max(gaps, default=0.0) * 1000, 1),
+            'extractions': FakeYoutubeDL.calls,
+            'api_calls': dict(sorted(self.api.calls.items())),
+            'api_calls_per_command': round(self.api.total() / max(1, commands), 1),
+            'peak_memory_kb': round(peak / 1024),
+            'wall_seconds': round(finished - started, 2),
+        }
+
+
+def playlist_url():
+    return "https://www.youtube.com/playlist?list=PLbench"
+
+def video_url(i):
+    return f"https://www.youtube.com/watch?v=bench{i:06d}"
+
+# &play <playlist> on pyppdisbot
+async def scenario_pyppdisbot(harness):
+    import pyppdisbot
+    await pyppdisbot.play.callback(FakeContext(harness.guild, harness.channel, harness.member), url=playlist_url())
+    return 1
+
+# /play <playlist> on pydisbot3
+async def scenario_pydisbot3(harness):
+    import pydisbot3
+    await pydisbot3.play.callback(FakeInteraction(harness.guild, harness.channel, harness.member), playlist_url())
+    return 1
+
+# One /play with every track's URL on ppdisbot, which has no playlist support
+async def scenario_ppdisbot(harness):
+    import ppdisbot
+    urls = ' '.join(video_url(i) for i in range(harness.tracks))
+    await ppdisbot.play.callback(FakeInteraction(harness.guild, harness.channel, harness.member), urls)
+    return 1
+
+def _import_ppdisbot():
+    # ppdisbot reads bot_config.json from the working directory at import time
+    cwd = os.getcwd()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # Still importable after the chdir
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'bot_config.json'), 'w') as config_file:
+            config_file.write('{}')
+        os.chdir(directory)
+        try:
+            import ppdisbot
+        finally:
+            os.chdir(cwd)
+    return ppdisbot
+
+async def run_all(tracks, speed, block_threshold):
+    import pyppdisbot
+    import pydisbot3
+    ppdisbot = _import_ppdisbot()
+
+    ytextract.YoutubeDL = FakeYoutubeDL
+    ytextract.ydl_pool.close()
+    ytextract.extraction_backend = ytextract.ExtractionBackend('thread')  # Fakes don't cross process boundaries
+    FakeYoutubeDL.playlist_size = tracks
+    pyppdisbot.audio_cache.cache_after = float('inf')  # Never download to disk
+    message_interval, presence_interval = updates.message_interval, updates.presence_interval
+    updates.message_interval = message_interval / speed
+    updates.presence_interval = presence_interval / speed
+
+    scenarios = [
+        ('pyppdisbot', pyppdisbot, scenario_pyppdisbot, lambda: not pyppdisbot.sessions.get(4242).queue),
+        ('pydisbot3', pydisbot3, scenario_pydisbot3, lambda: not pydisbot3.sessions.get(4242).queue),
+        ('ppdisbot', ppdisbot, scenario_ppdisbot, lambda: not ppdisbot.bot.players.get(4242).queue),
+    ]
+    results = {}
+    loop_watchdog = LoopWatchdog(block_threshold)
+    loop_watchdog.start()
+    try:
+        for name, module, scenario, idle in scenarios:
+            await module.bot._async_setup_hook()
+            module.make_source = fake_make_source
+            stream_cache.clear()
+            FakeYoutubeDL.reset()
+            harness = Harness(tracks, speed)
+            module.bot.change_presence = harness.api.change_presence
+            detected_before = loop_watchdog.detected
+            results[name] = await harness.run(scenario, idle)
+            detected = loop_watchdog.detected - detected_before
+            blocks = list(loop_watchdog.blocks)[-detected:] if detected else []
+            results[name]['loop_blocks'] = detected
+            results[name]['max_loop_block_ms'] = round(max((block['seconds'] for block in blocks), default=0) * 1000, 1)
+            for block in blocks:
+                print(f"{name} blocked the event loop for {block['seconds'] * 1000:.0f} ms in:\n{block['stack']}")
+            if harness.guild.voice_client is not None:
+                await harness.guild.voice_client.disconnect()
+            print(f"{name}: {json.dumps(results[name])}")
+    finally:
+        loop_watchdog.stop()
+        updates.message_interval, updates.presence_interval = message_interval, presence_interval
+        ytextract.extraction_backend.shutdown()
+    return results
+
+# Print how each number moved since the last run with the same parameters
+def compare(previous, results):
+    for name, metrics in results.items():
+        before = previous['results'].get(name, {})
+        changes = []
+        for key, value in metrics.items():
+            old = before.get(key)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old != value:
+                changes.append(f"{key} {old} -> {value}")
+        if changes:
+            print(f"{name} vs {previous['commit']}: " + ", ".join(changes))
+
+def main():
+    args = docopt(doc)
+    tracks = int(args['--tracks'])
+    speed = float(args['--speed'])
+    FakeYoutubeDL.latency = float(args['--latency'])
+    FakeYoutubeDL.failure_rate = float(args['--failure-rate'])
+    params = {'tracks': tracks, 'latency': FakeYoutubeDL.latency,
+              'failure_rate': FakeYoutubeDL.failure_rate, 'speed': speed}
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = asyncio.run(run_all(tracks, speed, float(args['--block-threshold'])))
+
+    record = {'commit': _git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'params': params, 'results': results}
+    path = args['--results']
+    previous = None
+    if os.path.exists(path):
+        with open(path) as results_file:
+            for line in results_file:
+                entry = json.loads(line)
+                if entry.get('params') == params:
+                    previous = entry
+    if previous is not None:
+        compare(previous, results)
+    with open(path, 'a') as results_file:
+        results_file.write(json.dumps(record) + '\n')
+    print(f"Results appended to {path}")
+
+    if any(metrics['loop_blocks'] for metrics in results.values()):
+        print("FAIL: a command handler blocked the event loop")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
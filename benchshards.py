@@ -0,0 +1,189 @@
+"""Sharded supervisor check against a local stub Discord gateway.
+
+Starts a stub of the Discord HTTP API and gateway, runs pyppdisbot under the
+supervisor with real worker processes connecting to it, then kills a worker and
+measures how long the supervisor takes to bring its shards back.
+
+Usage:
+  benchshards.py [--workers=<n>] [--shards=<n>] [--guilds=<n>] [--timeout=<s>]
+
+Options:
+  --workers=<n>    Worker processes [default: 2].
+  --shards=<n>     Total shards [default: 4].
+  --guilds=<n>     Guilds spread over the shards [default: 40].
+  --timeout=<s>    Seconds to wait for each phase [default: 60].
+"""
+import asyncio
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from aiohttp import web, WSMsgType
+from docopt import docopt
+
+from supervisor import Supervisor
+
+BOT_USER = {'id': '100000000000000001', 'username': 'stubbot', 'discriminator': '0000',
+            'avatar': None, 'bot': True, 'global_name': None}
+
+
+# discord.py only parses bodies whose Content-Type is exactly application/json
+def _json(data):
+    return web.Response(body=json.dumps(data).encode(), headers={'Content-Type': 'application/json'})
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Just enough of the Discord API and gateway for a bot to log in, identify its shards
+# and receive its guilds. Every IDENTIFY is recorded with the shard it asked for.
+class StubGateway:
+    def __init__(self, shard_count, guilds):
+        self.shard_count = shard_count
+        self.guild_ids = [(index + 1) << 22 | index for index in range(guilds)]
+        self.identified = []  # (time, shard ID)
+        self.port = _free_port()
+        self._runner = None
+
+    @property
+    def api_base(self):
+        return f"http://127.0.0.1:{self.port}/api/v10"
+
+    @property
+    def gateway_url(self):
+        return f"ws://127.0.0.1:{self.port}/gateway"
+
+    def _guilds_for(self, shard_id):
+        return [guild_id for guild_id in self.guild_ids if (guild_id >> 22) % self.shard_count == shard_id]
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/api/v10/users/@me', lambda request: _json(BOT_USER))
+        app.router.add_get('/api/v10/oauth2/applications/@me', lambda request: _json({
+            'id': BOT_USER['id'], 'name': 'stub', 'description': '', 'icon': None, 'bot_public': True,
+            'bot_require_code_grant': False, 'owner': BOT_USER, 'verify_key': '', 'flags': 0,
+        }))
+        gateway = {'url': self.gateway_url, 'shards': self.shard_count,
+                   'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0, 'max_concurrency': 16}}
+        app.router.add_get('/api/v10/gateway', lambda request: _json({'url': self.gateway_url}))
+        app.router.add_get('/api/v10/gateway/bot', lambda request: _json(gateway))
+        app.router.add_get('/gateway', self._websocket)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '127.0.0.1', self.port).start()
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        sequence = 0
+
+        async def dispatch(event, data):
+            nonlocal sequence
+            sequence += 1
+            await ws.send_str(json.dumps({'op': 0, 's': sequence, 't': event, 'd': data}))
+
+        await ws.send_str(json.dumps({'op': 10, 'd': {'heartbeat_interval': 41250}}))
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                break
+            payload = json.loads(message.data)
+            if payload['op'] == 1:
+                await ws.send_str(json.dumps({'op': 11}))
+            elif payload['op'] == 2:
+                shard_id = payload['d'].get('shard', [0, 1])[0]
+                self.identified.append((time.monotonic(), shard_id))
+                guild_ids = self._guilds_for(shard_id)
+                await dispatch('READY', {
+                    'v': 10, 'user': BOT_USER, 'session_id': f"stub-{shard_id}-{len(self.identified)}",
+                    'resume_gateway_url': self.gateway_url, 'shard': [shard_id, self.shard_count],
+                    'application': {'id': BOT_USER['id'], 'flags': 0},
+                    'guilds': [{'id': str(guild_id), 'unavailable': True} for guild_id in guild_ids],
+                })
+                for guild_id in guild_ids:
+                    await dispatch('GUILD_CREATE', {
+                        'id': str(guild_id), 'name': f"Guild {guild_id}", 'owner_id': BOT_USER['id'],
+                        'member_count': 1, 'channels': [], 'roles': [], 'members': [], 'emojis': [],
+                        'stickers': [], 'features': [], 'voice_states': [], 'threads': [],
+                        'presences': [], 'stage_instances': [], 'guild_scheduled_events': [],
+                    })
+        return ws
+
+
+async def _wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.1)
+    return True
+
+async def run(workers, shards, guilds, timeout):
+    stub = StubGateway(shards, guilds)
+    await stub.start()
+    workdir = tempfile.mkdtemp(prefix='bench-shards-')
+    env = dict(os.environ)
+    env.update({
+        'DISCORD_TOKEN': 'stub', 'DISCORD_API_BASE': stub.api_base, 'DISCORD_GATEWAY': stub.gateway_url,
+        'HEALTH_INTERVAL': '0.2', 'LOG_FILE': os.path.join(workdir, 'bot.log'),
+        'JOURNAL_PATH': os.path.join(workdir, 'journal'), 'SEARCH_INDEX_PATH': os.path.join(workdir, 'search.json'),
+        'AUDIO_CACHE_DIR': os.path.join(workdir, 'audio'),
+    })
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pyppdisbot.py')
+    supervisor = Supervisor([sys.executable, script], workers, shard_count=shards,
+                            socket_path=os.path.join(workdir, 'supervisor.sock'), env=env, metrics_port=0)
+    results = {'workers': workers, 'shards': shards, 'guilds': guilds}
+    started = time.monotonic()
+    task = asyncio.get_running_loop().create_task(supervisor.run())
+    try:
+        ready = await _wait_for(lambda: supervisor.health()['ready'] == workers
+                                and supervisor.health()['guilds'] == guilds, timeout)
+        results['all_ready'] = ready
+        results['time_to_ready_s'] = round(time.monotonic() - started, 2)
+        results['identified_shards'] = sorted({shard_id for _, shard_id in stub.identified})
+        if not ready:
+            return results
+
+        # Crash one worker and time its shards coming back
+        victim = supervisor.workers[0]
+        killed_at = time.monotonic()
+        os.kill(victim.process.pid, signal.SIGKILL)
+        await _wait_for(lambda: victim.report is None, timeout)
+        recovered = await _wait_for(lambda: supervisor.health()['ready'] == workers
+                                    and supervisor.health()['guilds'] == guilds, timeout)
+        results['recovered'] = recovered
+        results['restart_to_ready_s'] = round(time.monotonic() - killed_at, 2)
+        results['reidentified_shards'] = sorted({shard_id for at, shard_id in stub.identified if at > killed_at})
+        results['restarts'] = supervisor.health()['restarts']
+
+        exposition = supervisor.render_metrics()
+        results['merged_metrics_workers'] = sorted(
+            {line.split('worker="')[1].split('"')[0] for line in exposition.splitlines() if 'worker="' in line})
+        results['health'] = supervisor.health()['workers']
+    finally:
+        await supervisor.stop()
+        await task
+        await stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def main():
+    args = docopt(__doc__)
+    results = asyncio.run(run(int(args['--workers']), int(args['--shards']), int(args['--guilds']),
+                              float(args['--timeout'])))
+    print(json.dumps(results, indent=2))
+    ok = (results['all_ready'] and results.get('recovered')
+          and results['reidentified_shards'] == results['health'][0]['shards'])
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
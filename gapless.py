@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import discord
+
+# Seconds before the current track ends at which the next track's source is opened
+PRESPAWN_SECONDS = float(os.getenv('PRESPAWN_SECONDS', 10))
+
+# Frames (20 ms each) read ahead from the next source so ffmpeg has connected and probed by the handover
+PREBUFFER_FRAMES = int(os.getenv('PREBUFFER_FRAMES', 25))
+
+FRAME_SECONDS = 0.02
+
+
+# Wraps a source and reads its first frames on a background thread as soon as it
+# is created, so process start, TLS and demux probing happen before it's played
+class PrebufferedSource(discord.AudioSource):
+    def __init__(self, source, frames=PREBUFFER_FRAMES):
+        self.source = source
+        self._buffer = deque()
+        self._frames = frames
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        try:
+            for _ in range(self._frames):
+                data = self.source.read()
+                self._buffer.append(data)
+                if not data:
+                    break
+        except Exception as e:
+            logging.error(f"Prebuffering failed: {e}")
+            self._buffer.append(b'')
+
+    def read(self):
+        self._thread.join()  # Only waits if the handover came before prebuffering finished
+        if self._buffer:
+            return self._buffer.popleft()
+        return self.source.read()
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+
+# Plays a chain of tracks as one continuous source, so the voice client's player never
+# stops between them. PRESPAWN_SECONDS before the current track ends, prepare_next() is
+# awaited on the event loop for the next (source, track). When the current source runs
+# dry, the next one takes over on the very next 20 ms frame and on_handover(track, gap)
+# is called on the loop. Tracks without a known duration are prepared when they end,
+# which is no slower than starting a fresh player. Stopping the voice client cleans up
+# both the playing and the prepared source.
+# The voice client decides from the first source whether to Opus-encode what it reads,
+# so only tracks that are Opus (or not) like the first one are chained; any other track
+# is left for the after= callback to start on a fresh player.
+class ChainedSource(discord.AudioSource):
+    def __init__(self, source, duration, prepare_next, on_handover, loop=None):
+        self.loop = loop or asyncio.get_running_loop()
+        self.prepare_next = prepare_next
+        self.on_handover = on_handover
+        self._lock = threading.Lock()
+        self._current = source
+        self._opus = source.is_opus()
+        self._next = None  # (PrebufferedSource, track) once prepared
+        self._closed = False
+        self._start(duration)
+
+    def _start(self, duration):
+        self._frames = 0
+        self._prepare_at = None
+        self._preparing = False
+        if duration:
+            self._prepare_at = max(0, int((duration - PRESPAWN_SECONDS) / FRAME_SECONDS))
+
+    def _request_next(self):
+        if self._preparing:
+            return
+        self._preparing = True
+        self.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._prepare()))
+
+    async def _prepare(self):
+        try:
+            prepared = await self.prepare_next()
+        except Exception as e:
+            logging.error(f"Preparing the next track failed: {e}")
+            prepared = None
+        if prepared is None:
+            return
+        source, track = prepared
+        if source.is_opus() != self._opus:
+            logging.info(f"Not chaining {track.title}: it is encoded differently from the playing track")
+            source.cleanup()
+            return
+        with self._lock:
+            if self._closed:
+                source.cleanup()
+                return
+            self._next = (PrebufferedSource(source), track)
+
+    def read(self):
+        data = self._current.read()
+        if data:
+            self._frames += 1
+            if self._prepare_at is not None and self._frames >= self._prepare_at:
+                self._request_next()
+            return data
+
+        # The current track ended: hand over to the prepared one if there is one
+        ended_at = time.perf_counter()
+        with self._lock:
+            prepared, self._next = self._next, None
+        if prepared is None:
+            return b''
+        source, track = prepared
+        self._current.cleanup()
+        self._current = source
+        self._start(track.duration)
+        data = source.read()
+        if data:
+            gap = time.perf_counter() - ended_at
+            self.loop.call_soon_threadsafe(self.on_handover, track, gap)
+        return data
+
+    def is_opus(self):
+        return self._opus
+
+    def cleanup(self):
+        with self._lock:
+            self._closed = True
+            prepared, self._next = self._next, None
+        self._current.cleanup()
+        if prepared is not None:
+            prepared[0].cleanup()
@@ -0,0 +1,203 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+from collections import deque
+
+from trackqueue import Track
+
+JOURNAL_PATH = os.getenv('JOURNAL_PATH', '/tmp/pyppdisbot.journal')
+
+# Compact the journal into a snapshot after this many appended records
+COMPACT_EVERY = int(os.getenv('JOURNAL_COMPACT_EVERY', 20000))
+
+
+# Tracks are journaled without their stream URL, which will have expired by the time it's read back
+def track_to_record(track):
+    return [track.id, track.title, track.uploader, track.duration]
+
+def track_from_record(record):
+    return Track(*record)
+
+def _empty_state():
+    return {'queue': deque(), 'current': None, 'started_at': None, 'message': None}
+
+# Apply one journaled mutation to a guild's saved state
+def _apply(state, op, record):
+    if op == 'extend':
+        state['queue'].extend(record['tracks'])
+    elif op == 'requeue':
+        # A track (the current one unless given) went back to the front of the queue
+        track = record.get('track') or state['current']
+        if track:
+            state['queue'].appendleft(track)
+            state['current'] = None
+    elif op == 'advance':
+        # The head of the queue became the current track
+        state['current'] = state['queue'].popleft() if state['queue'] else None
+        state['started_at'] = record.get('started_at')
+    elif op == 'current':
+        # A track that wasn't at the head of the queue became the current track
+        state['current'] = record['track']
+        state['started_at'] = record.get('started_at')
+    elif op == 'clear':
+        # Playback ended or was stopped: nothing is playing or queued
+        state['queue'].clear()
+        state['current'] = None
+        state['started_at'] = None
+    elif op == 'message':
+        state['message'] = record['ref']
+
+
+# Append-only log of queue mutations, compacted into snapshots. Journal files are
+# numbered by generation; a snapshot of generation N covers every journal before N,
+# so replay is idempotent however a crash interleaves with compaction.
+class SessionJournal:
+    def __init__(self, path=JOURNAL_PATH, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.snapshot_path = f"{path}.snapshot"
+        self.compact_every = compact_every
+        self.generation = 0
+        self._file = None
+        self._appended = 0
+        self._compacting = None
+        self._sessions = None
+        self._restored = {}  # guild ID -> saved state not yet claimed by a session
+
+    def _journal_file(self, generation):
+        return f"{self.path}.{generation}"
+
+    def _journal_generations(self):
+        generations = []
+        for name in glob.glob(f"{glob.escape(self.path)}.*"):
+            suffix = name.rsplit('.', 1)[1]
+            if suffix.isdigit():
+                generations.append(int(suffix))
+        return sorted(generations)
+
+    # Read the snapshot and replay newer journals into plain saved state (no Tracks built yet)
+    def load(self):
+        states = {}
+        self.generation = 0
+        try:
+            with open(self.snapshot_path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            self.generation = snapshot['generation']
+            for guild_id, state in snapshot['guilds'].items():
+                state['queue'] = deque(state['queue'])
+                states[int(guild_id)] = state
+        except FileNotFoundError:
+            pass
+
+        for generation in self._journal_generations():
+            if generation < self.generation:
+                continue
+            with open(self._journal_file(generation)) as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # Torn final write from a crash
+                    guild_id = record['g']
+                    if record['op'] == 'drop':
+                        states.pop(guild_id, None)
+                        continue
+                    state = states.get(guild_id)
+                    if state is None:
+                        state = states[guild_id] = _empty_state()
+                    _apply(state, record['op'], record)
+            self.generation = max(self.generation, generation)
+
+        self._restored = {guild_id: state for guild_id, state in states.items()
+                          if state['queue'] or state['current']}
+        return self._restored
+
+    # Load saved state, start a fresh journal generation and hook into the session registry
+    def open(self, sessions):
+        started = time.perf_counter()
+        self.load()
+        self._sessions = sessions
+        self._rotate()
+        logging.info(f"Journal restored {len(self._restored)} guilds in {time.perf_counter() - started:.3f}s")
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        self.generation += 1
+        self._file = open(self._journal_file(self.generation), 'a')
+        self._appended = 0
+
+    # Saved state for a guild, handed out once when its session is first created
+    def claim(self, guild_id):
+        return self._restored.pop(guild_id, None)
+
+    def record(self, guild_id, op, **fields):
+        if self._file is None:
+            return
+        if 'tracks' in fields:
+            fields['tracks'] = [track_to_record(track) for track in fields['tracks']]
+        if 'track' in fields:
+            fields['track'] = track_to_record(fields['track'])
+        fields['g'] = guild_id
+        fields['op'] = op
+        self._file.write(json.dumps(fields, separators=(',', ':')) + '\n')
+        self._file.flush()  # Survives a process crash; the OS writes it out
+        self._appended += 1
+        if self._appended >= self.compact_every and self._compacting is None:
+            self._start_compaction()
+
+    def _start_compaction(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.compact()
+            return
+        self._compacting = loop.create_task(self.compact_async())
+
+    # Capture every guild's state on the loop; the slow JSON write happens in a thread
+    def _capture(self):
+        guilds = {}
+        for session in self._sessions or ():
+            if not session.queue and session.current is None:
+                continue
+            guilds[session.guild_id] = {
+                'queue': [track_to_record(track) for track in session.queue],
+                'current': track_to_record(session.current) if session.current else None,
+                'started_at': getattr(session, 'started_at', None),
+                'message': getattr(session, 'now_playing_ref', None),
+            }
+        for guild_id, state in self._restored.items():
+            guilds.setdefault(guild_id, {**state, 'queue': list(state['queue'])})
+        self._rotate()
+        return {'generation': self.generation, 'guilds': guilds}
+
+    def _write_snapshot(self, snapshot):
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file, separators=(',', ':'))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        for generation in self._journal_generations():
+            if generation < snapshot['generation']:
+                os.remove(self._journal_file(generation))
+        logging.info(f"Journal compacted: {len(snapshot['guilds'])} guilds at generation {snapshot['generation']}")
+
+    def compact(self):
+        self._write_snapshot(self._capture())
+
+    async def compact_async(self):
+        try:
+            snapshot = self._capture()
+            await asyncio.to_thread(self._write_snapshot, snapshot)
+        except Exception as e:
+            logging.error(f"Journal compaction failed: {e}")
+        finally:
+            self._compacting = None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
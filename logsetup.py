@@ -0,0 +1,122 @@
+import copy
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import time
+
+LOG_FILE = os.getenv('LOG_FILE', '/tmp/pyppdisbot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+# Rotate the log file at this size, keeping LOG_BACKUPS old files
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', 5))
+
+# Messages longer than this are truncated before they are queued
+MAX_MESSAGE_CHARS = 2000
+
+# Records waiting for the writer thread; beyond this they are dropped, not blocked on
+MAX_QUEUED_RECORDS = 10000
+
+
+# Writes one JSON object per line; extra={'fields': {...}} adds structured fields
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text[-MAX_MESSAGE_CHARS:]
+        return json.dumps(entry, default=str)
+
+
+_exception_formatter = logging.Formatter()
+
+# Hands records to the writer thread without ever blocking the event loop
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    # QueueHandler.prepare() drops exc_info, and would otherwise append the traceback to
+    # the message, so the traceback is rendered here and handed over as exc_text
+    def prepare(self, record):
+        exc_text = None
+        if record.exc_info:
+            exc_text = record.exc_text or _exception_formatter.formatException(record.exc_info)
+            record = copy.copy(record)  # Other handlers still see the original
+            record.exc_info = None
+            record.exc_text = None
+        record = super().prepare(record)
+        record.exc_text = exc_text
+        if len(record.msg) > MAX_MESSAGE_CHARS:
+            record.msg = record.msg[:MAX_MESSAGE_CHARS] + f"... [{len(record.msg) - MAX_MESSAGE_CHARS} chars truncated]"
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_handler = None
+
+# Route all logging through a bounded queue to a rotating file written by a
+# background thread. Call again after forking (e.g. entering daemon mode): the
+# writer thread and file handle do not survive a fork. Does nothing in a process
+# extraction worker, which imports the bot module again but must not write its log.
+def setup_logging(path=LOG_FILE, level=LOG_LEVEL):
+    global _listener, _handler
+    if multiprocessing.parent_process() is not None:
+        return
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+    file_handler.setFormatter(StructuredFormatter())
+    record_queue = queue.Queue(MAX_QUEUED_RECORDS)
+    _handler = BoundedQueueHandler(record_queue)
+    _listener = logging.handlers.QueueListener(record_queue, file_handler)
+    _listener.start()
+
+    root.addHandler(_handler)
+    root.setLevel(level)
+
+def stop_logging():
+    global _listener
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+    _listener = None
+
+# Small summary of a yt-dlp info dict for the log instead of the whole dict
+def summarize_info(info):
+    if not info:
+        return {'resolved': False}
+    summary = {
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'duration': info.get('duration'),
+    }
+    if 'entries' in info:
+        summary['entries'] = len(info['entries'])
+    return summary
+
+def log_extraction(url, info, started_at):
+    fields = summarize_info(info)
+    fields.update(url=url, latency_ms=round((time.perf_counter() - started_at) * 1000))
+    logging.info("Extracted info", extra={'fields': fields})
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+# Log the event loop's stack whenever it is blocked for longer than this (seconds); 0 disables
+LOOP_BLOCK_THRESHOLD = float(os.getenv('LOOP_BLOCK_THRESHOLD', 0))
+
+# Most recent blocks kept with their stacks; older ones are only counted
+RECENT_BLOCKS = 100
+
+
+# Detects callbacks that block the event loop. A task on the loop records a heartbeat
+# every `interval`; a separate thread notices when the heartbeat stops and logs what the
+# loop thread is executing at that moment, so the offending code shows up in the trace.
+class LoopWatchdog:
+    def __init__(self, threshold, interval=None):
+        self.threshold = threshold
+        self.interval = interval or threshold / 4
+        self.blocks = deque(maxlen=RECENT_BLOCKS)  # {'seconds': ..., 'stack': ...} per recent block
+        self.detected = 0  # Blocks detected since start, including those no longer kept
+        self._beat = time.monotonic()
+        self._loop_thread = None
+        self._heartbeat_task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        logging.info(f"Event loop watchdog started, threshold {self.threshold * 1000:.0f} ms")
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        block = None
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold:
+                if block is not None:
+                    logging.warning(f"Event loop was blocked for {block['seconds']:.3f}s")
+                    block = None
+                continue
+            if block is not None and block['beat'] == beat:
+                block['seconds'] = blocked  # Same block, still going
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            block = {'beat': beat, 'seconds': blocked, 'stack': stack}
+            self.blocks.append(block)
+            self.detected += 1
+            logging.warning(f"Event loop blocked for over {blocked:.3f}s in:\n{stack}")
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+loop_watchdog = LoopWatchdog(LOOP_BLOCK_THRESHOLD) if LOOP_BLOCK_THRESHOLD > 0 else None
+
+# Start the shared watchdog with the bot, if LOOP_BLOCK_THRESHOLD enables it
+def install(bot):
+    if loop_watchdog is None:
+        return
+
+    async def start_watchdog():
+        loop_watchdog.start()
+
+    bot.add_listener(start_watchdog, 'on_ready')
@@ -0,0 +1,269 @@
+import asyncio
+import bisect
+import logging
+import os
+
+import aiohttp
+
+# Port for the Prometheus endpoint; unset or 0 leaves it off
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# Only local scrapers by default
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# How often event-loop lag is sampled (seconds)
+LOOP_LAG_INTERVAL = 0.5
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return f'{{{pairs}}}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+# Gauge read at scrape time from callbacks returning a number or {label values: number}
+class Gauge:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._callbacks = []
+        self._values = {}
+
+    def set(self, value, **labels):
+        self._values[tuple(labels.get(name, '') for name in self.label_names)] = value
+
+    def collect_from(self, callback):
+        self._callbacks.append(callback)
+
+    def render(self):
+        values = dict(self._values)
+        for callback in self._callbacks:
+            try:
+                result = callback()
+            except Exception as e:
+                logging.error(f"Metrics callback for {self.name} failed: {e}")
+                continue
+            if isinstance(result, dict):
+                for key, value in result.items():
+                    key = key if isinstance(key, tuple) else (key,)
+                    values[key] = values.get(key, 0) + value
+            else:
+                values[()] = values.get((), 0) + result
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.label_names + ('le',)
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+extraction_seconds = Histogram(
+    'disbot_extraction_seconds', "Time to resolve a track, by stream cache result and extractor retries",
+    labels=('cache', 'retries'))
+queue_depth = Gauge('disbot_queue_depth', "Tracks queued per guild", labels=('guild',))
+ffmpeg_processes = Gauge('disbot_ffmpeg_processes', "Live ffmpeg processes")
+voice_clients = Gauge('disbot_voice_clients', "Connected voice clients")
+loop_lag = Histogram('disbot_event_loop_lag_seconds', "How late the event loop woke up a sleeping task",
+                     buckets=LAG_BUCKETS)
+loop_lag_last = Gauge('disbot_event_loop_lag_last_seconds', "Most recent event-loop lag sample")
+discord_requests = Counter('disbot_discord_requests_total', "Discord HTTP API requests by method and status",
+                           labels=('method', 'status'))
+discord_rate_limited = Counter('disbot_discord_rate_limited_total', "Discord HTTP API responses with status 429")
+extraction_retries = Counter('disbot_extraction_retries_total', "Extractions retried after a transient error",
+                             labels=('extractor',))
+extractor_circuit_open = Gauge('disbot_extractor_circuit_open',
+                               "1 while an extractor's circuit breaker is shedding requests", labels=('extractor',))
+voice_connect_seconds = Histogram(
+    'disbot_voice_connect_seconds',
+    "Time to get a voice connection: a new or shared handshake, a move or a reused connection", labels=('kind',))
+discord_updates = Gauge('disbot_discord_updates', "Coalesced message edits and presence updates",
+                        labels=('result',))
+
+REGISTRY = [
+    extraction_seconds, queue_depth, ffmpeg_processes, voice_clients, loop_lag, loop_lag_last,
+    discord_requests, discord_rate_limited, discord_updates, extraction_retries, extractor_circuit_open,
+    voice_connect_seconds,
+]
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def _add_labels(sample, labels):
+    series, value = sample.rsplit(' ', 1)
+    extra = ','.join(f'{name}="{value}"' for name, value in labels.items())
+    if series.endswith('}'):
+        return f"{series[:-1]},{extra}}} {value}"
+    return f"{series}{{{extra}}} {value}"
+
+# Combine expositions from several processes, given as (labels, text) pairs, into one:
+# each family keeps a single HELP/TYPE header and every sample gets its source's labels
+def merge(expositions):
+    families = {}  # family name -> [HELP line, TYPE line, samples]
+    for labels, text in expositions:
+        family = None
+        for line in text.splitlines():
+            if line.startswith(('# HELP ', '# TYPE ')):
+                family = families.setdefault(line.split()[2], ['', '', []])
+                family[0 if line.startswith('# HELP ') else 1] = line
+            elif line and family is not None:
+                family[2].append(_add_labels(line, labels) if labels else line)
+    lines = []
+    for help_line, type_line, samples in families.values():
+        lines.extend([help_line, type_line, *samples])
+    return '\n'.join(lines) + '\n'
+
+
+# aiohttp trace hooks counting every request the bot's HTTP client makes
+def http_trace():
+    async def on_request_end(session, context, params):
+        status = params.response.status
+        discord_requests.inc(method=params.method, status=status)
+        if status == 429:
+            discord_rate_limited.inc()
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+# Minimal HTTP handler serving routes {path: (render function, content type)} for GET
+def _handler(routes):
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass  # Headers are not needed
+            parts = request_line.split()
+            route = None
+            if len(parts) >= 2 and parts[0] == b'GET':
+                route = routes.get(parts[1].split(b'?')[0].decode('latin-1'))
+            if route is not None:
+                body = route[0]().encode()
+                status, content_type = b'200 OK', route[1].encode()
+            else:
+                body = b'Not found\n'
+                status, content_type = b'404 Not Found', b'text/plain'
+            writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: ' + content_type + b'\r\n'
+                         + b'Content-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+            await writer.drain()
+        except Exception as e:
+            logging.error(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+
+    return handle
+
+async def serve(port, host, routes):
+    return await asyncio.start_server(_handler(routes), host, port)
+
+async def _sample_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL)
+        loop_lag.observe(lag)
+        loop_lag_last.set(lag)
+
+
+_server = None
+_lag_task = None
+
+# Sample event-loop lag on the running loop (once; later calls are no-ops)
+def start_lag_sampler():
+    global _lag_task
+    if _lag_task is None:
+        _lag_task = asyncio.get_running_loop().create_task(_sample_loop_lag())
+
+# Start the HTTP endpoint and lag sampler on the running loop (once; later calls are no-ops)
+async def start(port=METRICS_PORT, host=METRICS_HOST):
+    global _server
+    if not port or _server is not None:
+        return
+    _server = await serve(port, host, {'/metrics': (render, PROMETHEUS_CONTENT_TYPE)})
+    start_lag_sampler()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+
+# Hook a bot and its session registry into the metrics. The endpoint starts on the
+# first on_ready when METRICS_PORT is set; collection itself is always on and cheap.
+def install(bot, sessions):
+    from audiosource import live_ffmpeg_processes
+    from updates import updates
+
+    if bot.http.http_trace is None:
+        bot.http.http_trace = http_trace()  # Read when the HTTP session is created at login
+    queue_depth.collect_from(lambda: {session.guild_id: len(session.queue) for session in sessions})
+    voice_clients.collect_from(lambda: sum(1 for vc in bot.voice_clients if vc.is_connected()))
+    if not ffmpeg_processes._callbacks:
+        # Process-wide sources, registered once however many bots are installed
+        ffmpeg_processes.collect_from(live_ffmpeg_processes)
+        discord_updates.collect_from(lambda: {
+            'requested': updates.requested, 'sent': updates.sent,
+            'errors': updates.errors,
+        })
+
+    async def start_metrics():
+        await start()
+
+    bot.add_listener(start_metrics, 'on_ready')
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+from collections import deque
+
+from trackqueue import Track
+from ytextract import extract
+
+# Playlist entries fetched per page
+PLAYLIST_PAGE_SIZE = int(os.getenv('PLAYLIST_PAGE_SIZE', 50))
+
+# The next page is fetched once fewer tracks than this are queued
+PLAYLIST_LOW_WATER = int(os.getenv('PLAYLIST_LOW_WATER', 10))
+
+
+# Position in a playlist that is still being read: the next 1-based entry to fetch and,
+# once yt-dlp reports it, how many entries the playlist has
+class PlaylistCursor:
+    __slots__ = ('url', 'title', 'next_item', 'total', 'done')
+
+    def __init__(self, url, title=None, next_item=1, total=None):
+        self.url = url
+        self.title = title
+        self.next_item = next_item
+        self.total = total
+        self.done = False
+
+    # Move past a fetched page of up to page_size entries; returns its entries
+    def advance(self, info, page_size):
+        entries = [entry for entry in info.get('entries') or [] if entry]
+        self.total = info.get('playlist_count') or self.total
+        self.next_item += page_size
+        if not entries or (self.total and self.next_item > self.total) \
+                or (not self.total and len(entries) < page_size):
+            self.done = True
+        return entries
+
+    def remaining(self):
+        if self.done:
+            return 0
+        return max(0, self.total - self.next_item + 1) if self.total else None
+
+    def __repr__(self):
+        return f"PlaylistCursor({self.url!r}, next_item={self.next_item}, total={self.total})"
+
+
+async def fetch_flat_page(url, items):
+    return await extract(url, 'playlist', items=items)
+
+
+# Feeds a TrackQueue from playlists a page at a time. Whatever can't go straight into the
+# queue waits here in order, as playlist cursors or lists of tracks queued after a
+# playlist, so the queue itself only ever holds tracks and keeps its order.
+class QueueFeed:
+    def __init__(self, queue, fetch_page=fetch_flat_page, page_size=PLAYLIST_PAGE_SIZE,
+                 low_water=PLAYLIST_LOW_WATER):
+        self.queue = queue
+        self.fetch_page = fetch_page  # Awaited with (url, "start-stop"); returns a flat playlist record
+        self.page_size = page_size
+        self.low_water = low_water
+        self.on_extend = None  # Called with the tracks each time the feed extends the queue
+        self._segments = deque()  # PlaylistCursor or list of Tracks, in queue order
+        self._filling = None
+        self.pages = 0
+
+    def __bool__(self):
+        return bool(self._segments)
+
+    # Tracks waiting behind the queue; None when a playlist hasn't reported its length
+    def pending(self):
+        count = 0
+        for segment in self._segments:
+            remaining = len(segment) if isinstance(segment, list) else segment.remaining()
+            if remaining is None:
+                return None
+            count += remaining
+        return count
+
+    def _extend(self, tracks):
+        self.queue.extend(tracks)
+        if self.on_extend is not None and tracks:
+            self.on_extend(tracks)
+
+    # Queue tracks behind anything still waiting
+    def add(self, tracks):
+        if self._segments:
+            self._segments.append(list(tracks))
+        else:
+            self._extend(tracks)
+
+    # Continue a playlist whose first page the caller queued itself
+    def add_cursor(self, cursor):
+        if not cursor.done:
+            self._segments.append(cursor)
+
+    # Fetch the first page of a playlist without queueing it. Returns its tracks and a
+    # cursor for the rest, which is None if the URL was a single video.
+    async def first_page(self, url):
+        cursor = PlaylistCursor(url)
+        tracks, info = await self._next_page(cursor)
+        if info is None:
+            return [], None
+        if 'entries' not in info:
+            return [Track.from_info(info, url)], None
+        cursor.title = info.get('title')
+        return tracks, cursor
+
+    # Queue the first page of a playlist now and keep a cursor for the rest. Returns the
+    # tracks queued and the cursor, as first_page does.
+    async def add_playlist(self, url):
+        tracks, cursor = await self.first_page(url)
+        self.add(tracks)
+        if cursor is not None:
+            self.add_cursor(cursor)
+        return tracks, cursor
+
+    def clear(self):
+        self._segments.clear()
+        if self._filling is not None:
+            self._filling.cancel()
+            self._filling = None
+
+    # Fetch pages in the background if the queue has run low
+    def refill(self):
+        if self._segments and len(self.queue) < self.low_water:
+            asyncio.ensure_future(self.fill())
+
+    # Make sure at least `wanted` tracks (default: the low-water mark) are queued, if there
+    # are that many. Concurrent callers share one fill instead of fetching the same page.
+    async def fill(self, wanted=None):
+        wanted = self.low_water if wanted is None else wanted
+        while self._segments and len(self.queue) < wanted:
+            if self._filling is None:
+                self._filling = asyncio.ensure_future(self._fill_one())
+            task = self._filling
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise  # The caller itself was cancelled
+                return  # The feed was cleared
+            finally:
+                if self._filling is task and task.done():
+                    self._filling = None
+
+    async def _fill_one(self):
+        segment = self._segments[0]
+        if isinstance(segment, list):
+            self._segments.popleft()
+            self._extend(segment)
+            return
+        try:
+            tracks, _ = await self._next_page(segment)
+        except Exception as e:
+            # Give up on the rest of this playlist rather than retrying it on every track
+            logging.error(f"Fetching the next page of {segment.url} failed: {e}")
+            segment.done = True
+            tracks = []
+        if segment.done and self._segments and self._segments[0] is segment:
+            self._segments.popleft()
+        self._extend(tracks)
+
+    async def _next_page(self, cursor):
+        start = cursor.next_item
+        stop = start + self.page_size - 1
+        info = await self.fetch_page(cursor.url, f"{start}-{stop}")
+        self.pages += 1
+        if not info:
+            cursor.done = True
+            return [], None
+        entries = cursor.advance(info, self.page_size)
+        logging.info(f"Fetched playlist entries {start}-{stop} of {cursor.total or '?'}: {cursor.url}")
+        return [Track.from_info(entry) for entry in entries], info
@@ -1,11 +1,24 @@
+import startup  # Before anything else, so startup timing covers every import
 import os
 import discord
 from discord.ext import commands
 from discord import app_commands
 from dotenv import load_dotenv
-import yt_dlp
 import json
 
+from streamcache import stream_cache
+from ytextract import extract
+from trackqueue import Track
+from sessions import GuildSession, SessionRegistry
+from updates import updates
+from queueview import QueueView
+from audiosource import make_source
+from gapless import ChainedSource
+from batchplay import Batch, batch_items
+import metrics
+import loopwatch
+from voiceidle import IdleDisconnect, VoiceConnections
+
 # Load token from .env
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
@@ -23,91 +36,133 @@ class ConfigManager:
     def get(self, key, default=None):
         return self.config.get(key, default)
 
-# Music Player Class
-class Player:
-    def __init__(self):
-        self.queue = []
-        self.current_song = None
-
+# Music Player Class, one per guild
+class Player(GuildSession):
     def add_to_queue(self, song):
         self.queue.append(song)
 
     def next_song(self):
         if self.queue:
-            self.current_song = self.queue.pop(0)
-            return self.current_song
+            self.current = self.queue.popleft()
+            return self.current
         return None
 
     def clear_queue(self):
         self.queue.clear()
+        self.feed.clear()
 
 # Main Bot Class
 class MusicBot(commands.Bot):
     def __init__(self, config_manager, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.config_manager = config_manager
-        self.player = Player()
-        self.guild_data = {}  # To store bot messages per guild
+        self.players = SessionRegistry(Player)  # Queue, current song and bot message per guild
+        # Voice connections stay open while idle, and close after IDLE_DISCONNECT_AFTER
+        self.idle_disconnect = IdleDisconnect(self)
+        self.voice = VoiceConnections(self.idle_disconnect)
 
     async def on_ready(self):
         print(f'Logged in as {self.user}')
-        # Sync app commands (slash commands)
+        # Sync app commands (slash commands) if they changed since the last sync
         try:
-            await self.tree.sync()
-            print("Slash commands have been synchronized.")
+            if await startup.sync_commands(self):
+                print("Slash commands have been synchronized.")
         except Exception as e:
             print(f"Error synchronizing commands: {e}")
 
     async def connect_to_channel(self, interaction):
         if interaction.user.voice and interaction.user.voice.channel:
-            voice_channel = interaction.user.voice.channel
-            if interaction.guild.voice_client is None:
-                await voice_channel.connect()
-            return interaction.guild.voice_client
+            # Reuses the open connection, moving it if the user is in another channel
+            return await self.voice.connect(interaction.user.voice.channel)
         else:
             if not interaction.response.is_done():
                 await interaction.response.send_message("You are not connected to a voice channel.", ephemeral=True)
             return None
 
     async def play_song(self, interaction, url):
-        await interaction.response.defer(thinking=True)
+        voice_client = await self.connect_to_channel(interaction)
+        if not voice_client:
+            return
+
+        info = await stream_cache.resolve(url, self.extract_song_info)
+        song = {
+            'title': info.get('title', 'Unknown'),
+            'uploader': info.get('uploader', 'Unknown'),
+            'duration': info.get('duration', 0),
+            'views': info.get('view_count', 'Unknown'),
+            'upload_date': info.get('upload_date', 'Unknown'),
+            'thumbnail': info.get('thumbnail', ''),
+        }
+
+        player = self.players.get(interaction.guild.id)
+        player.voice_client = voice_client
+        player.add_to_queue(Track.from_info(info, url))
+
+        if not voice_client.is_playing():
+            await self.play_next_song(voice_client)
+
+        await self.send_song_info(interaction, song)
 
+    # Queue several songs in their given order, with one reply that is edited as they resolve
+    async def play_batch(self, interaction, urls, dropped):
         voice_client = await self.connect_to_channel(interaction)
         if not voice_client:
             return
 
-        ydl_opts = {'format': 'bestaudio'}
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            song = {
-                'title': info.get('title', 'Unknown'),
-                'uploader': info.get('uploader', 'Unknown'),
-                'duration': info.get('duration', 0),
-                'views': info.get('view_count', 'Unknown'),
-                'upload_date': info.get('upload_date', 'Unknown'),
-                'thumbnail': info.get('thumbnail', ''),
-                'audio_url': info['url']
-            }
-
-            self.player.add_to_queue(song)
+        player = self.players.get(interaction.guild.id)
+        player.voice_client = voice_client
 
+        async def resolve(url):
+            return await stream_cache.resolve(url, self.extract_song_info)
+
+        async def enqueue(url, info):
+            song = Track.from_info(info, url)
+            player.add_to_queue(song)
             if not voice_client.is_playing():
                 await self.play_next_song(voice_client)
+            return f"{song.title} by {song.uploader}"
+
+        batch = Batch(urls, resolve, enqueue, dropped)
+        batch.message = await interaction.followup.send(batch.render())
+        await batch.run()
+
+    # Run yt-dlp in a worker thread; results are shared through the stream cache
+    async def extract_song_info(self, url):
+        return await extract(url, 'audio')
+
+    # Play a song; the songs queued after it are chained on without a gap
+    def play_track(self, voice_client, song):
+        player = self.players.get(voice_client.guild.id)
+
+        async def prepare_next():
+            if not player.queue:
+                return None
+            upcoming = player.queue[0]
+            # The queued stream URL may have expired; the stream cache only returns fresh ones
+            info = await stream_cache.resolve(upcoming.webpage_url, self.extract_song_info)
+            upcoming.stream_url, upcoming.codec = info['url'], info.get('acodec')
+            return make_source(upcoming.stream_url, upcoming.codec), upcoming
 
-            await self.send_song_info(interaction, song)
+        def on_handover(upcoming, gap):
+            if player.queue and player.queue[0] is upcoming:
+                player.next_song()
+
+        source = ChainedSource(make_source(song.stream_url, song.codec), song.duration, prepare_next, on_handover, loop=self.loop)
+        voice_client.play(source, after=lambda e: self.loop.create_task(self.check_queue(voice_client)))
+        self.idle_disconnect.playing(voice_client.guild)
 
     async def play_next_song(self, voice_client):
-        next_song = self.player.next_song()
+        next_song = self.players.get(voice_client.guild.id).next_song()
         if next_song:
-            voice_client.play(discord.FFmpegPCMAudio(next_song['audio_url']), after=lambda e: self.loop.create_task(self.check_queue(voice_client)))
+            self.play_track(voice_client, next_song)
 
     async def check_queue(self, voice_client):
         if not voice_client.is_playing():
-            next_song = self.player.next_song()
+            next_song = self.players.get(voice_client.guild.id).next_song()
             if next_song:
-                voice_client.play(discord.FFmpegPCMAudio(next_song['audio_url']), after=lambda e: self.loop.create_task(self.check_queue(voice_client)))
+                self.play_track(voice_client, next_song)
             else:
-                await voice_client.disconnect()
+                self.idle_disconnect.stopped(voice_client.guild)  # Stay connected for a while
 
     async def send_song_info(self, interaction, song):
         embed = discord.Embed(
@@ -121,17 +176,13 @@ class MusicBot(commands.Bot):
         )
         embed.set_image(url=song.get('thumbnail', ''))
 
-        # Get or initialize guild data for storing messages
-        guild_id = interaction.guild.id
-        if guild_id not in self.guild_data:
-            self.guild_data[guild_id] = {"bot_message": None}
+        player = self.players.get(interaction.guild.id)
 
         # If the bot has already sent a message, edit it instead of creating a new one
-        if self.guild_data[guild_id]["bot_message"]:
-            await self.guild_data[guild_id]["bot_message"].edit(embed=embed)
+        if player.now_playing:
+            updates.edit_message(player.now_playing, embed=embed)
         else:
-            bot_message = await interaction.followup.send(embed=embed)
-            self.guild_data[guild_id]["bot_message"] = bot_message
+            player.now_playing = await interaction.followup.send(embed=embed)
 
 # Initialize Config and Bot
 config_manager = ConfigManager('bot_config.json')
@@ -139,20 +190,31 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.voice_states = True
 bot = MusicBot(command_prefix="/", config_manager=config_manager, intents=intents)
-
-# Play Command
-@bot.tree.command(name="play", description="Play a song from YouTube")
-async def play(interaction: discord.Interaction, url: str):
-    await bot.play_song(interaction, url)
+metrics.install(bot, bot.players)
+loopwatch.install(bot)
+startup.install(bot)
+startup.mark('imports')
+
+# Play Command: one URL, several separated by spaces, or a text file of them
+@bot.tree.command(name="play", description="Play a song from YouTube, or several in order")
+@app_commands.describe(url="A song URL, or several separated by spaces",
+                       file="A text file with one song URL per line")
+async def play(interaction: discord.Interaction, url: str = None, file: discord.Attachment = None):
+    await interaction.response.defer(thinking=True)
+    urls, dropped = await batch_items(url, [file])
+    if len(urls) > 1:
+        await bot.play_batch(interaction, urls, dropped)
+    elif urls:
+        await bot.play_song(interaction, urls[0])
+    else:
+        await interaction.followup.send("Give a URL, or attach a text file of URLs.")
 
 # Stop Command
 @bot.tree.command(name="stop", description="Stop the current song and clear the queue")
 async def stop(interaction: discord.Interaction):
-    voice_client = interaction.guild.voice_client
-    if voice_client and voice_client.is_connected():
-        await voice_client.disconnect()
-
-    bot.player.clear_queue()
+    # Keep the voice connection so the next /play doesn't have to reconnect
+    bot.players.get(interaction.guild.id).clear_queue()
+    bot.voice.release(interaction.guild)
 
     if not interaction.response.is_done():
         await interaction.response.send_message("Stopped the music and cleared the queue.")
@@ -172,11 +234,12 @@ async def next_song(interaction: discord.Interaction):
 # Queue Command
 @bot.tree.command(name="queue", description="Display the current song queue")
 async def queue(interaction: discord.Interaction):
-    if bot.player.queue:
-        queue_list = "\n".join([song['title'] for song in bot.player.queue])
-        await interaction.response.send_message(f"Current Queue:\n{queue_list}")
+    player = bot.players.get(interaction.guild.id)
+    if player.queue:
+        await QueueView(player.queue, format_entry=lambda song: song.title).show(interaction)
     else:
         await interaction.response.send_message("The queue is empty.")
 
 # Start the bot
-bot.run(TOKEN)
\ No newline at end of file
+if __name__ == '__main__':
+    bot.run(TOKEN)
@@ -1,14 +1,30 @@
+import startup  # Before anything else, so startup timing covers every import
 import discord
-from discord import FFmpegPCMAudio
 from discord.ext import commands
-from yt_dlp import YoutubeDL
 import os
 import asyncio
+from collections import deque
 from dotenv import load_dotenv
 import logging
 
-# Set up logging to a file
-logging.basicConfig(filename='/tmp/pyppdisbot.log', level=logging.INFO)
+from streamcache import stream_cache, stream_url_expired, is_video_url, video_id_from_url
+from ytextract import extract
+from trackqueue import Track
+from sessions import SessionRegistry
+from updates import updates
+from logsetup import setup_logging
+from queueview import QueueView
+from audiosource import make_source
+from gapless import ChainedSource
+from playlistfeed import PlaylistCursor, PLAYLIST_PAGE_SIZE
+from batchplay import Batch, batch_items
+import metrics
+import loopwatch
+from voiceidle import IdleDisconnect, VoiceConnections
+
+# Set up logging to a rotating file written off the event loop
+setup_logging()
+startup.mark('imports')
 logging.info("###############################")
 logging.info("###-------- ppbot ----------###")
 logging.info("###############################")
@@ -22,11 +38,11 @@ intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix='/', intents=intents)
 
-# Queue and history to manage song playback
-queue = asyncio.Queue()
-metadata_queue = []  # Store song metadata (title, uploader, duration, etc.)
-previous_songs = []  # Stack to store previously played songs
-current_song = None  # Store the current song
+# Per-guild queue of song metadata, history of previously played songs and current song
+sessions = SessionRegistry()
+metrics.install(bot, sessions)
+loopwatch.install(bot)
+startup.install(bot)
 
 # Allowed channels and users
 ALLOWED_CHANNELS = [1271957559732862977]
@@ -35,8 +51,14 @@ ALLOWED_USER_IDS = [275385318574915585]
 # Timeout for auto-disconnection (seconds)
 DISCONNECT_TIMEOUT = 120  # 2 minutes
 
-# Maximum number of songs to fetch from a playlist
-MAX_PLAYLIST_ITEMS = 100
+# Leaves the voice channel once nothing has played, or nobody has listened, for DISCONNECT_TIMEOUT
+idle_disconnect = IdleDisconnect(bot, idle_after=DISCONNECT_TIMEOUT, empty_after=DISCONNECT_TIMEOUT)
+
+# Reuses or moves the open voice connection; /stop keeps it until the idle timeout
+voice_connections = VoiceConnections(idle_disconnect)
+
+# Number of playlist entries resolved concurrently
+PLAYLIST_WORKERS = int(os.getenv('PLAYLIST_WORKERS', 4))
 
 # Restrict the bot to specific channels and users
 async def check_channel(interaction):
@@ -47,7 +69,7 @@ async def check_channel(interaction):
 async def on_ready():
     print(f'Bot is ready as {bot.user}')
     await bot.change_presence(activity=discord.Game(name="/help"))
-    await bot.tree.sync()
+    await startup.sync_commands(bot)  # Only when the commands have changed since the last sync
 
 # Connect the bot to a voice channel
 async def connect_to_voice(interaction):
@@ -56,170 +78,229 @@ async def connect_to_voice(interaction):
         await interaction.followup.send("You need to be in a voice channel to play music.", ephemeral=True)
         return None
 
-    voice_client = discord.utils.get(bot.voice_clients, guild=interaction.guild)
-    if not voice_client:
-        voice_client = await voice_channel.connect()
-
-    return voice_client
+    return await voice_connections.connect(voice_channel)
 
-# Play a song using FFmpegPCMAudio
-async def play_audio(voice_client, stream_url):
+# Play a song, passing Opus streams through without transcoding. The songs queued
+# after it are chained on without a gap.
+async def play_audio(voice_client, song):
     ffmpeg_options = {
         'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
         'options': '-vn -sn -dn -buffer_size 65535 -http_persistent 0'
     }
+    session = sessions.get(voice_client.guild.id)
+
+    async def prepare_next():
+        if not session.queue:
+            return None
+        upcoming = await refresh_song(session.queue[0])
+        return make_source(upcoming.stream_url, upcoming.codec, **ffmpeg_options), upcoming
+
+    def on_handover(upcoming, gap):
+        # refresh_song may have replaced the queued song, so match it by ID
+        if session.queue and session.queue[0].id == upcoming.id:
+            session.queue.popleft()
+            session.feed.refill()
+        if session.current:
+            session.history.append(session.current)
+        session.current = upcoming
+        logging.info(f"Gapless handover to {upcoming.title}: {gap * 1000:.0f} ms")
 
     try:
-        logging.info(f"Playing audio: {stream_url}")
-        voice_client.play(FFmpegPCMAudio(stream_url, **ffmpeg_options), after=lambda e: asyncio.run_coroutine_threadsafe(play_next_song(voice_client), bot.loop))
+        logging.info(f"Playing audio: {song.stream_url}")
+        source = ChainedSource(make_source(song.stream_url, song.codec, **ffmpeg_options), song.duration,
+                               prepare_next, on_handover, loop=bot.loop)
+        voice_client.play(source, after=lambda e: asyncio.run_coroutine_threadsafe(play_next_song(voice_client), bot.loop))
+        idle_disconnect.playing(voice_client.guild)
     except Exception as e:
         logging.error(f"Error playing audio: {str(e)}")
 
-# Detect whether the URL is a playlist or a single video
-async def detect_playlist(url):
-    ydl_opts = {
-        'quiet': True,
-        'extract_flat': True,
-    }
-
-    def _extract(url):
-        with YoutubeDL(ydl_opts) as ydl:
-            return ydl.extract_info(url, download=False, process=False)
-
-    try:
-        info = await asyncio.to_thread(_extract, url)
-        is_playlist = 'entries' in info
-        return is_playlist
-    except Exception as e:
-        logging.error(f"Error detecting playlist: {str(e)}")
-        return False
-
 # Fetch the direct stream URL for a single song
 async def fetch_single_stream_url(url):
-    ydl_opts = {
-        'format': 'bestaudio',
-        'quiet': True,
-    }
-
-    def _extract(url):
-        with YoutubeDL(ydl_opts) as ydl:
-            return ydl.extract_info(url, download=False)
+    async def _extract(url):
+        logging.info(f"Extracting stream URL for song: {url}")
+        return await extract(url, 'audio')
 
     try:
-        logging.info(f"Extracting stream URL for song: {url}")
-        info = await asyncio.to_thread(_extract, url)
-        return {
-            'url': info['url'],
-            'title': info.get('title', 'Unknown'),
-            'uploader': info.get('uploader', 'Unknown'),
-            'duration': info.get('duration', 0),
-            'views': info.get('view_count', 'Unknown'),
-            'upload_date': info.get('upload_date', 'Unknown'),
-        }
+        info = await stream_cache.resolve(url, _extract)
+        return Track.from_info(info, url)
     except Exception as e:
         logging.error(f"Error fetching stream URL: {str(e)}")
         return None
 
-# Fetch stream URL(s) and metadata using yt_dlp
-async def fetch_stream_urls(url):
-    is_playlist = await detect_playlist(url)
-    ydl_opts = {
-        'format': 'bestaudio',
-        'quiet': True,
-    }
-
-    if is_playlist:
-        ydl_opts['extract_flat'] = 'in_playlist'
-
-    def _extract(url):
-        with YoutubeDL(ydl_opts) as ydl:
-            return ydl.extract_info(url, download=False)
-
+# Resolve a song queued from a later playlist page, or re-resolve one whose stream URL
+# has expired since it was queued
+async def refresh_song(song):
+    if song.stream_url and not stream_url_expired(song.stream_url):
+        return song
+    logging.info(f"Resolving stream URL: {song.title}")
+    return await fetch_single_stream_url(song.webpage_url) or song
+
+# Resolve playlist entries with at most `workers` extractions in flight.
+# Songs are handed to on_resolved in playlist order as soon as they (and every
+# entry before them) are ready, so playback can start on the first track.
+async def resolve_playlist_entries(entries, on_resolved, workers=PLAYLIST_WORKERS):
+    entries = iter(entries)
+    pending = deque()
+
+    def _schedule_next():
+        entry = next(entries, None)
+        if entry is not None:
+            entry_url = f"https://www.youtube.com/watch?v={entry['id']}"
+            pending.append(asyncio.create_task(fetch_single_stream_url(entry_url)))
+
+    for _ in range(max(1, workers)):
+        _schedule_next()
+
+    resolved = 0
+    try:
+        while pending:
+            song_metadata = await pending.popleft()
+            _schedule_next()
+            if song_metadata:
+                await on_resolved(song_metadata)
+                resolved += 1
+    finally:
+        for task in pending:
+            task.cancel()
+    return resolved
+
+# Fetch stream URL(s) and metadata using yt_dlp, passing each song to on_resolved.
+# A single extraction both classifies the URL and resolves it. Only a playlist's first
+# page is read; the returned cursor is where the rest continues (or None).
+async def fetch_stream_urls(url, on_resolved):
     try:
+        if is_video_url(url):
+            # Known single video: resolve it directly (usually a stream cache hit)
+            metadata = await fetch_single_stream_url(url)
+            if not metadata:
+                return 0, None
+            await on_resolved(metadata)
+            return 1, None
+
         logging.info(f"Extracting metadata for URL: {url}")
-        info = await asyncio.to_thread(_extract, url)
+        info = await extract(url, 'flat', items=f"1-{PLAYLIST_PAGE_SIZE}")
 
         if 'entries' in info:
-            # Playlist case: Fetch direct stream URL for each song
-            song_data = []
-            for entry in info['entries'][:MAX_PLAYLIST_ITEMS]:
-                song_metadata = await fetch_single_stream_url(f"https://www.youtube.com/watch?v={entry['id']}")
-                if song_metadata:
-                    song_data.append(song_metadata)
-            return song_data, True
+            # Playlist case: Resolve the first page concurrently and stream it into the queue
+            cursor = PlaylistCursor(url, title=info.get('title'))
+            resolved = await resolve_playlist_entries(cursor.advance(info, PLAYLIST_PAGE_SIZE), on_resolved)
+            return resolved, cursor
         else:
-            # Single video case: Extract metadata directly
-            metadata = await fetch_single_stream_url(url)
-            return [metadata], False
+            # Single video case: the flat pass already resolved the stream
+            stream_cache.put(video_id_from_url(info.get('webpage_url') or url), info)
+            await on_resolved(Track.from_info(info, url))
+            return 1, None
 
     except Exception as e:
         logging.error(f"Error fetching stream URL(s): {str(e)}")
-        return None, None
+        return 0, None
 
 # Play the next song in the queue
 async def play_next_song(voice_client):
-    global current_song
-    if not queue.empty():
-        # Save the current song to the previous_songs stack
-        if current_song:
-            previous_songs.append(current_song)
-
-        current_song = await queue.get()
-        logging.info(f"Playing next song: {current_song['title']}")
-        await play_audio(voice_client, current_song['url'])
+    session = sessions.get(voice_client.guild.id)
+    session.voice_client = voice_client
+    if not session.queue:
+        await session.feed.fill()  # The rest of a playlist may still be waiting
+    if session.queue:
+        # Save the current song to the history stack
+        if session.current:
+            session.history.append(session.current)
+
+        session.current = await refresh_song(session.queue.popleft())
+        session.feed.refill()
+        logging.info(f"Playing next song: {session.current.title}")
+        await play_audio(voice_client, session.current)
     else:
         logging.info("Queue is empty, switching presence back to /help.")
-        await bot.change_presence(activity=discord.Game(name="/help"))
-        await check_and_disconnect(voice_client)
-
-# Disconnect the bot if idle or alone
-async def check_and_disconnect(voice_client):
-    await asyncio.sleep(5)
-    if not voice_client.is_playing() and len(voice_client.channel.members) == 1:
-        await asyncio.sleep(DISCONNECT_TIMEOUT)
-        if not voice_client.is_playing() and len(voice_client.channel.members) == 1:
-            logging.info("Bot disconnected due to inactivity or being alone.")
-            await voice_client.disconnect()
-
-# Play a song or playlist from YouTube using a URL
-@bot.tree.command(name="play", description="Play a song or playlist from YouTube")
-async def play(interaction: discord.Interaction, url: str):
+        updates.change_presence(bot, activity=discord.Game(name="/help"))
+        idle_disconnect.stopped(voice_client.guild)
+
+# Queue several URLs from one command in their given order, with one summary reply that
+# is edited as they resolve
+async def play_batch(interaction, voice_client, session, items, dropped):
+    async def resolve(item):
+        songs = []
+
+        async def collect(song):
+            songs.append(song)
+
+        _, cursor = await fetch_stream_urls(item, collect)
+        return songs, cursor
+
+    async def enqueue(item, resolved):
+        songs, cursor = resolved
+        if not songs:
+            return None
+        session.feed.add(songs)
+        if cursor is not None:
+            session.feed.add_cursor(cursor)
+        if not voice_client.is_playing() and not voice_client.is_paused():
+            await play_next_song(voice_client)
+        if cursor is not None:
+            return f"{cursor.title or item}: {cursor.total or len(songs)} songs"
+        return f"{songs[0].title} by {songs[0].uploader}"
+
+    batch = Batch(items, resolve, enqueue, dropped)
+    batch.message = await interaction.followup.send(batch.render(), ephemeral=True)
+    await batch.run()
+
+# Play a song or playlist from YouTube using a URL, or several URLs (space-separated or
+# in an attached text file, one per line)
+@bot.tree.command(name="play", description="Play a song or playlist from YouTube, or several URLs")
+async def play(interaction: discord.Interaction, url: str = None, file: discord.Attachment = None):
     await interaction.response.defer(ephemeral=True)
 
+    items, dropped = await batch_items(url, [file])
+    if not items:
+        await interaction.followup.send("Give a URL, or attach a text file of URLs.", ephemeral=True)
+        return
+
     voice_client = await connect_to_voice(interaction)
     if not voice_client:
         return
 
-    songs, is_playlist = await fetch_stream_urls(url)
-    if not songs:
-        await interaction.followup.send("Failed to retrieve the stream URL(s).", ephemeral=True)
+    session = sessions.get(interaction.guild.id)
+    if len(items) > 1:
+        await play_batch(interaction, voice_client, session, items, dropped)
         return
 
-    # Add songs to the queue
-    for song_metadata in songs:
-        await queue.put(song_metadata)
-        metadata_queue.append(song_metadata)
-        logging.info(f"Added song to queue: {song_metadata['title']} by {song_metadata['uploader']}")
+    url = items[0]
+    songs = []
+
+    # Add each song to the queue as soon as it is resolved
+    async def enqueue(song):
+        session.feed.add([song])
+        songs.append(song)
+        logging.info(f"Added song to queue: {song.title} by {song.uploader}")
+
+        # Play the first song if the bot is not currently playing
+        if not voice_client.is_playing() and not voice_client.is_paused():
+            await play_next_song(voice_client)
+
+    added, cursor = await fetch_stream_urls(url, enqueue)
+    if not added:
+        await interaction.followup.send("Failed to retrieve the stream URL(s).", ephemeral=True)
+        return
 
     # Notify user
-    if is_playlist:
-        await interaction.followup.send(f"Added {len(songs)} songs from the playlist to the queue.", ephemeral=True)
+    if cursor is not None:
+        session.feed.add_cursor(cursor)  # The rest of the playlist follows as the queue runs low
+        await interaction.followup.send(f"Added {cursor.total or added} songs from the playlist to the queue.",
+                                        ephemeral=True)
     else:
-        await interaction.followup.send(f"Playing: {songs[0]['title']}", ephemeral=True)
-
-    # Play the first song if the bot is not currently playing
-    if not voice_client.is_playing() and not queue.empty():
-        await play_next_song(voice_client)
+        await interaction.followup.send(f"Playing: {songs[0].title}", ephemeral=True)
 
 # Display the current queue
 @bot.tree.command(name="queue", description="Display the current queue of songs")
 async def display_queue(interaction: discord.Interaction):
-    if not metadata_queue:
+    session = sessions.get(interaction.guild.id)
+    queue = session.queue
+    if not queue:
         await interaction.response.send_message("The queue is currently empty.", ephemeral=True)
     else:
-        queue_message = "\n".join([f"{idx+1}. {metadata['title']} by {metadata['uploader']}" for idx, metadata in enumerate(metadata_queue)])
-        logging.info(f"Current queue: {queue_message}")
-        await interaction.response.send_message(f"Current Queue:\n{queue_message}", ephemeral=True)
+        logging.info(f"Displaying queue of {len(queue)} songs")
+        view = QueueView(queue, format_entry=lambda song: f"{song.title} by {song.uploader}", feed=session.feed)
+        await view.show(interaction, ephemeral=True)
 
 # Skip to the next song
 @bot.tree.command(name="next", description="Skip to the next song")
@@ -233,36 +314,37 @@ async def skip_next(interaction: discord.Interaction):
 # Play the previous song
 @bot.tree.command(name="prev", description="Play the previous song")
 async def play_previous(interaction: discord.Interaction):
-    global current_song
+    session = sessions.get(interaction.guild.id)
     voice_client = discord.utils.get(bot.voice_clients, guild=interaction.guild)
     
-    if previous_songs:
+    if session.history:
+        await interaction.response.defer(ephemeral=True)
+
         # Stop the current song and play the previous one
         if voice_client.is_playing():
             voice_client.stop()
 
-        current_song = previous_songs.pop()
-        logging.info(f"Playing previous song: {current_song['title']} by {current_song['uploader']}")
-        await play_audio(voice_client, current_song['url'])
-        await interaction.response.send_message(f"Playing: {current_song['title']} by {current_song['uploader']}", ephemeral=True)
+        session.current = await refresh_song(session.history.pop())
+        logging.info(f"Playing previous song: {session.current.title} by {session.current.uploader}")
+        await play_audio(voice_client, session.current)
+        await interaction.followup.send(f"Playing: {session.current.title} by {session.current.uploader}", ephemeral=True)
     else:
         await interaction.response.send_message("No previous songs in the history.", ephemeral=True)
 
-# Stop the currently playing song and disconnect
+# Stop the music and clear the queue. The voice connection stays open until the idle
+# timeout, so the next /play starts without reconnecting.
 @bot.tree.command(name="stop", description="Stop playing music")
 async def stop(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
 
-    voice_client = discord.utils.get(bot.voice_clients, guild=interaction.guild)
-    if voice_client and voice_client.is_playing():
-        voice_client.stop()
-
-    # Disconnect after stopping
-    if voice_client and voice_client.is_connected():
-        logging.info("Bot stopped and disconnected.")
-        await voice_client.disconnect()
+    session = sessions.get(interaction.guild.id)
+    session.queue.clear()
+    session.feed.clear()
+    voice_connections.release(interaction.guild)
+    logging.info("Bot stopped; staying connected until the idle timeout.")
 
-    await interaction.followup.send("Stopped the music and disconnected.", ephemeral=True)
+    await interaction.followup.send("Stopped the music.", ephemeral=True)
 
 # Run the bot using the token from the .env file
-bot.run(TOKEN)
\ No newline at end of file
+if __name__ == '__main__':
+    bot.run(TOKEN)
@@ -1,440 +1,751 @@
-from docopt import docopt
-import os
-import daemon
-import daemon.pidfile
-from dotenv import load_dotenv
-import discord
-from discord.ext import commands, tasks
-import yt_dlp as ytdl
-import logging
-import asyncio
-from collections import deque
-import time
-from yt_dlp.utils import DownloadError
-
-from discord.ui import Button, View
-
-# Setup logging to a file
-logging.basicConfig(filename='/tmp/pyppdisbot.log', level=logging.INFO)
-
-# Define the usage pattern for the command-line arguments
-doc = """
-My Discord Bot.
-
-Usage:
-  pyppdisbot.py [--daemon]
-  pyppdisbot.py (-h | --help)
-  pyppdisbot.py --version
-
-Options:
-  -h --help     Show this screen.
-  --version     Show version.
-  --daemon      Run the bot in the background as a daemon.
-"""
-
-# Parse the command-line arguments
-args = docopt(doc, version='PP Discord Bot 1.0')
-
-PID_FILE = '/tmp/pyppdisbot.pid'
-
-# Load environment variables from .env file
-load_dotenv()
-TOKEN = os.getenv('DISCORD_TOKEN')
-
-# Global variable to store the playback message
-playback_message = None
-
-intents = discord.Intents.default()
-intents.message_content = True
-
-async def progress_bar(voice_client, total_duration):
-    length = 30  # Length of the progress bar
-    while voice_client.is_playing():
-        current_time = voice_client.timestamp.total_seconds()
-        progress = int((current_time / total_duration) * length)
-        bar = "█" * progress + "-" * (length - progress)
-        progress_message = f"Progress: [{bar}] {int(current_time)}s / {int(total_duration)}s"
-        
-        # Assuming you store the message ID of the playback message
-        await playback_message.edit(content=progress_message)
-        
-        await asyncio.sleep(5)  # Update every 5 seconds
-
-async def load_playlist(playlist_url):
-    ydl_opts = {'extract_flat': 'in_playlist'}  # Use the flat extraction for speed
-    with ytdl.YoutubeDL(ydl_opts) as ydl:
-        info = await extract_info_with_retries(ydl, playlist_url)  # Await the coroutine
-        if info and 'entries' in info:
-            return [entry['url'] for entry in info['entries']]
-        return []
-
-
-def get_prefix(bot, message):
-    prefixes = ['&', '!']  # List of prefixes the bot should recognize
-    return prefixes
-
-bot = commands.Bot(command_prefix=get_prefix, intents=intents)
-
-# YouTube-DL options
-ytdl_format_options = {
-    'format': 'worstaudio',
-    'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
-    'restrictfilenames': True,
-    'noplaylist': False,  # Allow playlists
-    'nocheckcertificate': True,
-    'ignoreerrors': True,  # Continue on errors
-    'logtostderr': False,
-    'quiet': True,
-    'no_warnings': True,
-    'default_search': 'auto',
-    'source_address': '0.0.0.0'
-}
-
-ffmpeg_options = {
-    'options': '-vn -buffer_size 65535 -http_persistent 0'
-}
-
-ytdl_instance = ytdl.YoutubeDL(ytdl_format_options)
-
-class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=0.5):
-        super().__init__(source, volume)
-        self.data = data
-        self.title = data.get('title')
-        self.url = data.get('url')
-
-    @classmethod
-    async def from_url(cls, url, *, loop=None, stream=False):
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl_instance.extract_info(url, download=not stream))
-
-        if 'entries' in data:
-            data = data['entries'][0]
-
-        filename = data['url'] if stream else ytdl_instance.prepare_filename(data)
-        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)
-
-queue = deque()
-current_track = None
-
-async def extract_info_with_retries(ydl, url, retries=3, delay=5):
-    loop = asyncio.get_event_loop()
-    for attempt in range(retries):
-        try:
-            info = await loop.run_in_executor(None, lambda: ydl.extract_info(url, download=False))
-            logging.info(f"Successfully extracted info: {info}")  # Log the extracted info
-            return info
-        except DownloadError as e:
-            logging.error(f"DownloadError: {e}")
-            if attempt < retries - 1:
-                logging.error(f"Error extracting info (attempt {attempt + 1}/{retries}), retrying in {delay} seconds...")
-                await asyncio.sleep(delay)
-            else:
-                raise e
-        except Exception as e:
-            logging.error(f"An unexpected error occurred: {e}")
-            raise e
-    return None
-
-async def auto_disconnect(ctx):
-    await bot.wait_until_ready()
-    voice_client = ctx.voice_client
-
-    while voice_client and voice_client.is_connected():
-        # Check if the only member in the channel is the bot itself
-        if len(voice_client.channel.members) == 1:
-            await ctx.send("Voice channel is empty, stopping playback and leaving the channel.")
-            await voice_client.disconnect()
-            break
-        
-        await asyncio.sleep(30)  # Check every 30 seconds
-
-
-async def check_queue(ctx):
-    global playback_message  # Access the global playback_message
-
-    if queue:
-        next_track = queue.popleft()
-        try:
-            info = await extract_info_with_retries(ytdl_instance, next_track)
-            audio_url = info['url']
-            ctx.voice_client.play(discord.FFmpegPCMAudio(audio_url), after=lambda e: bot.loop.create_task(check_queue(ctx)))
-            await update_status(info['title'])  # Update the bot's status with the next song title
-            
-            # Edit the existing playback message
-            if playback_message:
-                await playback_message.edit(content=f"Now playing: {info['title']}")
-            else:
-                playback_message = await ctx.send(f"Now playing: {info['title']}")
-        except Exception as e:
-            await ctx.send(f"An error occurred: {str(e)}")
-            logging.error(f"Playback error: {str(e)}")
-            await bot.change_presence(status=discord.Status.idle, activity=discord.Game("Idle"))
-    else:
-        await bot.change_presence(status=discord.Status.idle, activity=discord.Game("Queue is empty"))
-        if playback_message:
-            await playback_message.edit(content="The queue is empty. Playback has ended.")
-        else:
-            await ctx.send("The queue is empty. Playback has ended.")
-
-
-async def update_status(title):
-    game = discord.Game(f"Now playing: {title}")
-    await bot.change_presence(status=discord.Status.online, activity=game)
-
-# Task to disconnect bot after inactivity
-@tasks.loop(minutes=0.5)
-async def disconnect_after_inactivity():
-    for vc in bot.voice_clients:
-        if not vc.is_playing():
-            await vc.disconnect()
-            logging.info(f"Bot disconnected from {vc.channel} due to inactivity")
-
-async def on_ready():
-    print(f"Logged in as {bot.user}")
-    await bot.change_presence(status=discord.Status.idle, activity=discord.Game("&help"))
-
-@bot.event
-async def on_command_completion(ctx):
-    if not ctx.voice_client or not ctx.voice_client.is_playing():
-        await bot.change_presence(status=discord.Status.idle, activity=discord.Game("&help"))
-
-@bot.command(name='join')
-async def join(ctx):
-    if not ctx.message.author.voice:
-        await ctx.send("{} is not connected to a voice channel".format(ctx.message.author.name))
-        return
-    channel = ctx.message.author.voice.channel
-    await channel.connect()
-    await ctx.send(f"Joined {channel.name}")
-
-@bot.command(name='leave')
-async def leave(ctx):
-    voice_client = ctx.message.guild.voice_client
-    if voice_client.is_connected():
-        await voice_client.disconnect()
-    else:
-        await ctx.send("The bot is not connected to a voice channel.")
-
-## Remove the default help command to avoid conflicts
-bot.remove_command('help')
-
-@bot.command(name='help', help="Shows this message.")
-async def custom_help_command(ctx):
-    # Retrieve the prefix using the get_prefix function
-    prefix = get_prefix(bot, ctx.message)
-    help_message = f"""Command prefix: {' , '.join(prefix)} 
-    
-Commands:
-&help - Shows this message
-&play <url> - Play a song or a playlist from a URL
-&queue - Display the current queue
-&stop - Stop the current playback
-&next - Skip to the next track
-&prev - Play the previous track
-&join - Make the bot join your voice channel
-&leave - Make the bot leave the voice channel
-"""
-
-    await ctx.send(help_message)
-    await bot.change_presence(status=discord.Status.online, activity=discord.Game("Assisting users with commands"))
-
-
-@bot.command(name='play', help="Play a song or a playlist from a YouTube URL.")
-async def play(ctx, url=None):
-    global current_track, playback_message
-
-    if url:
-        try:
-            playlist_urls = await load_playlist(url)  # Load the playlist URLs
-            if playlist_urls:
-                queue.extend(playlist_urls)
-                await ctx.send(f"Added {len(playlist_urls)} tracks from the playlist to the queue.")
-            else:
-                await ctx.send("No information could be retrieved from the URL.")
-        except Exception as e:
-            await ctx.send(f"An error occurred: {str(e)}")
-            logging.error(f"Error adding track to queue: {str(e)}")
-            return
-
-    if not queue:
-        await ctx.send("The queue is empty.")
-        return
-    
-    # Ensure the bot is connected to the voice channel
-    if not ctx.voice_client:
-        if ctx.author.voice:
-            await ctx.author.voice.channel.connect()
-        else:
-            await ctx.send("You are not connected to a voice channel.")
-            return
-    
-    # If the bot is already playing, do not start a new track
-    if ctx.voice_client.is_playing():
-        await ctx.send("Already playing.")
-        return
-    
-    current_track = queue.popleft()
-
-    try:
-        info = await extract_info_with_retries(ytdl_instance, current_track)
-        if not info:
-            await ctx.send("No information could be retrieved from the URL.")
-            return
-
-        audio_url = info['url']
-        ctx.voice_client.play(discord.FFmpegPCMAudio(audio_url), after=lambda e: bot.loop.create_task(check_queue(ctx)))
-
-        buttons = [
-            discord.ui.Button(label="⏮️ Previous", custom_id="prev", style=discord.ButtonStyle.secondary),
-            discord.ui.Button(label="⏯️ Play/Pause", custom_id="pause_resume", style=discord.ButtonStyle.primary),
-            discord.ui.Button(label="⏭️ Next", custom_id="next", style=discord.ButtonStyle.secondary)
-        ]
-        view = discord.ui.View()
-        for button in buttons:
-            view.add_item(button)
-
-        if playback_message:
-            await playback_message.edit(content=f"Now playing: {info['title']}", view=view)
-        else:
-            playback_message = await ctx.send(f"Now playing: {info['title']}", view=view)
-    except Exception as e:
-        await ctx.send(f"An error occurred: {str(e)}")
-        logging.error(f"Playback error: {str(e)}")
-
-
-@bot.command(name='stop')
-async def stop(ctx):
-    voice_client = ctx.message.guild.voice_client
-    if not voice_client or not voice_client.is_connected():
-        await ctx.send("The bot is not connected to any voice channel.")
-        return
-
-    if voice_client.is_playing():
-        voice_client.stop()
-    
-    await ctx.send("Stopped playing.")
-
-@bot.command(name='next')
-async def next(ctx):
-    voice_client = ctx.message.guild.voice_client
-    if voice_client and voice_client.is_playing():
-        voice_client.stop()
-        await play(ctx)
-    else:
-        await ctx.send("Not currently playing anything.")
-
-@bot.command(name='prev')
-async def prev(ctx):
-    global current_track
-
-    if current_track:
-        queue.appendleft(current_track)
-        voice_client = ctx.message.guild.voice_client
-        if voice_client and voice_client.is_playing():
-            voice_client.stop()
-        await play(ctx)
-    else:
-        await ctx.send("No previous track.")
-
-# Interaction callback for buttons
-@bot.event
-async def on_interaction(interaction):
-    voice_client = interaction.guild.voice_client
-    
-    if interaction.data['custom_id'] == 'pause_resume':
-        if voice_client.is_paused():
-            voice_client.resume()
-            await interaction.response.send_message('Resumed playback', ephemeral=True)
-        elif voice_client.is_playing():
-            voice_client.pause()
-            await interaction.response.send_message('Paused playback', ephemeral=True)
-    
-    elif interaction.data['custom_id'] == 'next':
-        if voice_client is not None and voice_client.is_playing():
-            voice_client.stop()
-            # Call the play command but handle it as an interaction
-            await handle_play_interaction(interaction)
-    
-    elif interaction.data['custom_id'] == 'prev':
-        await handle_play_interaction(interaction)
-
-async def handle_play_interaction(interaction):
-    global current_track, playback_message
-
-    if not queue:
-        await interaction.response.send_message("The queue is empty.", ephemeral=True)
-        return
-
-    current_track = queue.popleft()
-    voice_client = interaction.guild.voice_client
-
-    if voice_client is None:
-        channel = interaction.user.voice.channel
-        voice_client = await channel.connect()
-    elif voice_client.channel != interaction.user.voice.channel:
-        await voice_client.move_to(interaction.user.voice.channel)
-
-    try:
-        # Acknowledge the interaction immediately to avoid timeout
-        await interaction.response.defer()
-
-        info = await extract_info_with_retries(ytdl_instance, current_track)
-        if not info:
-            await interaction.followup.send("No information could be retrieved from the URL.", ephemeral=True)
-            return
-
-        audio_url = info['url']
-        voice_client.play(discord.FFmpegPCMAudio(audio_url), after=lambda e: bot.loop.create_task(check_queue(interaction)))
-
-        buttons = [
-            discord.ui.Button(label="⏮️ Previous", custom_id="prev", style=discord.ButtonStyle.secondary),
-            discord.ui.Button(label="⏯️ Play/Pause", custom_id="pause_resume", style=discord.ButtonStyle.primary),
-            discord.ui.Button(label="⏭️ Next", custom_id="next", style=discord.ButtonStyle.secondary)
-        ]
-        view = discord.ui.View()
-        for button in buttons:
-            view.add_item(button)
-
-        # Edit the existing playback message instead of sending a new one
-        if playback_message:
-            await playback_message.edit(content=f"Now playing: {info['title']}", view=view)
-        else:
-            playback_message = await interaction.followup.send(f"Now playing: {info['title']}", view=view)
-
-    except Exception as e:
-        await interaction.followup.send(f"An error occurred: {str(e)}", ephemeral=True)
-        logging.error(f"Playback error: {str(e)}")
-
-
-@bot.command(name='queue', help="Display the current queue.")
-async def show_queue(ctx):
-    if not queue:
-        await ctx.send("The queue is empty.")
-        return
-    
-    queue_list = list(queue)  # Convert deque to list
-
-    # Iterate through each item in the queue and send it
-    for index, url in enumerate(queue_list, start=1):
-        await ctx.send(f"{index}. {url}")
-
-    # If there are more than 10 items, inform the user
-    if len(queue_list) > 10:
-        await ctx.send(f"...and {len(queue_list) - 10} more items in the queue.")
-
-
-
-# Function to run the bot
-def run_bot():
-    bot.run(TOKEN)
-
-# Run in daemon mode if the --daemon option is specified
-if args['--daemon']:
-    pidfile = daemon.pidfile.PIDLockFile(PID_FILE)
-    with daemon.DaemonContext(pidfile=pidfile):
-        pid = os.getpid()  # Get the current process PID
-        logging.info(f"Bot running in daemon mode with PID: {pid}")
-        run_bot()
-else:
-    run_bot()
\ No newline at end of file
+import startup  # Before anything else, so startup timing covers every import
+import os
+from dotenv import load_dotenv
+import discord
+from discord.ext import commands
+import logging
+import asyncio
+from collections import deque
+import time
+import sys
+
+from discord.ui import Button, View
+
+from streamcache import stream_cache
+from ytextract import extract, ExtractionError
+from sessions import GuildSession, SessionRegistry
+from updates import updates
+from logsetup import setup_logging
+from queueview import QueueView
+from trackqueue import Track
+from journal import SessionJournal, track_from_record
+from audiocache import AudioCache
+from audiosource import make_source
+from gapless import ChainedSource
+import metrics
+import loopwatch
+from voiceidle import IdleDisconnect, VoiceConnections
+from searchindex import SearchIndex, is_search_query
+from batchplay import Batch, batch_items
+from retrypolicy import retry_policy
+from supervisor import Supervisor, run_worker, worker_index, worker_shards
+
+# Setup logging to a rotating file written off the event loop
+setup_logging()
+startup.mark('imports')
+
+# Define the usage pattern for the command-line arguments
+doc = """
+My Discord Bot.
+
+Usage:
+  pyppdisbot.py [--daemon [--workers=<n>]]
+  pyppdisbot.py (-h | --help)
+  pyppdisbot.py --version
+
+Options:
+  -h --help        Show this screen.
+  --version        Show version.
+  --daemon         Run the bot in the background as a daemon.
+  --workers=<n>    Worker processes for --daemon, each running its own range of shards
+                   under a supervisor that restarts them [default: 1].
+"""
+
+PID_FILE = '/tmp/pyppdisbot.pid'
+
+# Load environment variables from .env file
+load_dotenv()
+TOKEN = os.getenv('DISCORD_TOKEN')
+
+intents = discord.Intents.default()
+intents.message_content = True
+
+async def progress_bar(voice_client, total_duration):
+    length = 30  # Length of the progress bar
+    while voice_client.is_playing():
+        current_time = voice_client.timestamp.total_seconds()
+        progress = int((current_time / total_duration) * length)
+        bar = "█" * progress + "-" * (length - progress)
+        progress_message = f"Progress: [{bar}] {int(current_time)}s / {int(total_duration)}s"
+        
+        playback_message = sessions.get(voice_client.guild.id).now_playing
+        if playback_message:
+            updates.edit_message(playback_message, content=progress_message)
+        
+        await asyncio.sleep(5)  # Update every 5 seconds
+
+# Tracks for a search result, a single video or the first page of a playlist, without
+# queueing them. Returns the tracks and a cursor for the rest of a playlist, or None.
+async def fetch_tracks(session, url):
+    if is_search_query(url):
+        return await search_tracks(url), None
+    # Use the flat extraction for speed
+    return await session.feed.first_page(url)
+
+# Queue a search result, a single video or the first page of a playlist (the rest of a
+# playlist is fetched as the queue runs low). Returns the tracks queued now and the total.
+async def load_playlist(session, playlist_url):
+    tracks, cursor = await fetch_tracks(session, playlist_url)
+    session.feed.add(tracks)
+    if cursor is None:
+        return tracks, len(tracks)
+    session.feed.add_cursor(cursor)
+    return tracks, cursor.total or len(tracks)
+
+# Queue several URLs or searches from one command, in order, replying with one summary
+# that fills in as they resolve. Returns once the first is queued so playback can start.
+async def load_batch(ctx, session, items, dropped):
+    async def enqueue(item, resolved):
+        tracks, cursor = resolved
+        if not tracks:
+            return None
+        session.feed.add(tracks)
+        if cursor is None:
+            return tracks[0].title
+        session.feed.add_cursor(cursor)
+        return f"{cursor.title or item}: {cursor.total or len(tracks)} tracks"
+
+    batch = Batch(items, lambda item: fetch_tracks(session, item), enqueue, dropped)
+    batch.message = await ctx.send(batch.render())
+    batch.start()
+    await batch.first_queued()
+
+# Flat page of playlist entries for the queue feed
+async def fetch_playlist_page(url, items):
+    return await extract_info_with_retries(url, profile='playlist', items=items)
+
+# Queue the first result for a text search. Searches seen before, or close enough to the
+# title of something played before, skip the remote search and go straight to resolving
+# the stream.
+async def search_tracks(query):
+    track = search_index.lookup(query)
+    if track is not None:
+        return [track]
+    info = await extract_info_with_retries(f"ytsearch1:{query}", profile='playlist')
+    entries = [entry for entry in (info or {}).get('entries') or [] if entry]
+    if not entries:
+        return []
+    track = Track.from_info(entries[0])
+    search_index.put(query, track)
+    return [track]
+
+
+def get_prefix(bot, message):
+    prefixes = ['&', '!']  # List of prefixes the bot should recognize
+    return prefixes
+
+# A supervisor's worker runs only its own shards; a standalone bot runs a single connection
+shards = worker_shards()
+if shards:
+    bot = commands.AutoShardedBot(command_prefix=get_prefix, intents=intents, **shards)
+else:
+    bot = commands.Bot(command_prefix=get_prefix, intents=intents)
+
+# Number of upcoming tracks resolved in the background while the current one plays
+PREFETCH_DEPTH = int(os.getenv('PREFETCH_DEPTH', 2))
+
+# Recent gaps between one track ending and the next starting (seconds)
+track_gaps = deque(maxlen=100)
+
+# Transient failures are retried with jittered backoff within a deadline; while YouTube
+# keeps failing, its circuit breaker fails requests straight away instead
+async def extract_info_with_retries(url, profile='search', items=None):
+    async def attempt():
+        info = await extract(url, profile, items)
+        if info is None:
+            # The 'search' profile ignores errors: yt-dlp logs the failure and returns nothing
+            raise ExtractionError(f"No information could be retrieved for {url}")
+        return info
+
+    started = time.perf_counter()
+    try:
+        info, retries = await retry_policy.run(url, attempt)
+    except Exception as e:
+        logging.error(f"Extraction failed for {url}: {e}")
+        raise
+    metrics.extraction_seconds.observe(time.perf_counter() - started, cache='miss', retries=retries)
+    return info
+
+# Resolve a track through the shared stream cache, extracting only on a miss
+# (waiting on another caller's extraction counts as a hit: no extractor call was made for it)
+async def resolve_track(track):
+    started = time.perf_counter()
+    extracted = False
+
+    async def extract_on_miss(url):
+        nonlocal extracted
+        extracted = True
+        return await extract_info_with_retries(url)
+
+    info = await stream_cache.resolve(track.webpage_url, extract_on_miss)
+    if not extracted:
+        metrics.extraction_seconds.observe(time.perf_counter() - started, cache='hit', retries=0)
+    return info
+
+# Resolves the next few queued tracks ahead of time so transitions hit the stream cache
+class Prefetcher:
+    def __init__(self, queue, depth=PREFETCH_DEPTH):
+        self.queue = queue
+        self.depth = depth
+        self._tasks = {}  # track ID -> background resolve task
+
+    # Start resolving the head of the queue and forget anything that left it
+    def refresh(self):
+        wanted = {track.id: track for track in self.queue.page(0, self.depth)}
+        for track_id in list(self._tasks):
+            if track_id not in wanted:
+                self._tasks.pop(track_id).cancel()
+        for track_id, track in wanted.items():
+            task = self._tasks.get(track_id)
+            if task is None or task.done():
+                self._tasks[track_id] = asyncio.ensure_future(self._prefetch(track))
+
+    # Drop all prefetched work, e.g. after the queue is cleared or reordered
+    def invalidate(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    async def _prefetch(self, track):
+        try:
+            await resolve_track(track)
+            logging.info(f"Prefetched track: {track.webpage_url}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Prefetch failed for {track.webpage_url}: {e}")
+
+# Per-guild player state: queue of tracks, current track, now-playing message and prefetcher
+class PlayerSession(GuildSession):
+    def __init__(self, guild_id):
+        super().__init__(guild_id)
+        self.prefetcher = Prefetcher(self.queue)
+        self.started_at = None  # Wall-clock time the current track started
+        self.now_playing_ref = None  # (channel ID, message ID) of now_playing, for the journal
+        self.resume_at = 0  # Seconds into the next track to start from after a restart
+        self.feed.fetch_page = fetch_playlist_page
+        self.feed.on_extend = self.queued
+
+    # Tracks entered the queue, now or from a later playlist page
+    def queued(self, tracks):
+        journal.record(self.guild_id, 'extend', tracks=tracks)
+        self.prefetcher.refresh()
+
+sessions = SessionRegistry(PlayerSession)
+metrics.install(bot, sessions)
+loopwatch.install(bot)
+startup.install(bot)
+
+# Queue mutations are journaled in daemon mode so a restart can restore every guild
+journal = SessionJournal()
+
+# Give a newly created session the state it had before a restart, without resolving anything
+def restore_session(session):
+    state = journal.claim(session.guild_id)
+    if state is None:
+        return
+    session.queue.extend(track_from_record(record) for record in state['queue'])
+    if state['current']:
+        # Replay the interrupted track first, from roughly where it was
+        current = track_from_record(state['current'])
+        session.queue.appendleft(current)
+        journal.record(session.guild_id, 'requeue')
+        if state['started_at']:
+            elapsed = time.time() - state['started_at']
+            if current.duration and elapsed < current.duration:
+                session.resume_at = elapsed
+    if state['message']:
+        channel_id, message_id = state['message']
+        session.now_playing_ref = (channel_id, message_id)
+        session.now_playing = bot.get_partial_messageable(channel_id).get_partial_message(message_id)
+    logging.info(f"Restored {len(session.queue)} queued tracks for guild {session.guild_id}")
+
+sessions.on_create = restore_session
+sessions.on_evict = lambda session: journal.record(session.guild_id, 'drop')
+
+# Pop the next track and make it current
+def advance_queue(session):
+    session.current = session.queue.popleft()
+    session.started_at = time.time()
+    journal.record(session.guild_id, 'advance', started_at=session.started_at)
+    session.feed.refill()
+    return session.current
+
+# Nothing is playing any more: the last track finished with the queue empty, or &stop.
+# Journaled so a restart doesn't play the finished track again.
+def end_playback(session):
+    if session.current:
+        session.history.append(session.current)
+    session.current = None
+    session.started_at = None
+    journal.record(session.guild_id, 'clear')
+
+def set_now_playing(session, message):
+    session.now_playing = message
+    session.now_playing_ref = (message.channel.id, message.id)
+    journal.record(session.guild_id, 'message', ref=session.now_playing_ref)
+
+# Frequently played tracks are kept on disk and played without a stream lookup
+audio_cache = AudioCache()
+
+# Text searches already resolved to a video, and the titles of everything played
+search_index = SearchIndex()
+search_index.load()
+
+# FFmpeg source for a track, seeking into it if playback is resuming after a restart
+def audio_source(session, audio_url, codec=None):
+    before_options = None
+    if session.resume_at:
+        before_options = f"-ss {int(session.resume_at)}"
+        session.resume_at = 0
+    return make_source(audio_url, codec, before_options=before_options)
+
+# Audio source and title for a track, from the local audio cache when it has the file
+async def track_source(session, track):
+    path = audio_cache.lookup(track.id)
+    if path:
+        return audio_source(session, path), track.title or track.webpage_url
+    info = await resolve_track(track)
+    if not info:
+        return None, None
+    # Tracks queued straight from a URL learn their metadata here
+    track.title = track.title or info['title']
+    track.duration = track.duration or info.get('duration')
+    return audio_source(session, info['url'], info.get('acodec')), info['title']
+
+# Count a play once a track actually starts; prefetched tracks may never be played
+def record_play(track):
+    audio_cache.record_play(track.id, track.webpage_url)
+    search_index.record_play(track)
+
+# Record how long the voice channel was silent between two tracks
+def record_track_gap(ended_at):
+    if ended_at is None:
+        return
+    gap = time.perf_counter() - ended_at
+    track_gaps.append(gap)
+    logging.info(f"Inter-track gap: {gap * 1000:.0f} ms")
+
+# Start a track on the voice client; the tracks after it are chained on without a gap
+def start_playback(ctx, session, voice_client, source):
+    async def prepare_next():
+        if not session.queue:
+            return None
+        track = session.queue[0]
+        source, _ = await track_source(session, track)
+        return (source, track) if source is not None else None
+
+    def on_handover(track, gap):
+        bot.loop.create_task(handover(ctx, session, track, gap))
+
+    chain = ChainedSource(source, session.current.duration, prepare_next, on_handover, loop=bot.loop)
+    voice_client.play(chain, after=lambda e: bot.loop.create_task(check_queue(ctx, time.perf_counter())))
+    idle_disconnect.playing(voice_client.guild)
+    record_play(session.current)
+
+# A chained track took over from the previous one
+async def handover(ctx, session, track, gap):
+    if session.queue and session.queue[0] is track:
+        advance_queue(session)
+    else:
+        session.current = track  # The queue changed after this track was prepared
+        session.started_at = time.time()
+        journal.record(session.guild_id, 'current', track=track, started_at=session.started_at)
+    record_play(track)
+    track_gaps.append(gap)
+    logging.info(f"Gapless handover: {gap * 1000:.0f} ms")
+    session.prefetcher.refresh()
+    await announce_track(ctx, session, track.title or track.webpage_url)
+
+async def announce_track(ctx, session, title):
+    update_status(title)  # Update the bot's status with the next song title
+
+    # Edit the existing playback message
+    if session.now_playing:
+        updates.edit_message(session.now_playing, content=f"Now playing: {title}")
+    else:
+        set_now_playing(session, await ctx.send(f"Now playing: {title}"))
+
+async def check_queue(ctx, ended_at=None):
+    session = sessions.get(ctx.guild.id)
+    queue = session.queue
+
+    if queue:
+        next_track = advance_queue(session)
+        try:
+            source, title = await track_source(session, next_track)
+            if source is None:
+                raise ExtractionError(f"No information could be retrieved for {next_track.webpage_url}")
+            start_playback(ctx, session, ctx.voice_client, source)
+            record_track_gap(ended_at)
+            session.prefetcher.refresh()
+            await announce_track(ctx, session, title)
+        except Exception as e:
+            await ctx.send(f"An error occurred: {str(e)}")
+            logging.error(f"Playback error: {str(e)}")
+            updates.change_presence(bot, status=discord.Status.idle, activity=discord.Game("Idle"))
+            idle_disconnect.stopped(ctx.guild)
+    else:
+        end_playback(session)
+        idle_disconnect.stopped(ctx.guild)
+        updates.change_presence(bot, status=discord.Status.idle, activity=discord.Game("Queue is empty"))
+        if session.now_playing:
+            updates.edit_message(session.now_playing, content="The queue is empty. Playback has ended.")
+        else:
+            await ctx.send("The queue is empty. Playback has ended.")
+
+
+def update_status(title):
+    game = discord.Game(f"Now playing: {title}")
+    updates.change_presence(bot, status=discord.Status.online, activity=game)
+
+# Called by the idle timers after leaving a voice channel that was idle or empty
+async def left_voice(guild, reason):
+    session = sessions.get(guild.id)
+    if reason == 'empty':
+        message = "Voice channel is empty, stopped playback and left the channel."
+    else:
+        message = "Nothing played for a while, left the voice channel."
+    if session.now_playing:
+        updates.edit_message(session.now_playing, content=message)
+    updates.change_presence(bot, status=discord.Status.idle, activity=discord.Game("&help"))
+
+# Leaves voice channels on timers armed by playback stopping or the channel emptying
+idle_disconnect = IdleDisconnect(bot, on_disconnect=left_voice)
+
+# Reuses or moves the open voice connection instead of reconnecting
+voice_connections = VoiceConnections(idle_disconnect)
+
+async def on_ready():
+    print(f"Logged in as {bot.user}")
+    await bot.change_presence(status=discord.Status.idle, activity=discord.Game("&help"))
+
+@bot.event
+async def on_command_completion(ctx):
+    if not ctx.voice_client or not ctx.voice_client.is_playing():
+        updates.change_presence(bot, status=discord.Status.idle, activity=discord.Game("&help"))
+
+@bot.command(name='join')
+async def join(ctx):
+    if not ctx.message.author.voice:
+        await ctx.send("{} is not connected to a voice channel".format(ctx.message.author.name))
+        return
+    channel = ctx.message.author.voice.channel
+    await voice_connections.connect(channel)
+    idle_disconnect.stopped(ctx.guild)
+    await ctx.send(f"Joined {channel.name}")
+
+@bot.command(name='leave')
+async def leave(ctx):
+    voice_client = ctx.message.guild.voice_client
+    if voice_client.is_connected():
+        await voice_client.disconnect()
+    else:
+        await ctx.send("The bot is not connected to a voice channel.")
+
+## Remove the default help command to avoid conflicts
+bot.remove_command('help')
+
+@bot.command(name='help', help="Shows this message.")
+async def custom_help_command(ctx):
+    # Retrieve the prefix using the get_prefix function
+    prefix = get_prefix(bot, ctx.message)
+    help_message = f"""Command prefix: {' , '.join(prefix)} 
+    
+Commands:
+&help - Shows this message
+&play <url or search> - Play a song or a playlist from a URL, or the first search result
+&play <url> <url> ... - Queue several URLs (or attach a text file of them) in order
+&queue - Display the current queue
+&stop - Stop the current playback
+&next - Skip to the next track
+&prev - Play the previous track
+&join - Make the bot join your voice channel
+&leave - Make the bot leave the voice channel
+&keep - Keep the current track in the local audio cache
+&stats - Show stream cache and track transition statistics
+"""
+
+    await ctx.send(help_message)
+    updates.change_presence(bot, status=discord.Status.online, activity=discord.Game("Assisting users with commands"))
+
+
+@bot.command(name='play', help="Play a song or a playlist from a YouTube URL, or search for a song. "
+                                "Several URLs, or an attached text file of them, are queued in order.")
+async def play(ctx, *, url=None):
+    session = sessions.get(ctx.guild.id)
+    queue = session.queue
+
+    # Several URLs, one per line or space-separated, and/or an attached text file of them
+    items, dropped = await batch_items(url, ctx.message.attachments)
+    if len(items) > 1:
+        await load_batch(ctx, session, items, dropped)
+    elif items:
+        url = items[0]
+        try:
+            tracks, total = await load_playlist(session, url)  # Queues the playlist's first page
+            if tracks:
+                if is_search_query(url):
+                    await ctx.send(f"Added {tracks[0].title} to the queue.")
+                else:
+                    await ctx.send(f"Added {total} tracks from the playlist to the queue.")
+            else:
+                await ctx.send("No information could be retrieved from the URL.")
+        except Exception as e:
+            await ctx.send(f"An error occurred: {str(e)}")
+            logging.error(f"Error adding track to queue: {str(e)}")
+            return
+
+    if not queue:
+        await ctx.send("The queue is empty.")
+        return
+    
+    # Ensure the bot is connected to the voice channel, reusing or moving a warm connection
+    if not (ctx.voice_client and ctx.voice_client.is_playing()):
+        if ctx.author.voice:
+            await voice_connections.connect(ctx.author.voice.channel)
+        elif not ctx.voice_client:
+            await ctx.send("You are not connected to a voice channel.")
+            return
+    
+    # If the bot is already playing, do not start a new track
+    if ctx.voice_client.is_playing():
+        await ctx.send("Already playing.")
+        return
+    
+    advance_queue(session)
+    session.voice_client = ctx.voice_client
+
+    try:
+        source, title = await track_source(session, session.current)
+        if source is None:
+            await ctx.send("No information could be retrieved from the URL.")
+            return
+
+        start_playback(ctx, session, ctx.voice_client, source)
+        session.prefetcher.refresh()
+
+        buttons = [
+            discord.ui.Button(label="⏮️ Previous", custom_id="prev", style=discord.ButtonStyle.secondary),
+            discord.ui.Button(label="⏯️ Play/Pause", custom_id="pause_resume", style=discord.ButtonStyle.primary),
+            discord.ui.Button(label="⏭️ Next", custom_id="next", style=discord.ButtonStyle.secondary)
+        ]
+        view = discord.ui.View()
+        for button in buttons:
+            view.add_item(button)
+
+        if session.now_playing:
+            updates.edit_message(session.now_playing, content=f"Now playing: {title}", view=view)
+        else:
+            set_now_playing(session, await ctx.send(f"Now playing: {title}", view=view))
+    except Exception as e:
+        await ctx.send(f"An error occurred: {str(e)}")
+        logging.error(f"Playback error: {str(e)}")
+
+
+@bot.command(name='stop')
+async def stop(ctx):
+    voice_client = ctx.message.guild.voice_client
+    if not voice_client or not voice_client.is_connected():
+        await ctx.send("The bot is not connected to any voice channel.")
+        return
+
+    session = sessions.get(ctx.guild.id)
+    session.queue.clear()
+    session.feed.clear()
+    session.prefetcher.invalidate()
+    end_playback(session)
+    voice_connections.release(ctx.guild)  # Stays connected until the idle timeout
+    
+    await ctx.send("Stopped playing.")
+
+@bot.command(name='next')
+async def next(ctx):
+    voice_client = ctx.message.guild.voice_client
+    if voice_client and voice_client.is_playing():
+        voice_client.stop()
+        await play(ctx)
+    else:
+        await ctx.send("Not currently playing anything.")
+
+@bot.command(name='prev')
+async def prev(ctx):
+    session = sessions.get(ctx.guild.id)
+
+    # The current track, or the last one played once playback has ended
+    track = session.current or (session.history.pop() if session.history else None)
+    if track:
+        session.queue.appendleft(track)
+        journal.record(session.guild_id, 'requeue', track=track)
+        session.prefetcher.invalidate()
+        voice_client = ctx.message.guild.voice_client
+        if voice_client and voice_client.is_playing():
+            voice_client.stop()
+        await play(ctx)
+    else:
+        await ctx.send("No previous track.")
+
+# Interaction callback for buttons
+@bot.event
+async def on_interaction(interaction):
+    voice_client = interaction.guild.voice_client
+    
+    if interaction.data['custom_id'] == 'pause_resume':
+        if voice_client.is_paused():
+            voice_client.resume()
+            idle_disconnect.playing(interaction.guild)
+            await interaction.response.send_message('Resumed playback', ephemeral=True)
+        elif voice_client.is_playing():
+            voice_client.pause()
+            idle_disconnect.stopped(interaction.guild)
+            await interaction.response.send_message('Paused playback', ephemeral=True)
+    
+    elif interaction.data['custom_id'] == 'next':
+        if voice_client is not None and voice_client.is_playing():
+            voice_client.stop()
+            # Call the play command but handle it as an interaction
+            await handle_play_interaction(interaction)
+    
+    elif interaction.data['custom_id'] == 'prev':
+        await handle_play_interaction(interaction)
+
+async def handle_play_interaction(interaction):
+    session = sessions.get(interaction.guild.id)
+
+    if not session.queue:
+        await interaction.response.send_message("The queue is empty.", ephemeral=True)
+        return
+
+    advance_queue(session)
+    voice_client = await voice_connections.connect(interaction.user.voice.channel)
+    session.voice_client = voice_client
+
+    try:
+        # Acknowledge the interaction immediately to avoid timeout
+        await interaction.response.defer()
+
+        source, title = await track_source(session, session.current)
+        if source is None:
+            await interaction.followup.send("No information could be retrieved from the URL.", ephemeral=True)
+            return
+
+        start_playback(interaction, session, voice_client, source)
+        session.prefetcher.refresh()
+
+        buttons = [
+            discord.ui.Button(label="⏮️ Previous", custom_id="prev", style=discord.ButtonStyle.secondary),
+            discord.ui.Button(label="⏯️ Play/Pause", custom_id="pause_resume", style=discord.ButtonStyle.primary),
+            discord.ui.Button(label="⏭️ Next", custom_id="next", style=discord.ButtonStyle.secondary)
+        ]
+        view = discord.ui.View()
+        for button in buttons:
+            view.add_item(button)
+
+        # Edit the existing playback message instead of sending a new one
+        if session.now_playing:
+            updates.edit_message(session.now_playing, content=f"Now playing: {title}", view=view)
+        else:
+            set_now_playing(session, await interaction.followup.send(f"Now playing: {title}", view=view))
+
+    except Exception as e:
+        await interaction.followup.send(f"An error occurred: {str(e)}", ephemeral=True)
+        logging.error(f"Playback error: {str(e)}")
+
+
+@bot.command(name='queue', help="Display the current queue.")
+async def show_queue(ctx):
+    session = sessions.get(ctx.guild.id)
+    if not session.queue:
+        await ctx.send("The queue is empty.")
+        return
+
+    await QueueView(session.queue, format_entry=lambda track: track.title or track.webpage_url,
+                    feed=session.feed).show(ctx)
+
+
+@bot.command(name='keep', help="Keep the current track in the local audio cache.")
+async def keep(ctx):
+    session = sessions.get(ctx.guild.id)
+    if session.current is None:
+        await ctx.send("Nothing is playing.")
+        return
+    if audio_cache.store(session.current.id, session.current.webpage_url) is None:
+        await ctx.send("This track is already cached or being downloaded.")
+        return
+    await ctx.send(f"Caching {session.current.title or session.current.webpage_url} for offline playback.")
+
+
+@bot.command(name='stats', help="Show stream cache and track transition statistics.")
+async def show_stats(ctx):
+    stats = stream_cache.stats()
+    message = (
+        f"Cached videos: {stats['entries']} | hits: {stats['hits']} | misses: {stats['misses']} | "
+        f"coalesced: {stats['coalesced']} | expired: {stats['expired']} | "
+        f"extractions saved: {stats['saved_extractions']} ({stats['hit_rate']:.0%})"
+    )
+    if track_gaps:
+        gaps = sorted(track_gaps)
+        p95 = gaps[min(len(gaps) - 1, int(len(gaps) * 0.95))]
+        message += f"\nTrack gaps: avg {sum(gaps) / len(gaps) * 1000:.0f} ms | p95 {p95 * 1000:.0f} ms over {len(gaps)} transitions"
+    update_stats = updates.stats()
+    message += (
+        f"\nDiscord updates: {update_stats['requested']} requested | {update_stats['sent']} sent | "
+        f"{update_stats['saved']} saved | {update_stats['errors']} failed"
+    )
+    cache_stats = audio_cache.stats()
+    message += (
+        f"\nLocal audio: {cache_stats['files']} files | {cache_stats['bytes'] / 1024 ** 2:.0f} MiB | "
+        f"hits: {cache_stats['hits']} | misses: {cache_stats['misses']}"
+    )
+    search_stats = search_index.stats()
+    message += (
+        f"\nSearch index: {search_stats['queries']} searches | {search_stats['titles']} titles | "
+        f"hits: {search_stats['hits']} | prefix: {search_stats['prefix_hits']} | "
+        f"fuzzy: {search_stats['fuzzy_hits']} | misses: {search_stats['misses']}"
+    )
+    retry_stats = retry_policy.stats()
+    breakers = ', '.join(f"{key} {breaker['state']} ({breaker['trips']} trips, {breaker['shed']} shed)"
+                         for key, breaker in retry_stats['breakers'].items())
+    message += f"\nExtraction retries: {retry_stats['retries']} | gave up: {retry_stats['gave_up']} | {breakers or 'no extractors yet'}"
+    voice_stats = voice_connections.stats()
+    message += (
+        f"\nVoice: {voice_stats['connect']} handshakes (avg {voice_stats['handshake_ms_mean']:.0f} ms, "
+        f"p95 {voice_stats['handshake_ms_p95']:.0f} ms) | {voice_stats['reuse']} reused | {voice_stats['move']} moved"
+    )
+    await ctx.send(message)
+
+
+# Function to run the bot
+def run_bot():
+    bot.run(TOKEN)
+    search_index.save()  # Keep searches made since the last periodic write
+
+if __name__ == '__main__':
+    # Parse the command-line arguments (imported here, like daemon below, to keep them off the import path)
+    from docopt import docopt
+    args = docopt(doc, version='PP Discord Bot 1.0')
+
+    # Run in daemon mode if the --daemon option is specified
+    if args['--daemon']:
+        import daemon
+        import daemon.pidfile
+        workers = int(args['--workers'])
+        pidfile = daemon.pidfile.PIDLockFile(PID_FILE)
+        with daemon.DaemonContext(pidfile=pidfile):
+            setup_logging()  # The log writer thread does not survive daemonizing
+            pid = os.getpid()  # Get the current process PID
+            if workers > 1:
+                logging.info(f"Supervisor running in daemon mode with PID: {pid}")
+                asyncio.run(Supervisor([sys.executable, os.path.abspath(__file__)], workers).run())
+            else:
+                journal.open(sessions)  # Restore guild queues saved before the last restart
+                logging.info(f"Bot running in daemon mode with PID: {pid}")
+                run_bot()
+    elif worker_index() is not None:
+        # Started by the supervisor, which passes the shard range and journal path
+        journal.open(sessions)
+        logging.info(f"Worker {worker_index()} running shards {bot.shard_ids} with PID: {os.getpid()}")
+        run_worker(bot, TOKEN, sessions)
+        search_index.save()
+    else:
+        run_bot()
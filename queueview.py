@@ -0,0 +1,77 @@
+import discord
+
+# Queue entries shown per page
+PAGE_SIZE = 10
+
+# Longest line shown per entry; keeps a page well under the embed size limit
+MAX_ENTRY_CHARS = 200
+
+# Seconds the paging buttons stay active after the last click
+VIEW_TIMEOUT = 180
+
+
+# One embed page of a TrackQueue, paged by editing the same message. Only the visible
+# slice of the queue is read, so rendering costs O(page size) for any queue length.
+# With a QueueFeed, paging past the end of the queue fetches the next playlist page.
+class QueueView(discord.ui.View):
+    def __init__(self, queue, format_entry, title="Current Queue", page_size=PAGE_SIZE, timeout=VIEW_TIMEOUT,
+                 feed=None):
+        super().__init__(timeout=timeout)
+        self.queue = queue
+        self.format_entry = format_entry
+        self.feed = feed
+        self.title = title
+        self.page_size = page_size
+        self.position = 0  # Index of the first entry on the current page
+
+    def page_entries(self):
+        return self.queue.page(self.position, self.position + self.page_size)
+
+    def render(self):
+        total = len(self.queue)
+        last_page_start = max(0, (total - 1) // self.page_size * self.page_size)
+        self.position = min(self.position, last_page_start)
+
+        lines = [
+            f"{index}. {self.format_entry(entry)}"[:MAX_ENTRY_CHARS]
+            for index, entry in enumerate(self.page_entries(), start=self.position + 1)
+        ]
+        embed = discord.Embed(
+            title=self.title,
+            description="\n".join(lines) if lines else "The queue is empty.",
+            color=discord.Color.blue()
+        )
+        pending = self.feed.pending() if self.feed else 0
+        page = self.position // self.page_size + 1
+        if pending is None:
+            embed.set_footer(text=f"Page {page} · {total}+ tracks")
+        else:
+            pages = max(1, (total + pending + self.page_size - 1) // self.page_size)
+            embed.set_footer(text=f"Page {page}/{pages} · {total + pending} tracks")
+
+        self.previous_page.disabled = self.position == 0
+        self.next_page.disabled = self.position + self.page_size >= total and not self.feed
+        return embed
+
+    async def show(self, interaction_or_ctx, **kwargs):
+        embed = self.render()
+        if isinstance(interaction_or_ctx, discord.Interaction):
+            await interaction_or_ctx.response.send_message(embed=embed, view=self, **kwargs)
+        else:
+            await interaction_or_ctx.send(embed=embed, view=self, **kwargs)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.position = max(0, self.position - self.page_size)
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.position += self.page_size
+        if self.feed and self.position + self.page_size > len(self.queue):
+            # Fetching a page can outlast the interaction deadline, so acknowledge first
+            await interaction.response.defer()
+            await self.feed.fill(self.position + self.page_size)
+            await interaction.edit_original_response(embed=self.render(), view=self)
+            return
+        await interaction.response.edit_message(embed=self.render(), view=self)
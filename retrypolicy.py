@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+import metrics
+from ytextract import ExtractionError, is_extraction_error
+
+# Attempts per request, including the first
+RETRY_ATTEMPTS = int(os.getenv('RETRY_ATTEMPTS', 4))
+
+# Backoff before retry n is random between 0 and min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**n)
+# seconds, so guilds that failed together don't retry together
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 0.5))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 8))
+
+# Longest a request may take across all its attempts and backoffs (seconds)
+RETRY_DEADLINE = float(os.getenv('RETRY_DEADLINE', 30))
+
+# Consecutive transient failures after which an extractor's breaker opens, and how long
+# it sheds requests before letting one through to probe it
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 5))
+BREAKER_RESET = float(os.getenv('BREAKER_RESET', 30))
+
+# yt-dlp errors that will fail the same way however often they are retried
+PERMANENT_ERRORS = (
+    'video unavailable', 'private video', 'not available', 'has been removed', 'been terminated',
+    'copyright', 'confirm your age', 'members-only', 'unsupported url', 'is not a valid url',
+    'does not exist', 'http error 404', 'http error 403: forbidden', 'no video formats',
+)
+
+
+# Whether retrying could help: throttling, server errors, network trouble and timeouts
+# are transient; unavailable videos, bad URLs and bugs are not
+def is_transient(error):
+    if isinstance(error, CircuitOpen):
+        return False
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if is_extraction_error(error) or isinstance(error, OSError):
+        message = str(error).lower()
+        return not any(marker in message for marker in PERMANENT_ERRORS)
+    return False
+
+# Breaker key for a URL: its site, with searches and short links counted as YouTube
+def extractor_key(url):
+    if url.startswith('ytsearch'):
+        return 'youtube.com'
+    host = (urlsplit(url).hostname or '').removeprefix('www.').removeprefix('m.').removeprefix('music.')
+    if host in ('youtu.be', ''):
+        return 'youtube.com'  # Bare text goes through the default YouTube search
+    return host
+
+
+# Raised instead of extracting while an extractor's breaker is open. An ExtractionError,
+# so callers handle it like any other failed extraction.
+class CircuitOpen(ExtractionError):
+    pass
+
+
+# Opens after `failures` consecutive transient failures, then after `reset_after`
+# seconds lets a single probe through: success closes it, failure reopens it
+class CircuitBreaker:
+    def __init__(self, failures=BREAKER_FAILURES, reset_after=BREAKER_RESET):
+        self.failure_threshold = failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+        self.shed = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.probing or time.monotonic() - self.opened_at >= self.reset_after:
+            return 'half-open'
+        return 'open'
+
+    # Seconds until the next probe is allowed, or 0 if a request may go ahead now
+    def wait_time(self):
+        if self.opened_at is None:
+            return 0.0
+        if self.probing:
+            return self.reset_after
+        return max(0.0, self.opened_at + self.reset_after - time.monotonic())
+
+    def allow(self):
+        if self.wait_time() > 0:
+            self.shed += 1
+            return False
+        if self.opened_at is not None:
+            self.probing = True
+        return True
+
+    # A probe that ended without an answer (cancelled) lets the next request probe instead
+    def abandon(self):
+        self.probing = False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        if self.probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+            if not self.probing:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+
+# Retries transient failures with jittered exponential backoff within an overall
+# deadline, through one circuit breaker per extractor
+class RetryPolicy:
+    def __init__(self, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 deadline=RETRY_DEADLINE, classify=is_transient, breaker_failures=BREAKER_FAILURES,
+                 breaker_reset=BREAKER_RESET):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.classify = classify
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.breakers = {}  # extractor key -> CircuitBreaker
+        self.retries = 0
+        self.gave_up = 0
+
+    def breaker(self, key):
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+        return breaker
+
+    def backoff(self, retry):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    # Await call() until it succeeds, fails permanently, runs out of attempts or would
+    # overrun the deadline. Returns its result and how many retries it took.
+    async def run(self, url, call):
+        key = extractor_key(url)
+        breaker = self.breaker(key)
+        deadline = time.monotonic() + self.deadline
+        retry = 0
+        while True:
+            if not breaker.allow():
+                self.gave_up += 1
+                raise CircuitOpen(f"Extraction from {key} is paused after repeated failures; "
+                                  f"trying again in {breaker.wait_time():.0f}s")
+            probe = breaker.probing
+            try:
+                result = await asyncio.wait_for(call(), max(0.0, deadline - time.monotonic()))
+            except asyncio.CancelledError:
+                if probe:
+                    breaker.abandon()
+                raise
+            except Exception as e:
+                transient = self.classify(e)
+                if transient:
+                    breaker.failure()
+                else:
+                    breaker.success()  # The extractor answered; the request itself was bad
+                delay = self.backoff(retry)
+                if not transient or retry + 1 >= self.attempts or time.monotonic() + delay >= deadline:
+                    self.gave_up += 1
+                    raise
+                logging.error(f"Extraction of {url} failed (attempt {retry + 1}/{self.attempts}), "
+                              f"retrying in {delay:.1f}s: {e}")
+                retry += 1
+                self.retries += 1
+                metrics.extraction_retries.inc(extractor=key)
+                await asyncio.sleep(delay)
+            else:
+                breaker.success()
+                return result, retry
+
+    def stats(self):
+        return {
+            'retries': self.retries,
+            'gave_up': self.gave_up,
+            'breakers': {key: {'state': breaker.state, 'trips': breaker.trips, 'shed': breaker.shed}
+                         for key, breaker in self.breakers.items()},
+        }
+
+
+# Policy shared by every bot running in this process
+retry_policy = RetryPolicy()
+metrics.extractor_circuit_open.collect_from(
+    lambda: {key: int(breaker.state == 'open') for key, breaker in retry_policy.breakers.items()})
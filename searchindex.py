@@ -0,0 +1,201 @@
+import asyncio
+import bisect
+import difflib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+
+from journal import track_to_record, track_from_record
+from timerwheel import timers
+
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', '/tmp/pyppdisbot-search.json')
+
+# How long a search keeps resolving to the same video (seconds)
+SEARCH_INDEX_TTL = float(os.getenv('SEARCH_INDEX_TTL', 7 * 24 * 3600))
+
+# Maximum number of remembered queries, and separately of remembered played titles
+SEARCH_INDEX_ENTRIES = int(os.getenv('SEARCH_INDEX_ENTRIES', 10000))
+
+# Shortest query that may match a played title by prefix alone
+PREFIX_MIN_CHARS = 8
+
+# Similarity (0-1) a query needs to a played title to count as a fuzzy match
+FUZZY_CUTOFF = 0.85
+
+# Changes are written to disk at most this often (seconds)
+SAVE_DELAY = 30
+
+
+# Case, punctuation and spacing don't change what a search finds
+def normalise_query(text):
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text.casefold()).split())
+
+# True for text yt-dlp would run through default_search rather than open as a URL
+def is_search_query(text):
+    return '://' not in text and not re.match(r'^\S+\.\S+/', text.strip())
+
+
+# Persistent map from normalised search text to the video it found, plus the titles of
+# tracks that were actually played for prefix and fuzzy matching. Lookups are in-memory;
+# the file is rewritten off the event loop a while after the last change.
+class SearchIndex:
+    def __init__(self, path=SEARCH_INDEX_PATH, ttl=SEARCH_INDEX_TTL, max_entries=SEARCH_INDEX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._queries = OrderedDict()  # normalised query -> [track record, stored at]
+        self._titles = OrderedDict()  # video ID -> [track record, normalised title, plays]
+        self._sorted_titles = None  # [(normalised title, video ID)], rebuilt after changes
+        self._words = None  # word -> set of video IDs, rebuilt with _sorted_titles
+        self._save_timer = None
+        self.hits = 0
+        self.prefix_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._queries)
+
+    def load(self):
+        try:
+            with open(self.path) as index_file:
+                data = json.load(index_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read search index {self.path}: {e}")
+            return
+        now = time.time()
+        for query, (record, stored_at) in data.get('queries', {}).items():
+            if stored_at + self.ttl > now:
+                self._queries[query] = [record, stored_at]
+        for video_id, entry in data.get('titles', {}).items():
+            self._titles[video_id] = entry
+        self._sorted_titles = None
+        logging.info(f"Loaded {len(self._queries)} searches and {len(self._titles)} titles from {self.path}")
+
+    def _snapshot(self):
+        return {'queries': dict(self._queries), 'titles': dict(self._titles)}
+
+    def save(self, data=None):
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as index_file:
+            json.dump(data or self._snapshot(), index_file, separators=(',', ':'))
+        os.replace(temporary, self.path)
+
+    # Write the index a while after the first unsaved change, in a thread
+    def _schedule_save(self):
+        if self._save_timer is not None:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()  # No event loop (a script or the benchmarks); just write it now
+            return
+        self._save_timer = timers.schedule(SAVE_DELAY, self.flush)
+
+    # Write any unsaved changes now
+    async def flush(self):
+        if self._save_timer is None:
+            return
+        self._save_timer.cancel()
+        self._save_timer = None
+        try:
+            # Copied on the loop so the thread never sees the index mid-update
+            await asyncio.to_thread(self.save, self._snapshot())
+        except OSError as e:
+            logging.error(f"Could not write search index {self.path}: {e}")
+
+    def put(self, query, track):
+        key = normalise_query(query)
+        if not key:
+            return
+        self._queries[key] = [track_to_record(track), time.time()]
+        self._queries.move_to_end(key)
+        while len(self._queries) > self.max_entries:
+            self._queries.popitem(last=False)
+        self._schedule_save()
+
+    def record_play(self, track):
+        if not track.title or track.title == 'Unknown' or '://' in track.id:
+            return
+        entry = self._titles.pop(track.id, None)
+        plays = entry[2] + 1 if entry else 1
+        self._titles[track.id] = [track_to_record(track), normalise_query(track.title), plays]
+        while len(self._titles) > self.max_entries:
+            self._titles.popitem(last=False)
+        if entry is None or entry[1] != self._titles[track.id][1]:
+            self._sorted_titles = None
+        self._schedule_save()
+
+    def _build_title_index(self):
+        self._sorted_titles = sorted((entry[1], video_id) for video_id, entry in self._titles.items())
+        self._words = {}
+        for title, video_id in self._sorted_titles:
+            for word in title.split():
+                self._words.setdefault(word, set()).add(video_id)
+
+    # Most played title starting with key
+    def _prefix_match(self, key):
+        if len(key) < PREFIX_MIN_CHARS:
+            return None
+        start = bisect.bisect_left(self._sorted_titles, (key,))
+        best = None
+        for title, video_id in self._sorted_titles[start:]:
+            if not title.startswith(key):
+                break
+            if best is None or self._titles[video_id][2] > self._titles[best][2]:
+                best = video_id
+        return best
+
+    # Closest title among those sharing the query's rarest word, so a lookup never scans
+    # every title
+    def _fuzzy_match(self, key):
+        candidates = [self._words[word] for word in key.split() if word in self._words]
+        if not candidates:
+            return None
+        video_ids = min(candidates, key=len)
+        titles = {self._titles[video_id][1]: video_id for video_id in video_ids}
+        matches = difflib.get_close_matches(key, titles, n=1, cutoff=FUZZY_CUTOFF)
+        return titles[matches[0]] if matches else None
+
+    # Track a search should queue without searching again, or None to search remotely
+    def lookup(self, query):
+        key = normalise_query(query)
+        entry = self._queries.get(key)
+        if entry is not None:
+            if entry[1] + self.ttl > time.time():
+                self._queries.move_to_end(key)
+                self.hits += 1
+                return track_from_record(entry[0])
+            del self._queries[key]
+
+        if self._titles and key:
+            if self._sorted_titles is None:
+                self._build_title_index()
+            video_id = self._prefix_match(key)
+            if video_id is not None:
+                self.prefix_hits += 1
+                return track_from_record(self._titles[video_id][0])
+            video_id = self._fuzzy_match(key)
+            if video_id is not None:
+                self.fuzzy_hits += 1
+                return track_from_record(self._titles[video_id][0])
+
+        self.misses += 1
+        return None
+
+    def stats(self):
+        lookups = self.hits + self.prefix_hits + self.fuzzy_hits + self.misses
+        return {
+            'queries': len(self._queries),
+            'titles': len(self._titles),
+            'hits': self.hits,
+            'prefix_hits': self.prefix_hits,
+            'fuzzy_hits': self.fuzzy_hits,
+            'misses': self.misses,
+            'hit_rate': round((lookups - self.misses) / lookups, 3) if lookups else 0.0,
+        }
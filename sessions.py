@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from playlistfeed import QueueFeed
+from trackqueue import TrackQueue
+
+# Sessions without a connected voice client are dropped after this many idle seconds
+SESSION_IDLE_TIMEOUT = 30 * 60
+
+# How often idle sessions are swept (seconds)
+SESSION_SWEEP_INTERVAL = 5 * 60
+
+# Songs remembered for "previous" per guild
+HISTORY_LENGTH = 50
+
+
+# Everything one guild's player owns. Sessions are only touched from the event
+# loop, and each guild has its own, so no locking is needed.
+class GuildSession:
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.queue = TrackQueue()
+        self.feed = QueueFeed(self.queue)  # Playlist pages not fetched into the queue yet
+        self.history = deque(maxlen=HISTORY_LENGTH)
+        self.current = None
+        self.now_playing = None  # Message edited with the current track
+        self.voice_client = None
+        self.last_active = time.monotonic()
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def is_idle(self, now, timeout):
+        voice_client = self.voice_client
+        if voice_client is not None and voice_client.is_connected():
+            return False
+        return now - self.last_active >= timeout
+
+
+# Lazily creates one session per guild and evicts the ones that went idle
+class SessionRegistry:
+    def __init__(self, session_class=GuildSession, idle_timeout=SESSION_IDLE_TIMEOUT,
+                 sweep_interval=SESSION_SWEEP_INTERVAL):
+        self.session_class = session_class
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self._sessions = {}
+        self._sweeper = None
+        self.on_create = None  # Called with each new session
+        self.on_evict = None  # Called with each session evicted as idle
+        self.created = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(list(self._sessions.values()))
+
+    def __contains__(self, guild_id):
+        return guild_id in self._sessions
+
+    # Session for guild_id, created on first use
+    def get(self, guild_id):
+        session = self._sessions.get(guild_id)
+        if session is None:
+            session = self._sessions[guild_id] = self.session_class(guild_id)
+            self.created += 1
+            if self.on_create is not None:
+                self.on_create(session)
+            self._start_sweeper()
+        session.touch()
+        return session
+
+    # Session for guild_id if one exists, without creating or touching it
+    def peek(self, guild_id):
+        return self._sessions.get(guild_id)
+
+    def remove(self, guild_id):
+        return self._sessions.pop(guild_id, None)
+
+    def evict_idle(self, now=None):
+        now = time.monotonic() if now is None else now
+        idle = [guild_id for guild_id, session in self._sessions.items()
+                if session.is_idle(now, self.idle_timeout)]
+        for guild_id in idle:
+            session = self._sessions.pop(guild_id)
+            if self.on_evict is not None:
+                self.on_evict(session)
+        self.evicted += len(idle)
+        if idle:
+            logging.info(f"Evicted {len(idle)} idle guild sessions, {len(self._sessions)} remaining")
+        return len(idle)
+
+    def _start_sweeper(self):
+        if self._sweeper is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # No loop yet; the sweeper starts with the first session created on one
+        self._sweeper = loop.create_task(self._sweep_forever())
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.evict_idle()
+
+    def stats(self):
+        return {'sessions': len(self._sessions), 'created': self.created, 'evicted': self.evicted}
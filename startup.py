@@ -0,0 +1,85 @@
+import time
+
+# Taken when the bots import this module, which they do before anything else
+STARTED = time.perf_counter()
+
+import hashlib
+import json
+import logging
+import os
+
+import metrics
+
+# Hash of the last command tree synced to Discord, per application
+COMMAND_SYNC_PATH = os.getenv('COMMAND_SYNC_PATH', '/tmp/disbot-command-tree.json')
+
+# Sync the command tree on every start even if it hasn't changed
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '') not in ('', '0')
+
+startup_seconds = metrics.Gauge('disbot_startup_seconds', "Seconds from process start to each startup phase",
+                                labels=('phase',))
+metrics.REGISTRY.append(startup_seconds)
+
+_phases = {}  # phase -> seconds after STARTED
+_synced = {}  # application key -> hash synced by this process
+
+
+# Record how long startup took to reach a phase ('imports', 'ready'); only the first time counts
+def mark(phase):
+    if phase in _phases:
+        return
+    _phases[phase] = seconds = time.perf_counter() - STARTED
+    startup_seconds.set(round(seconds, 3), phase=phase)
+    logging.info(f"Startup: {phase} after {seconds * 1000:.0f} ms")
+
+def phases():
+    return dict(_phases)
+
+# Mark 'ready' when the bot first connects
+def install(bot):
+    async def on_ready():
+        mark('ready')
+
+    bot.add_listener(on_ready, 'on_ready')
+
+
+# Stable hash of every command in the tree, as Discord would receive it
+def tree_hash(tree):
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda data: data['name'])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def _load_hashes(path):
+    try:
+        with open(path) as sync_file:
+            return json.load(sync_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.error(f"Could not read command sync state {path}: {e}")
+        return {}
+
+# Sync the bot's command tree only if it differs from the last one synced. Syncing is a
+# slow, rate-limited global call, and on_ready runs again on every reconnect.
+# Returns True if the tree was synced.
+async def sync_commands(bot, path=COMMAND_SYNC_PATH, force=FORCE_COMMAND_SYNC):
+    key = str(bot.application_id or 'default')
+    digest = tree_hash(bot.tree)
+    if not force and _synced.get(key) == digest:
+        return False
+    hashes = _load_hashes(path)
+    if not force and hashes.get(key) == digest:
+        _synced[key] = digest
+        logging.info("Command tree unchanged since the last sync; not syncing")
+        return False
+
+    await bot.tree.sync()
+    _synced[key] = hashes[key] = digest
+    try:
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as sync_file:
+            json.dump(hashes, sync_file)
+        os.replace(temporary, path)
+    except OSError as e:
+        logging.error(f"Could not write command sync state {path}: {e}")
+    logging.info(f"Synced {len(bot.tree.get_commands())} commands")
+    return True
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+# Maximum number of resolved videos kept in memory
+MAX_ENTRIES = 2048
+
+# Lifetime for stream URLs that carry no expire= timestamp (seconds)
+DEFAULT_TTL = 30 * 60
+
+# Treat URLs as expired this long before the CDN does (seconds)
+EXPIRY_MARGIN = 5 * 60
+
+# Extract the YouTube video ID from a watch/short/embed URL, or fall back to the URL itself
+def video_id_from_url(url):
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    if host.endswith('youtu.be'):
+        return parsed.path.lstrip('/').split('/')[0] or url
+    if 'youtube' in host:
+        video_id = parse_qs(parsed.query).get('v')
+        if video_id:
+            return video_id[0]
+        parts = [part for part in parsed.path.split('/') if part]
+        if len(parts) >= 2 and parts[0] in ('shorts', 'embed', 'live', 'v'):
+            return parts[1]
+    return url
+
+# True for a URL that names a single YouTube video (and not a playlist around it)
+def is_video_url(url):
+    return video_id_from_url(url) != url and 'list' not in parse_qs(urlparse(url).query)
+
+# Read the expire= timestamp googlevideo embeds in the query string or path
+def stream_expiry(stream_url):
+    parsed = urlparse(stream_url)
+    expire = parse_qs(parsed.query).get('expire')
+    if expire:
+        value = expire[0]
+    else:
+        parts = parsed.path.split('/')
+        if 'expire' not in parts or parts.index('expire') + 1 >= len(parts):
+            return None
+        value = parts[parts.index('expire') + 1]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+# True if a resolved stream URL has expired (or is about to)
+def stream_url_expired(stream_url, margin=EXPIRY_MARGIN):
+    expires_at = stream_expiry(stream_url)
+    return expires_at is not None and expires_at - margin <= time.time()
+
+
+class StreamCache:
+    def __init__(self, max_entries=MAX_ENTRIES, default_ttl=DEFAULT_TTL, margin=EXPIRY_MARGIN):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.margin = margin
+        self._entries = OrderedDict()  # video ID -> (expires_at, info)
+        self._inflight = {}  # video ID -> extraction task shared by all waiters
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, info = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.expired += 1
+            return None
+        self._entries.move_to_end(key)
+        return info
+
+    def put(self, key, info):
+        stream_url = info.get('url') if info else None
+        if not stream_url or 'entries' in info:
+            return  # Only single videos with a playable URL are cached
+        expires_at = stream_expiry(stream_url)
+        if expires_at is None:
+            expires_at = time.time() + self.default_ttl
+        else:
+            expires_at -= self.margin
+        self._entries[key] = (expires_at, info)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    # Return cached info for url, or run extract(url) once no matter how many callers ask
+    async def resolve(self, url, extract):
+        key = video_id_from_url(url)
+        info = self.get(key)
+        if info is not None:
+            self.hits += 1
+            return info
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(extract(url))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self.put(key, task.result())
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'saved_extractions': self.hits + self.coalesced,
+            'hit_rate': round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+        }
+
+    def log_stats(self):
+        logging.info(f"Stream cache stats: {self.stats()}")
+
+
+# Cache shared by every bot running in this process
+stream_cache = StreamCache()
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+import discord
+import yarl
+
+import metrics
+
+# Unix socket workers report their health to
+SUPERVISOR_SOCKET = os.getenv('SUPERVISOR_SOCKET', '/tmp/pyppdisbot-supervisor.sock')
+
+# Total shards across all workers; defaults to one per worker
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 0))
+
+# Seconds between health reports from each worker
+HEALTH_INTERVAL = float(os.getenv('HEALTH_INTERVAL', 5))
+
+# A worker that has not reported for this long (after its startup grace) is killed and restarted
+HEALTH_TIMEOUT = float(os.getenv('HEALTH_TIMEOUT', 60))
+STARTUP_GRACE = float(os.getenv('WORKER_STARTUP_GRACE', 120))
+
+# Restart delay after a crash doubles up to the maximum, and resets once a worker stays up
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+STABLE_SECONDS = 300
+
+# Seconds workers get to shut down cleanly before they are killed
+STOP_TIMEOUT = 10
+
+# Point the bot at another Discord API and gateway (the local stub in benchshards.py)
+DISCORD_API_BASE = os.getenv('DISCORD_API_BASE')
+DISCORD_GATEWAY = os.getenv('DISCORD_GATEWAY')
+
+
+# Contiguous shard IDs for each worker
+def shard_ranges(shard_count, workers):
+    return [list(range(shard_count * index // workers, shard_count * (index + 1) // workers))
+            for index in range(workers)]
+
+
+# Keyword arguments for an AutoShardedBot when this process is a supervisor's worker, else {}
+def worker_shards():
+    shard_ids = os.getenv('SHARD_IDS')
+    if not shard_ids:
+        return {}
+    return {'shard_ids': [int(shard_id) for shard_id in shard_ids.split(',')],
+            'shard_count': int(os.environ['SHARD_COUNT'])}
+
+def worker_index():
+    index = os.getenv('WORKER_INDEX')
+    return int(index) if index is not None else None
+
+
+def _health_report(bot, sessions):
+    return {
+        'worker': worker_index(),
+        'pid': os.getpid(),
+        'shards': list(bot.shard_ids or []),
+        'ready': bot.is_ready(),
+        'guilds': len(bot.guilds),
+        'sessions': len(sessions),
+        'voice_clients': sum(1 for vc in bot.voice_clients if vc.is_connected()),
+        'latency': None if bot.latency != bot.latency else round(bot.latency, 4),  # NaN before the first heartbeat
+        'metrics': metrics.render(),
+    }
+
+# Send a health report to the supervisor every HEALTH_INTERVAL, reconnecting if it restarts
+async def report_health(bot, sessions, path=SUPERVISOR_SOCKET, interval=HEALTH_INTERVAL):
+    while True:
+        try:
+            _, writer = await asyncio.open_unix_connection(path)
+            try:
+                while True:
+                    writer.write(json.dumps(_health_report(bot, sessions)).encode() + b'\n')
+                    await writer.drain()
+                    await asyncio.sleep(interval)
+            finally:
+                writer.close()
+        except (ConnectionError, OSError) as e:
+            logging.error(f"Health report to {path} failed: {e}")
+            await asyncio.sleep(interval)
+
+# Run a worker's bot until it is closed or the supervisor sends SIGTERM
+def run_worker(bot, token, sessions):
+    if DISCORD_API_BASE:
+        discord.http.Route.BASE = DISCORD_API_BASE
+    if DISCORD_GATEWAY:
+        discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(DISCORD_GATEWAY)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, lambda: loop.create_task(bot.close()))
+        metrics.start_lag_sampler()
+        reporter = loop.create_task(report_health(bot, sessions))
+        try:
+            async with bot:
+                await bot.start(token)
+        finally:
+            reporter.cancel()
+
+    asyncio.run(main())
+
+
+class Worker:
+    def __init__(self, index, shard_ids):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.restart_delay = RESTART_DELAY
+        self.report = None
+        self.reported_at = None
+
+
+# Runs `command` once per shard range as a worker process, restarts workers that exit or
+# stop reporting, and serves their merged health and metrics. Workers get their shard
+# range, log file and journal through the environment, so the bot code stays the same.
+class Supervisor:
+    def __init__(self, command, workers, shard_count=SHARD_COUNT, socket_path=SUPERVISOR_SOCKET,
+                 env=None, metrics_port=metrics.METRICS_PORT, metrics_host=metrics.METRICS_HOST):
+        self.command = command
+        self.shard_count = max(shard_count, workers)  # Every worker needs at least one shard
+        self.socket_path = socket_path
+        self.env = dict(os.environ if env is None else env)
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.workers = [Worker(index, shard_ids)
+                        for index, shard_ids in enumerate(shard_ranges(self.shard_count, workers))]
+        self._stopping = None
+        self._tasks = []
+
+    def _worker_env(self, worker):
+        env = dict(self.env)
+        suffix = f"worker{worker.index}"
+        env.update({
+            'WORKER_INDEX': str(worker.index),
+            'SHARD_IDS': ','.join(str(shard_id) for shard_id in worker.shard_ids),
+            'SHARD_COUNT': str(self.shard_count),
+            'SUPERVISOR_SOCKET': self.socket_path,
+            'METRICS_PORT': '0',  # The supervisor serves every worker's metrics
+            'LOG_FILE': f"{env.get('LOG_FILE', '/tmp/pyppdisbot.log')}.{suffix}",
+            # A worker always owns the same shards, so its journal holds the same guilds
+            'JOURNAL_PATH': f"{env.get('JOURNAL_PATH', '/tmp/pyppdisbot.journal')}.{suffix}",
+            # Each worker keeps its search index in memory and rewrites the whole file
+            'SEARCH_INDEX_PATH': f"{env.get('SEARCH_INDEX_PATH', '/tmp/pyppdisbot-search.json')}.{suffix}",
+        })
+        return env
+
+    async def _spawn(self, worker):
+        worker.process = await asyncio.create_subprocess_exec(*self.command, env=self._worker_env(worker))
+        worker.started_at = time.monotonic()
+        worker.report = None
+        worker.reported_at = None
+        logging.info(f"Started worker {worker.index} (PID {worker.process.pid}) for shards {worker.shard_ids}")
+
+    # Keep one worker running, restarting it with backoff whenever it exits
+    async def _keep_running(self, worker):
+        while not self._stopping.is_set():
+            await self._spawn(worker)
+            returncode = await worker.process.wait()
+            if self._stopping.is_set():
+                break
+            if time.monotonic() - worker.started_at > STABLE_SECONDS:
+                worker.restart_delay = RESTART_DELAY
+            logging.error(f"Worker {worker.index} exited with {returncode}; restarting in {worker.restart_delay:.0f}s")
+            worker.restarts += 1
+            try:
+                await asyncio.wait_for(self._stopping.wait(), worker.restart_delay)
+            except asyncio.TimeoutError:
+                pass
+            worker.restart_delay = min(worker.restart_delay * 2, MAX_RESTART_DELAY)
+
+    # Kill workers that are running but have stopped reporting (a hung event loop)
+    async def _watch_health(self):
+        while not self._stopping.is_set():
+            await asyncio.sleep(HEALTH_INTERVAL)
+            now = time.monotonic()
+            for worker in self.workers:
+                process = worker.process
+                if process is None or process.returncode is not None:
+                    continue
+                last_seen = worker.reported_at or worker.started_at + STARTUP_GRACE
+                if now - last_seen > HEALTH_TIMEOUT:
+                    logging.error(f"Worker {worker.index} has not reported for {now - last_seen:.0f}s; killing it")
+                    process.kill()
+
+    async def _receive_reports(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                report = json.loads(line)
+                worker = self.workers[report['worker']]
+                if worker.process is not None and report['pid'] == worker.process.pid:
+                    worker.report = report
+                    worker.reported_at = time.monotonic()
+        except (ConnectionError, ValueError, KeyError, IndexError) as e:
+            logging.error(f"Bad health report: {e}")
+        finally:
+            writer.close()
+
+    def health(self):
+        now = time.monotonic()
+        workers = []
+        for worker in self.workers:
+            report = worker.report or {}
+            running = worker.process is not None and worker.process.returncode is None
+            workers.append({
+                'worker': worker.index,
+                'pid': worker.process.pid if running else None,
+                'shards': worker.shard_ids,
+                'restarts': worker.restarts,
+                'ready': running and report.get('ready', False),
+                'guilds': report.get('guilds', 0),
+                'voice_clients': report.get('voice_clients', 0),
+                'latency': report.get('latency'),
+                'report_age': round(now - worker.reported_at, 1) if worker.reported_at else None,
+            })
+        return {
+            'workers': workers,
+            'ready': sum(1 for worker in workers if worker['ready']),
+            'guilds': sum(worker['guilds'] for worker in workers),
+            'voice_clients': sum(worker['voice_clients'] for worker in workers),
+            'restarts': sum(worker['restarts'] for worker in workers),
+        }
+
+    def render_metrics(self):
+        health = self.health()
+        own = [
+            '# HELP disbot_workers_ready Worker processes whose bot is ready',
+            '# TYPE disbot_workers_ready gauge',
+            f"disbot_workers_ready {health['ready']}",
+            '# HELP disbot_worker_restarts_total Worker processes restarted after exiting or hanging',
+            '# TYPE disbot_worker_restarts_total counter',
+            f"disbot_worker_restarts_total {health['restarts']}",
+        ]
+        expositions = [({}, '\n'.join(own))]
+        for worker in self.workers:
+            if worker.report:
+                expositions.append(({'worker': worker.index}, worker.report['metrics']))
+        return metrics.merge(expositions)
+
+    async def run(self):
+        self._stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self._stopping.set)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # Left over from a supervisor that was killed
+        server = await asyncio.start_unix_server(self._receive_reports, self.socket_path)
+        http = None
+        if self.metrics_port:
+            http = await metrics.serve(self.metrics_port, self.metrics_host, {
+                '/metrics': (self.render_metrics, metrics.PROMETHEUS_CONTENT_TYPE),
+                '/health': (lambda: json.dumps(self.health()), 'application/json'),
+            })
+            logging.info(f"Serving worker metrics and health on http://{self.metrics_host}:{self.metrics_port}")
+
+        logging.info(f"Supervising {len(self.workers)} workers over {self.shard_count} shards")
+        self._tasks = [loop.create_task(self._keep_running(worker)) for worker in self.workers]
+        self._tasks.append(loop.create_task(self._watch_health()))
+        try:
+            await self._stopping.wait()
+        finally:
+            await self.stop()
+            server.close()
+            if http is not None:
+                http.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    # Ask every worker to shut down, killing those that don't in time
+    async def stop(self):
+        self._stopping.set()
+        running = [worker.process for worker in self.workers
+                   if worker.process is not None and worker.process.returncode is None]
+        for process in running:
+            process.terminate()
+        for process in running:
+            try:
+                await asyncio.wait_for(process.wait(), STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -1,27 +1,22 @@
-import yt_dlp as ytdl
-from yt_dlp.utils import DownloadError, ExtractorError
-import time
+import asyncio
 
-def extract_info_with_retries(ydl, url, retries=5, delay=3):
-    for attempt in range(retries):
-        try:
-            return ydl.extract_info(url, download=False)
-        except (DownloadError, ExtractorError) as e:
-            if attempt < retries - 1:
-                print(f"Error extracting info (attempt {attempt + 1}/{retries}), retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                raise e
+from ytextract import extract
+from retrypolicy import retry_policy
 
-def load_playlist(playlist_url):
-    ydl_opts = {'extract_flat': 'in_playlist'}
-    with ytdl.YoutubeDL(ydl_opts) as ydl:
-        info = extract_info_with_retries(ydl, playlist_url)
-        if 'entries' in info:
-            return [entry['url'] for entry in info['entries']]
-        return []
+# Extraction runs on the extraction backend and retries back off with asyncio.sleep,
+# so nothing here blocks an event loop it shares with a bot
+async def extract_info_with_retries(url, profile='playlist'):
+    info, _ = await retry_policy.run(url, lambda: extract(url, profile))
+    return info
 
-# Example usage:
-playlist_url = "https://www.youtube.com/watch?v=PhidpMS6Tdw"
-urls = load_playlist(playlist_url)
-print(urls)  # Should print the list of video URLs from the playlist
+async def load_playlist(playlist_url):
+    info = await extract_info_with_retries(playlist_url)
+    if 'entries' in info:
+        return [entry['url'] for entry in info['entries']]
+    return []
+
+if __name__ == '__main__':
+    # Example usage:
+    playlist_url = "https://www.youtube.com/watch?v=PhidpMS6Tdw"
+    urls = asyncio.run(load_playlist(playlist_url))
+    print(urls)  # Should print the list of video URLs from the playlist
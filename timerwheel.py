@@ -0,0 +1,110 @@
+import asyncio
+import logging
+
+# Resolution of the shared wheel (seconds); idle timeouts don't need better
+TICK_SECONDS = 1.0
+
+# Slots per revolution; timers further out than one revolution wait extra rounds
+WHEEL_SLOTS = 512
+
+
+class Timer:
+    __slots__ = ('wheel', 'callback', 'args', 'rounds', 'slot', 'cancelled')
+
+    def __init__(self, wheel, callback, args, rounds, slot):
+        self.wheel = wheel
+        self.callback = callback
+        self.args = args
+        self.rounds = rounds
+        self.slot = slot
+        self.cancelled = False
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self.wheel._remove(self)
+
+
+# Hashed timing wheel: one task advances a cursor one slot per tick and fires the timers
+# in that slot. Scheduling and cancelling are O(1), and the task only runs while at least
+# one timer is pending, so thousands of idle guilds cost a set entry each and no CPU.
+class TimerWheel:
+    def __init__(self, tick=TICK_SECONDS, slots=WHEEL_SLOTS):
+        self.tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._cursor = 0
+        self._pending = 0
+        self._task = None
+        self._running = set()  # Tasks running coroutines returned by callbacks
+        self.fired = 0
+        self.cancelled = 0
+
+    def __len__(self):
+        return self._pending
+
+    # Call callback(*args) after roughly `delay` seconds (rounded up to whole ticks)
+    def schedule(self, delay, callback, *args):
+        ticks = max(1, -int(-delay // self.tick))
+        slot = (self._cursor + ticks) % len(self._slots)
+        timer = Timer(self, callback, args, (ticks - 1) // len(self._slots), slot)
+        self._slots[slot].add(timer)
+        self._pending += 1
+        self._start()
+        return timer
+
+    def _remove(self, timer):
+        slot = self._slots[timer.slot]
+        if timer in slot:
+            slot.discard(timer)
+            self._pending -= 1
+            self.cancelled += 1
+
+    def _start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self.tick
+        while self._pending:
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            # Catch up on every tick that passed, in case the loop was busy
+            while next_tick <= loop.time() and self._pending:
+                self._advance()
+                next_tick += self.tick
+        self._task = None
+
+    def _advance(self):
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        slot = self._slots[self._cursor]
+        due = [timer for timer in slot if timer.rounds == 0]
+        for timer in slot:
+            timer.rounds -= 1
+        for timer in due:
+            slot.discard(timer)
+            self._pending -= 1
+            timer.cancelled = True  # Fired timers can't be cancelled any more
+            self.fired += 1
+            try:
+                result = timer.callback(*timer.args)
+                if asyncio.iscoroutine(result):
+                    task = asyncio.ensure_future(result)
+                    self._running.add(task)
+                    task.add_done_callback(self._finished)
+            except Exception as e:
+                logging.error(f"Timer callback failed: {e}")
+
+    # A coroutine a callback returned has ended; its failure is logged like a callback's
+    def _finished(self, task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Timer callback failed: {task.exception()}")
+
+    def stats(self):
+        return {'pending': self._pending, 'fired': self.fired, 'cancelled': self.cancelled}
+
+
+# Wheel shared by everything in this process
+timers = TimerWheel()
@@ -0,0 +1,173 @@
+import random
+import sys
+
+from streamcache import video_id_from_url
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+# Slim queued track. `id` is the YouTube video ID, or the page URL for other sites
+# (the same key the stream cache uses). stream_url and codec are None until the track is resolved.
+class Track:
+    __slots__ = ('id', 'title', 'uploader', 'duration', 'stream_url', 'codec')
+
+    def __init__(self, id, title=None, uploader=None, duration=None, stream_url=None, codec=None):
+        self.id = _intern(id)
+        self.title = _intern(title)
+        self.uploader = _intern(uploader)
+        self.duration = duration
+        self.stream_url = stream_url
+        self.codec = _intern(codec)
+
+    @classmethod
+    def from_url(cls, url):
+        return cls(video_id_from_url(url))
+
+    # Build a track from a resolved yt-dlp info dict (or slim record) or a flat
+    # playlist entry, whose 'url' is the video page rather than a stream
+    @classmethod
+    def from_info(cls, info, url=None):
+        resolved = bool(info.get('webpage_url'))
+        page_url = info.get('webpage_url') or url or info.get('url')
+        track_id = video_id_from_url(page_url) if page_url else info.get('id')
+        stream_url = info.get('url') if resolved else None
+        return cls(
+            track_id,
+            title=info.get('title', 'Unknown'),
+            uploader=info.get('uploader') or info.get('channel') or 'Unknown',
+            duration=info.get('duration'),
+            stream_url=stream_url,
+            codec=info.get('acodec') if resolved else None,
+        )
+
+    @property
+    def webpage_url(self):
+        if '://' in self.id:
+            return self.id
+        return f"https://www.youtube.com/watch?v={self.id}"
+
+    def __repr__(self):
+        return f"Track({self.id!r}, {self.title!r})"
+
+
+# Queue of tracks in a growable ring buffer: O(1) append/pop at both ends and O(1)
+# indexed access, so a page of the queue can be read without walking it.
+class TrackQueue:
+    __slots__ = ('_items', '_head', '_size')
+
+    def __init__(self, tracks=(), capacity=16):
+        self._items = [None] * capacity
+        self._head = 0
+        self._size = 0
+        self.extend(tracks)
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __iter__(self):
+        items, head, capacity = self._items, self._head, len(self._items)
+        for offset in range(self._size):
+            yield items[(head + offset) % capacity]
+
+    def _slot(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("track queue index out of range")
+        return (self._head + index) % len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.page(*index.indices(self._size)[:2])
+        return self._items[self._slot(index)]
+
+    # Tracks from start (inclusive) to stop (exclusive), O(stop - start)
+    def page(self, start, stop):
+        start, stop = max(0, start), min(self._size, stop)
+        items, head, capacity = self._items, self._head, len(self._items)
+        return [items[(head + offset) % capacity] for offset in range(start, stop)]
+
+    def _grow(self):
+        self._items = list(self) + [None] * len(self._items)
+        self._head = 0
+
+    def append(self, track):
+        if self._size == len(self._items):
+            self._grow()
+        self._items[(self._head + self._size) % len(self._items)] = track
+        self._size += 1
+
+    def appendleft(self, track):
+        if self._size == len(self._items):
+            self._grow()
+        self._head = (self._head - 1) % len(self._items)
+        self._items[self._head] = track
+        self._size += 1
+
+    def extend(self, tracks):
+        for track in tracks:
+            self.append(track)
+
+    def popleft(self):
+        if not self._size:
+            raise IndexError("pop from an empty track queue")
+        track = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % len(self._items)
+        self._size -= 1
+        return track
+
+    def pop(self):
+        if not self._size:
+            raise IndexError("pop from an empty track queue")
+        slot = self._slot(-1)
+        track = self._items[slot]
+        self._items[slot] = None
+        self._size -= 1
+        return track
+
+    def clear(self):
+        self._items = [None] * 16
+        self._head = 0
+        self._size = 0
+
+    # Remove and return the track at index, shifting whichever side is shorter
+    def remove_at(self, index):
+        if index < 0:
+            index += self._size
+        self._slot(index)  # Bounds check
+        track = self[index]
+        if index < self._size // 2:
+            for offset in range(index, 0, -1):
+                self._items[self._slot(offset)] = self._items[self._slot(offset - 1)]
+            self.popleft()
+        else:
+            for offset in range(index, self._size - 1):
+                self._items[self._slot(offset)] = self._items[self._slot(offset + 1)]
+            self.pop()
+        return track
+
+    # Move the track at src so it ends up at dst
+    def move(self, src, dst):
+        track = self.remove_at(src)
+        if dst < 0:
+            dst += self._size + 1
+        dst = max(0, min(dst, self._size))
+        if dst == 0:
+            self.appendleft(track)
+            return
+        self.append(track)
+        for offset in range(self._size - 1, dst, -1):
+            self._items[self._slot(offset)] = self._items[self._slot(offset - 1)]
+        self._items[self._slot(dst)] = track
+
+    def shuffle(self):
+        tracks = list(self)
+        random.shuffle(tracks)
+        self._items = tracks + [None] * max(16, len(tracks))
+        self._head = 0
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+
+# Minimum seconds between two message edits in the same channel; Discord rate limits
+# edits per channel, not per message
+MESSAGE_EDIT_INTERVAL = 1.0
+
+# Minimum seconds between presence updates (the gateway allows roughly 5 per minute)
+PRESENCE_INTERVAL = 12.0
+
+
+# Outbound Discord updates that only need their latest state delivered. Each message or
+# presence keeps one pending update, and newer requests overwrite it. Updates share a
+# route (a channel's messages, or a bot's presence) and leave one at a time, each no
+# sooner than the route's interval after the previous send. discord.py itself waits out
+# any 429 it still gets.
+class UpdateScheduler:
+    def __init__(self, message_interval=MESSAGE_EDIT_INTERVAL, presence_interval=PRESENCE_INTERVAL):
+        self.message_interval = message_interval
+        self.presence_interval = presence_interval
+        self._pending = {}  # key -> (send coroutine function, kwargs)
+        self._waiting = {}  # route -> {key: None} of pending updates, oldest first
+        self._last_sent = {}  # route -> monotonic time of the last send
+        self._scheduled = set()  # routes with a flush already waiting
+        self.requested = 0
+        self.sent = 0
+        self.superseded = 0
+        self.errors = 0
+
+    # Queue message.edit(**fields); fields from earlier pending edits are kept unless overridden
+    def edit_message(self, message, **fields):
+        key = ('message', message.id)
+        pending = self._pending.get(key)
+        if pending is not None:
+            fields = {**pending[1], **fields}
+        channel_id = getattr(getattr(message, 'channel', None), 'id', None)
+        route = ('channel', channel_id) if channel_id is not None else key
+        self._request(key, route, message.edit, fields, self.message_interval)
+
+    # Queue bot.change_presence(**fields), replacing any presence not yet sent
+    def change_presence(self, bot, **fields):
+        key = ('presence', id(bot))
+        self._request(key, key, bot.change_presence, fields, self.presence_interval)
+
+    def _request(self, key, route, send, fields, interval):
+        self.requested += 1
+        if key in self._pending:
+            self.superseded += 1
+        self._pending[key] = (send, fields)
+        self._waiting.setdefault(route, {})[key] = None
+        self._schedule(route, interval)
+
+    def _schedule(self, route, interval):
+        if route in self._scheduled:
+            return
+        self._scheduled.add(route)
+        delay = max(0.0, self._last_sent.get(route, 0.0) + interval - time.monotonic())
+        loop = asyncio.get_running_loop()
+        loop.call_later(delay, lambda: loop.create_task(self._flush(route, interval)))
+
+    # Send the route's oldest pending update, and schedule the next one if there is one
+    async def _flush(self, route, interval):
+        self._scheduled.discard(route)
+        waiting = self._waiting.get(route)
+        if not waiting:
+            self._waiting.pop(route, None)
+            return
+        key = next(iter(waiting))
+        del waiting[key]
+        self._last_sent[route] = time.monotonic()
+        if len(self._last_sent) > 10000:
+            self._forget_stale()
+        if waiting:
+            self._schedule(route, interval)
+        else:
+            del self._waiting[route]
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        send, fields = pending
+        try:
+            await send(**fields)
+            self.sent += 1
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Failed to send update {key[0]}: {e}")
+
+    # Drop send times older than any interval so the table doesn't grow without bound
+    def _forget_stale(self):
+        cutoff = time.monotonic() - max(self.message_interval, self.presence_interval)
+        for key in [key for key, sent_at in self._last_sent.items() if sent_at < cutoff]:
+            del self._last_sent[key]
+
+    def stats(self):
+        return {
+            'requested': self.requested,
+            'sent': self.sent,
+            'saved': self.requested - self.sent - len(self._pending),
+            'superseded': self.superseded,
+            'errors': self.errors,
+        }
+
+
+# Scheduler shared by every bot running in this process
+updates = UpdateScheduler()
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import metrics
+from timerwheel import timers
+
+# Seconds a connected voice client may go without playing before it leaves
+IDLE_DISCONNECT_AFTER = float(os.getenv('IDLE_DISCONNECT_AFTER', 120))
+
+# Seconds the bot stays in a voice channel after the last listener left
+EMPTY_DISCONNECT_AFTER = float(os.getenv('EMPTY_DISCONNECT_AFTER', 30))
+
+
+def has_listeners(channel):
+    return any(not member.bot for member in channel.members)
+
+
+# Leaves voice channels that are idle or empty. Driven by playback transitions (the bot
+# calls playing()/stopped()) and on_voice_state_update rather than polling, with at most
+# one timer per guild per reason on the shared timer wheel.
+class IdleDisconnect:
+    def __init__(self, bot, idle_after=IDLE_DISCONNECT_AFTER, empty_after=EMPTY_DISCONNECT_AFTER,
+                 wheel=timers, on_disconnect=None):
+        self.bot = bot
+        self.idle_after = idle_after
+        self.empty_after = empty_after
+        self.wheel = wheel
+        self.on_disconnect = on_disconnect  # Awaited with (guild, reason) after leaving
+        self._timers = {}  # (guild ID, 'idle' | 'empty') -> Timer
+        self.disconnects = 0
+        bot.add_listener(self.on_voice_state_update, 'on_voice_state_update')
+
+    def _arm(self, guild_id, reason, delay):
+        self._cancel(guild_id, reason)
+        self._timers[(guild_id, reason)] = self.wheel.schedule(delay, self._expire, guild_id, reason)
+
+    def _cancel(self, guild_id, reason):
+        timer = self._timers.pop((guild_id, reason), None)
+        if timer is not None:
+            timer.cancel()
+
+    def playing(self, guild):
+        self._cancel(guild.id, 'idle')
+
+    def stopped(self, guild):
+        voice_client = guild.voice_client
+        if voice_client is not None and voice_client.is_connected():
+            self._arm(guild.id, 'idle', self.idle_after)
+
+    def forget(self, guild_id):
+        self._cancel(guild_id, 'idle')
+        self._cancel(guild_id, 'empty')
+
+    async def on_voice_state_update(self, member, before, after):
+        guild = member.guild
+        if self.bot.user is not None and member.id == self.bot.user.id and after.channel is None:
+            self.forget(guild.id)  # The bot itself left or was disconnected
+            return
+        voice_client = guild.voice_client
+        if voice_client is None or not voice_client.is_connected():
+            return
+        channel = voice_client.channel
+        if channel not in (before.channel, after.channel) and member.id != getattr(self.bot.user, 'id', None):
+            return  # Someone else's channel
+        if has_listeners(channel):
+            self._cancel(guild.id, 'empty')
+        elif (guild.id, 'empty') not in self._timers:
+            self._arm(guild.id, 'empty', self.empty_after)
+
+    async def _expire(self, guild_id, reason):
+        self._timers.pop((guild_id, reason), None)
+        guild = self.bot.get_guild(guild_id)
+        voice_client = guild.voice_client if guild is not None else None
+        if voice_client is None or not voice_client.is_connected():
+            return
+        # Re-check: the state may have changed since the timer was armed
+        if reason == 'idle' and voice_client.is_playing():
+            return
+        if reason == 'empty' and has_listeners(voice_client.channel):
+            return
+        logging.info(f"Leaving {voice_client.channel} in guild {guild_id}: {reason}")
+        self.forget(guild_id)
+        self.disconnects += 1
+        await voice_client.disconnect()
+        if self.on_disconnect is not None:
+            await self.on_disconnect(guild, reason)
+
+    def stats(self):
+        return {'timers': len(self._timers), 'disconnects': self.disconnects, **self.wheel.stats()}
+
+
+# Hands out voice connections and keeps them warm. An open connection is reused, or moved
+# with move_to when the user is in another channel; a new handshake is only made when
+# there is none, and concurrent commands share it. Stopping releases the connection to
+# the idle timer, so it stays open for the idle grace window instead of closing at once.
+class VoiceConnections:
+    def __init__(self, idle):
+        self.idle = idle  # IdleDisconnect that closes released connections after idle_after
+        self._connecting = {}  # guild ID -> handshake task
+        self.handshakes = deque(maxlen=100)  # Recent handshake times (seconds)
+        self.counts = {'connect': 0, 'shared': 0, 'move': 0, 'reuse': 0}
+
+    async def connect(self, channel):
+        guild = channel.guild
+        started = time.perf_counter()
+        voice_client = guild.voice_client
+        if voice_client is not None and voice_client.is_connected() and guild.id not in self._connecting:
+            if voice_client.channel == channel:
+                kind = 'reuse'
+            else:
+                kind = 'move'
+                await voice_client.move_to(channel)
+        else:
+            kind = 'shared'  # Waiting on another command's handshake
+            task = self._connecting.get(guild.id)
+            if task is None:
+                kind = 'connect'
+                task = self._connecting[guild.id] = asyncio.ensure_future(self._handshake(channel))
+                task.add_done_callback(lambda _: self._connecting.pop(guild.id, None))
+            voice_client = await asyncio.shield(task)
+        seconds = time.perf_counter() - started
+        self.counts[kind] += 1
+        if kind == 'connect':
+            self.handshakes.append(seconds)
+        metrics.voice_connect_seconds.observe(seconds, kind=kind)
+        return voice_client
+
+    async def _handshake(self, channel):
+        stale = channel.guild.voice_client
+        if stale is not None:
+            await stale.disconnect(force=True)  # Dropped by Discord but never cleaned up
+        started = time.perf_counter()
+        voice_client = await channel.connect()
+        logging.info(f"Connected to {channel} in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return voice_client
+
+    # Done with the connection for now: stop playing and leave once the idle window passes
+    def release(self, guild):
+        voice_client = guild.voice_client
+        if voice_client is None:
+            return
+        if voice_client.is_playing() or voice_client.is_paused():
+            voice_client.stop()
+        self.idle.stopped(guild)
+
+    def stats(self):
+        handshakes = sorted(self.handshakes)
+        return {
+            **self.counts,
+            'handshake_ms_mean': round(sum(handshakes) / len(handshakes) * 1000, 1) if handshakes else 0.0,
+            'handshake_ms_p95': round(handshakes[min(len(handshakes) - 1, int(len(handshakes) * 0.95))] * 1000, 1)
+            if handshakes else 0.0,
+        }
@@ -0,0 +1,291 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from logsetup import log_extraction
+
+# Option profiles; each profile gets its own pool of warm YoutubeDL objects
+PROFILES = {
+    # Classify and resolve in one pass: playlists come back flat, single videos fully resolved
+    'flat': {
+        'format': 'bestaudio',
+        'quiet': True,
+        'extract_flat': 'in_playlist',
+    },
+    # Resolve the best audio stream of a single video
+    'audio': {
+        'format': 'bestaudio',
+        'quiet': True,
+    },
+    # pyppdisbot: low-bandwidth audio, text searches allowed
+    'search': {
+        'format': 'worstaudio',
+        'noplaylist': False,
+        'nocheckcertificate': True,
+        'ignoreerrors': True,
+        'logtostderr': False,
+        'quiet': True,
+        'no_warnings': True,
+        'default_search': 'auto',
+        'source_address': '0.0.0.0',
+    },
+    # pyppdisbot: list playlist entries without resolving them
+    'playlist': {
+        'extract_flat': 'in_playlist',
+        'quiet': True,
+    },
+}
+
+# Where extraction runs: 'thread' (dedicated thread pool), 'process' (worker processes) or
+# 'inline' (on the event loop itself, which blocks it; only for measuring the other two)
+EXTRACT_BACKEND = os.getenv('EXTRACT_BACKEND', 'thread')
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', 4))
+
+# Seconds a single extraction may take before the caller gives up on it
+EXTRACT_TIMEOUT = float(os.getenv('EXTRACT_TIMEOUT', 60))
+
+# Process workers are replaced after this many jobs to contain leaks in yt-dlp. This makes
+# the pool spawn its workers, and a spawned worker imports the bot's main module again
+# (without running its __main__ block), so module-level code there must be safe to repeat
+# in a worker; setup_logging() leaves worker processes alone for this reason.
+EXTRACT_WORKER_MAX_JOBS = int(os.getenv('EXTRACT_WORKER_MAX_JOBS', 200))
+
+# A timed-out extraction may never finish, and its worker is lost until the process pool
+# is replaced. The pool is replaced once this share of its workers is stuck, or once a
+# job has been stuck for EXTRACT_STUCK_TIMEOUTS extraction timeouts.
+EXTRACT_STUCK_SHARE = float(os.getenv('EXTRACT_STUCK_SHARE', 0.5))
+EXTRACT_STUCK_TIMEOUTS = float(os.getenv('EXTRACT_STUCK_TIMEOUTS', 3))
+
+# Fields kept from yt-dlp's info dict; everything else (formats, headers, ...) is dropped
+SLIM_FIELDS = (
+    'id', 'url', 'webpage_url', 'title', 'uploader', 'duration',
+    'view_count', 'upload_date', 'thumbnail', 'extractor', 'acodec', 'playlist_count',
+)
+
+# Idle YoutubeDL objects kept per profile
+POOL_SIZE = 8
+
+# yt-dlp takes about a quarter of a second to import, so it is loaded by the first
+# extraction rather than at startup. The benchmarks put a stand-in here.
+YoutubeDL = None
+
+def _youtube_dl():
+    global YoutubeDL
+    if YoutubeDL is None:
+        from yt_dlp import YoutubeDL
+    return YoutubeDL
+
+
+# A failed extraction, with yt-dlp's message. yt-dlp's own errors are turned into this
+# so callers needn't import yt-dlp to catch them.
+class ExtractionError(Exception):
+    pass
+
+# Whether an exception is a failed extraction. yt-dlp errors can only exist once
+# yt-dlp has been imported, so it is never imported just to check.
+def is_extraction_error(error):
+    if isinstance(error, ExtractionError):
+        return True
+    utils = sys.modules.get('yt_dlp.utils')
+    return utils is not None and isinstance(error, utils.YoutubeDLError)
+
+
+# Pool of YoutubeDL objects grouped by option profile. A YoutubeDL object is not
+# safe to share between threads, so each one is lent to a single caller at a time.
+class YoutubeDLPool:
+    def __init__(self, profiles=PROFILES, size=POOL_SIZE):
+        self.profiles = profiles
+        self.size = size
+        self._idle = {name: [] for name in profiles}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    @contextmanager
+    def acquire(self, profile):
+        with self._lock:
+            idle = self._idle[profile]
+            ydl = idle.pop() if idle else None
+            if ydl is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if ydl is None:
+            ydl = _youtube_dl()(dict(self.profiles[profile]))
+            logging.info(f"Created YoutubeDL for profile '{profile}'")
+
+        try:
+            yield ydl
+        finally:
+            self._release(profile, ydl)
+
+    def _release(self, profile, ydl):
+        with self._lock:
+            idle = self._idle[profile]
+            if len(idle) < self.size:
+                idle.append(ydl)
+                return
+        ydl.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for ydl in idle:
+                    ydl.close()
+                idle.clear()
+
+    def stats(self):
+        with self._lock:
+            idle = {name: len(objs) for name, objs in self._idle.items()}
+        return {'created': self.created, 'reused': self.reused, 'idle': idle}
+
+
+# Pool shared by every bot running in this process
+ydl_pool = YoutubeDLPool()
+
+# Blocking extraction using a pooled YoutubeDL; run it in a worker thread.
+# `items` limits a playlist to a range of entries, in yt-dlp's syntax ("51-100").
+def extract_info(url, profile='audio', items=None):
+    with ydl_pool.acquire(profile) as ydl:
+        if items is None:
+            return ydl.extract_info(url, download=False)
+        ydl.params['playlist_items'] = items  # Only for this call; the object goes back to the pool
+        try:
+            return ydl.extract_info(url, download=False)
+        finally:
+            del ydl.params['playlist_items']
+
+# Reduce an info dict to a small picklable record (playlist entries included)
+def slim_info(info):
+    if info is None:
+        return None
+    record = {field: info[field] for field in SLIM_FIELDS if info.get(field) is not None}
+    if 'entries' in info:
+        record['entries'] = [slim_info(entry) for entry in info['entries'] if entry]
+    return record
+
+# Job run by every backend; returns a slim record instead of the full info dict.
+# yt-dlp errors come back as ExtractionError with the same message; they also carry
+# traceback objects that cannot be pickled back from a process worker.
+def extract_slim(url, profile='audio', items=None):
+    try:
+        return slim_info(extract_info(url, profile, items))
+    except Exception as e:
+        if is_extraction_error(e) and not isinstance(e, ExtractionError):
+            raise ExtractionError(str(e)) from None
+        raise
+
+# Process worker initializer: pay for imports and YoutubeDL construction once per worker
+def _warm_worker():
+    for profile in PROFILES:
+        with ydl_pool.acquire(profile):
+            pass
+
+
+# Runs extraction jobs off the event loop on a thread pool, a process pool, or inline
+class ExtractionBackend:
+    def __init__(self, kind=EXTRACT_BACKEND, workers=EXTRACT_WORKERS,
+                 timeout=EXTRACT_TIMEOUT, max_jobs=EXTRACT_WORKER_MAX_JOBS):
+        if kind not in ('thread', 'process', 'inline'):
+            raise ValueError(f"Unknown extraction backend: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self._executor = None
+        self._stuck = {}  # Timed-out job still running on a process worker -> when it timed out
+        self.jobs = 0
+        self.timeouts = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ytdl')
+            elif self.kind == 'process':
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_warm_worker,
+                    max_tasks_per_child=self.max_jobs,
+                )
+            logging.info(f"Started '{self.kind}' extraction backend with {self.workers} workers")
+        return self._executor
+
+    async def extract(self, url, profile='audio', items=None):
+        self.jobs += 1
+        started_at = time.perf_counter()
+        if self.kind == 'inline':
+            info = extract_slim(url, profile, items)
+            log_extraction(url, info, started_at)
+            return info
+
+        if self.kind == 'process':
+            self._check_stuck()
+        executor = self._get_executor()
+        job = executor.submit(extract_slim, url, profile, items)
+        try:
+            info = await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+            log_extraction(url, info, started_at)
+            return info
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logging.error(f"Extraction timed out after {self.timeout}s: {url}")
+            if self.kind == 'process' and job.running():
+                self._abandon(executor, job)
+            raise
+
+    # Leave a timed-out job running on its worker: killing one worker would break the whole
+    # pool and fail every other guild's extraction. A job that never finishes holds its
+    # worker for good, so the pool is replaced once too many workers are stuck or one has
+    # been stuck too long.
+    def _abandon(self, executor, job):
+        if executor is not self._executor:
+            return
+        stuck = self._stuck
+        stuck[job] = time.monotonic()
+        job.add_done_callback(lambda job: stuck.pop(job, None))
+        self._check_stuck()
+
+    def _check_stuck(self):
+        stuck_since = list(self._stuck.values())  # Jobs leave from the pool's thread as they finish
+        if not stuck_since:
+            return
+        limit = max(1, int(self.workers * EXTRACT_STUCK_SHARE))
+        oldest = time.monotonic() - min(stuck_since)
+        if len(stuck_since) >= limit or oldest > self.timeout * EXTRACT_STUCK_TIMEOUTS:
+            logging.error(f"{len(stuck_since)} of {self.workers} extraction workers are stuck, "
+                          f"the oldest for {oldest:.0f}s")
+            self._recycle()
+
+    # Swap in a fresh process pool and kill the old one's workers
+    def _recycle(self):
+        executor, self._executor = self._executor, None
+        self._stuck = {}
+        if executor is None:
+            return
+        processes = list(getattr(executor, '_processes', {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+        logging.info("Recycled extraction worker processes")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {'backend': self.kind, 'workers': self.workers, 'jobs': self.jobs, 'timeouts': self.timeouts,
+                'stuck': len(self._stuck)}
+
+
+# Backend shared by every bot running in this process
+extraction_backend = ExtractionBackend()
+
+# Extract url with the configured backend and return a slim info record
+async def extract(url, profile='audio', items=None):
+    return await extraction_backend.extract(url, profile, items)